@@ -5,7 +5,7 @@ from setuptools import setup
 setup(
     name='xstream',
     version='0.0.1',
-    packages=['xstream'],
+    packages=['xstream', 'xstream.bench'],
     package_data={
         '': ['README.md'],
     },
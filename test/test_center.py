@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import struct
+import pytest
+from xstream.center import Center, ACTION_SACK, ACTION_RESEND
+from xstream.bench.simulator import Simulator
+
+@pytest.fixture
+def simulator():
+    simulator = Simulator(connections=2, delay=0.01, bandwidth=0)
+    simulator.start()
+    simulator.run(1)
+    yield simulator
+    for session in (simulator.client_session, simulator.server_session):
+        for connection in session._connections:
+            connection._closed = True
+    simulator.stop()
+
+def capture_actions(monkeypatch, center):
+    actions = []
+    monkeypatch.setattr(center, "write_action", lambda action, data=b'', index=None, sort_ttl=True: actions.append((action, data)))
+    return actions
+
+def decode_sack(data):
+    range_count, = struct.unpack("!H", data[:2])
+    return [Center.SACK_RANGE_STRUCT.unpack_from(data, 2 + i * 6) for i in range(range_count)]
+
+def encode_sack(ranges):
+    return struct.pack("!H", len(ranges)) + b"".join([Center.SACK_RANGE_STRUCT.pack(*r) for r in ranges])
+
+def add_recv_frames(center, indexes, recv_time):
+    for index in indexes:
+        frame = center.frame_pool.frame(1, index, 0, b'')
+        frame.recv_time = recv_time
+        assert center.recv_frames.add(frame)
+
+def add_send_frames(center, connection, indexes, send_time):
+    for index in indexes:
+        frame = center.frame_pool.frame(1, index, 0, b'')
+        frame.connection = connection
+        frame.send_time = send_time
+        frame.use_connection(connection)
+        assert center.send_frames.add(frame)
+
+def test_sack_encode_gaps(simulator, monkeypatch):
+    center = simulator.server_session._center
+    actions = capture_actions(monkeypatch, center)
+    center.recv_index = 1
+    add_recv_frames(center, [3, 4, 7, 10], simulator.loop.now - 10)
+
+    center.on_ack_timeout_loop()
+    assert [action for action, _ in actions] == [ACTION_SACK]
+    assert decode_sack(actions[0][1]) == [(1, 2), (5, 2), (8, 2)]
+
+def test_sack_encode_skips_recently_received(simulator, monkeypatch):
+    center = simulator.server_session._center
+    actions = capture_actions(monkeypatch, center)
+    center.recv_index = 1
+    add_recv_frames(center, [3], simulator.loop.now - 10)
+    add_recv_frames(center, [6], simulator.loop.now)
+
+    center.on_ack_timeout_loop()
+    assert decode_sack(actions[0][1]) == [(1, 2)]
+
+    del actions[:]
+    center.on_ack_timeout_loop()
+    assert not actions
+
+def test_sack_encode_splits_long_ranges(simulator, monkeypatch):
+    center = simulator.server_session._center
+    actions = capture_actions(monkeypatch, center)
+    center.recv_index = 1
+    add_recv_frames(center, [0x10005], simulator.loop.now - 10)
+
+    center.on_ack_timeout_loop()
+    assert decode_sack(actions[0][1]) == [(1, 0xffff), (0x10000, 5)]
+
+def test_sack_encode_caps_range_count(simulator, monkeypatch):
+    center = simulator.server_session._center
+    actions = capture_actions(monkeypatch, center)
+    center.recv_index = 1
+    add_recv_frames(center, range(2, 2002, 2), simulator.loop.now - 10)
+
+    center.on_ack_timeout_loop()
+    ranges = decode_sack(actions[0][1])
+    assert len(ranges) == 964
+    assert ranges[0] == (1, 1) and ranges[-1] == (1927, 1)
+
+def test_sack_decode_partial_window(simulator, monkeypatch):
+    center = simulator.client_session._center
+    monkeypatch.setattr(center, "write_frame", lambda: None)
+    connection = simulator.client_session._connections[0]
+    center.send_frames.clear()
+    add_send_frames(center, connection, range(5, 11), simulator.loop.now - 10)
+
+    center.on_action(ACTION_SACK, encode_sack([(1, 6), (8, 1), (10, 4), (20, 3)]))
+    assert [frame.index for frame in center.frames] == [5, 6, 8, 10]
+    assert [frame.index for frame in center.send_frames] == [7, 9]
+    assert all(frame.resend_count == 1 for frame in center.frames)
+
+def test_sack_decode_ignores_ranges_outside_window(simulator, monkeypatch):
+    center = simulator.client_session._center
+    monkeypatch.setattr(center, "write_frame", lambda: None)
+    connection = simulator.client_session._connections[0]
+    center.send_frames.clear()
+    add_send_frames(center, connection, range(5, 11), simulator.loop.now - 10)
+
+    center.on_action(ACTION_SACK, encode_sack([(1, 4), (11, 0xffff)]))
+    assert not center.frames
+    assert len(center.send_frames) == 6
+
+def test_sack_decode_skips_recent_and_resent_frames(simulator, monkeypatch):
+    center = simulator.client_session._center
+    monkeypatch.setattr(center, "write_frame", lambda: None)
+    connection = simulator.client_session._connections[0]
+    center.send_frames.clear()
+    add_send_frames(center, connection, [5], simulator.loop.now - 10)
+    add_send_frames(center, connection, [6], simulator.loop.now)
+
+    center.on_action(ACTION_SACK, encode_sack([(5, 2)]))
+    assert [frame.index for frame in center.frames] == [5]
+
+    frame = center.frames.pop_first()
+    center.send_frames.add(frame)
+    center.on_action(ACTION_SACK, encode_sack([(5, 2)]))
+    assert not center.frames
+
+def test_sack_round_trip(simulator, monkeypatch):
+    server_center, client_center = simulator.server_session._center, simulator.client_session._center
+    actions = capture_actions(monkeypatch, server_center)
+    monkeypatch.setattr(client_center, "write_frame", lambda: None)
+    connection = simulator.client_session._connections[0]
+    client_center.send_frames.clear()
+    add_send_frames(client_center, connection, range(1, 9), simulator.loop.now - 10)
+    server_center.recv_index = 1
+    add_recv_frames(server_center, [2, 3, 6, 8], simulator.loop.now - 10)
+
+    server_center.on_ack_timeout_loop()
+    client_center.on_action(ACTION_SACK, actions[0][1])
+    assert [frame.index for frame in client_center.frames] == [1, 4, 5, 7]
+
+def test_recv_gap_waits_for_every_connection(simulator, monkeypatch):
+    center = simulator.server_session._center
+    actions = capture_actions(monkeypatch, center)
+    first, second = simulator.server_session._connections[:2]
+    center.recv_index = 1
+    add_recv_frames(center, [2, 3, 5], simulator.loop.now)
+
+    first._rmax_index, second._rmax_index = 5, 0
+    center.check_recv_gap()
+    assert not actions
+
+    second._rmax_index = 3
+    center.check_recv_gap()
+    assert decode_sack(actions[0][1]) == [(1, 1)]
+
+    second._rmax_index = 5
+    center.check_recv_gap()
+    assert decode_sack(actions[1][1]) == [(4, 1)]
+
+    center.check_recv_gap()
+    assert len(actions) == 2
+
+def test_recv_gap_reports_only_below_every_connection(simulator, monkeypatch):
+    center = simulator.server_session._center
+    actions = capture_actions(monkeypatch, center)
+    first, second = simulator.server_session._connections[:2]
+    center.recv_index = 1
+    add_recv_frames(center, [3, 6, 8], simulator.loop.now)
+
+    first._rmax_index, second._rmax_index = 8, 3
+    center.check_recv_gap()
+    assert decode_sack(actions[0][1]) == [(1, 2)]
+
+    second._rmax_index = 8
+    center.check_recv_gap()
+    assert decode_sack(actions[1][1]) == [(4, 2), (7, 1)]
+
+def test_sack_timeout_waits_longer_above_every_connection(simulator, monkeypatch):
+    center = simulator.server_session._center
+    actions = capture_actions(monkeypatch, center)
+    first, second = simulator.server_session._connections[:2]
+    center.recv_index = 1
+    add_recv_frames(center, [3, 6], simulator.loop.now - 2)
+
+    first._rmax_index, second._rmax_index = 6, 3
+    center.on_ack_timeout_loop()
+    assert decode_sack(actions[0][1]) == [(1, 2)]
+
+    second._rmax_index = 6
+    center.on_ack_timeout_loop()
+    assert decode_sack(actions[1][1]) == [(4, 2)]
+
+def test_sack_negotiated_per_connection(simulator):
+    for session in (simulator.client_session, simulator.server_session):
+        assert all(connection._sack for connection in session._connections)
+        assert session._center.is_sack_supported()
+
+def test_resend_fallback_without_sack(simulator, monkeypatch):
+    server_center, client_center = simulator.server_session._center, simulator.client_session._center
+    for connection in simulator.server_session._connections:
+        connection._sack = False
+    actions = capture_actions(monkeypatch, server_center)
+    monkeypatch.setattr(client_center, "write_frame", lambda: None)
+    connection = simulator.client_session._connections[0]
+    client_center.send_frames.clear()
+    add_send_frames(client_center, connection, range(1, 9), simulator.loop.now - 10)
+    server_center.recv_index = 1
+    add_recv_frames(server_center, [2, 3, 6, 8], simulator.loop.now - 10)
+
+    server_center.on_ack_timeout_loop()
+    assert [action for action, _ in actions] == [ACTION_RESEND]
+    assert struct.unpack("!5I", actions[0][1][:20]) == (4, 1, 4, 5, 7)
+    client_center.on_action(ACTION_RESEND, actions[0][1])
+    assert [frame.index for frame in client_center.frames] == [1, 4, 5, 7]
+
+def test_resend_fallback_caps_indexes(simulator, monkeypatch):
+    center = simulator.server_session._center
+    for connection in simulator.server_session._connections:
+        connection._sack = False
+    actions = capture_actions(monkeypatch, center)
+    center.write_resend([(1, 0xffff), (0x10000, 5)])
+    resend_count, = struct.unpack("!I", actions[0][1][:4])
+    assert resend_count == Center.MAX_RESEND_INDEXES
+    assert struct.unpack_from("!I", actions[0][1], 4 * resend_count)[0] == Center.MAX_RESEND_INDEXES
+
+def test_ttl_timeout_backs_off_rto_without_sample(simulator):
+    center = simulator.server_session._center
+    center.rtt.update(0.1)
+    srtt, rttvar, rto, sample_count = center.rtt.srtt, center.rtt.rttvar, center.rtt.rto, center.rtt.sample_count
+    center.ttl_changing = True
+    center.on_ttl_timeout()
+    assert not center.ttl_changing
+    assert (center.rtt.srtt, center.rtt.rttvar, center.rtt.sample_count) == (srtt, rttvar, sample_count)
+    assert center.rtt.rto == min(rto * 2, center.rtt.MAX_RTO)
+
+    center.ttl_changing, ttl_index = True, center.ttl_index
+    center.write_ttl()
+    assert center.rtt.rto == min(rto * 4, center.rtt.MAX_RTO)
+    assert center.ttl_index == ttl_index + 1
+
+    center.on_ttl_ack(100)
+    assert center.rtt.rto < rto * 2
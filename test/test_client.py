@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+from xstream.client import ConnectionAutoscaler, RAMP_UP_RATE
+
+def test_autoscaler_floor_does_not_grow_without_demand():
+    autoscaler = ConnectionAutoscaler(4, 4)
+    for now in range(1, 10):
+        assert autoscaler.update(now, 0, [], 0.05, 1, False) == 0
+    assert autoscaler.target == 4
+    assert autoscaler.action == ""
+
+def test_autoscaler_grows_on_goodput():
+    autoscaler = ConnectionAutoscaler(1, 8)
+    assert autoscaler.update(1, RAMP_UP_RATE * 3, [RAMP_UP_RATE], 0.05, 1, False) == 3
+    assert autoscaler.target == 4 and autoscaler.action == "grow"
+    assert autoscaler.update(2, RAMP_UP_RATE * 3, [RAMP_UP_RATE], 0.05, 2, False) == 2
+
+def test_autoscaler_shrinks_to_floor_when_idle():
+    autoscaler = ConnectionAutoscaler(1, 4)
+    for now in range(1, ConnectionAutoscaler.SHRINK_CHECK_COUNT):
+        assert autoscaler.update(now, 0, [], 0.05, 3, False) == 0
+    assert autoscaler.update(ConnectionAutoscaler.SHRINK_CHECK_COUNT, 0, [], 0.05, 3, False) == -1
+    assert autoscaler.target == 1 and autoscaler.action == "shrink"
+
+def test_autoscaler_ramps_up_only_near_connection_rate():
+    autoscaler = ConnectionAutoscaler(1, 8)
+    assert autoscaler.is_ramp_up(0, 2, True)
+    assert autoscaler.is_ramp_up(RAMP_UP_RATE * 2, 2, False)
+    assert not autoscaler.is_ramp_up(RAMP_UP_RATE * 1.8, 2, False)
+    assert autoscaler.update(1, RAMP_UP_RATE * 1.8, [RAMP_UP_RATE], 0.05, 2, False) == 1
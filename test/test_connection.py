@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import time
+import struct
+import pytest
+from sevent import Buffer, tcp
+from xstream import clock
+from xstream import connection as connection_module
+from xstream import crypto as crypto_module
+from xstream.crypto import Crypto, AEAD_ALGS, AEAD_TAG_LEN
+from xstream.connection import Connection, ACTION_BATCH, ACTION_AEAD_READY
+from xstream.frame import Frame, StreamFrame, FramePool
+from xstream.bench.simulator import Simulator, VirtualLink
+
+class PairSession(object):
+    def __init__(self):
+        self._frame_pool = FramePool()
+        self._center = None
+
+class LegacyCrypto(object):
+    def __init__(self, crypto):
+        self.encrypt_into = crypto.encrypt_into
+        self.decrypt_into = crypto.decrypt_into
+
+class ConnectionPair(object):
+    def __init__(self, simulator, client_crypto=None, server_crypto=None):
+        self.simulator = simulator
+        self.link = VirtualLink(simulator, 1, int(simulator.loop.now))
+        if client_crypto is not None:
+            self.link.client_socket.crypto = client_crypto
+        if server_crypto is not None:
+            self.link.server_socket.crypto = server_crypto
+        self.records = []
+        self.link.on_write = lambda socket, data: self.records.append((socket.address[0], data))
+        self.client = Connection(self.link.client_socket, PairSession())
+        self.server = Connection(self.link.server_socket, PairSession())
+        self.client_frames, self.server_frames = [], []
+        self.client.on("frame", lambda connection, frame: self.client_frames.append(self.dump_frame(frame)))
+        self.server.on("frame", lambda connection, frame: self.server_frames.append(self.dump_frame(frame)))
+
+    def dump_frame(self, frame):
+        if frame.data.__class__ == StreamFrame:
+            return frame.action, frame.index, frame.ack, frame.data.stream_id, frame.data.index, bytes(frame.data.data)
+        return frame.action, frame.index, frame.ack, bytes(frame.data)
+
+    def run(self, seconds=0.1):
+        self.simulator.run(seconds)
+
+    def close(self):
+        self.client._closed = self.server._closed = True
+
+@pytest.fixture
+def create_pair(monkeypatch):
+    simulator, pairs = Simulator(connections=0, delay=0.001, bandwidth=0), []
+    clock.install(simulator.loop.time, lambda: simulator.loop)
+
+    def create_pair(batch_size=0, aead_alg="", **kwargs):
+        monkeypatch.setattr(connection_module, "BATCH_WRITE_SIZE", batch_size)
+        monkeypatch.setattr(connection_module, "AEAD_ALG", aead_alg)
+        pair = ConnectionPair(simulator, **kwargs)
+        pairs.append(pair)
+        pair.run()
+        return pair
+
+    yield create_pair
+    for pair in pairs:
+        pair.close()
+    simulator.stop()
+
+def create_stream_frame(index, data):
+    return Frame(0, index, 0, StreamFrame(1, 0, index, data))
+
+def get_records(pair, side="client"):
+    return [data for address, data in pair.records if address == side]
+
+def create_crypto_pair(monkeypatch):
+    get_evp, get_aead, rand_string, sign_string, bytes_to_key_digest = crypto_module.get_openssl()
+    monkeypatch.setattr(crypto_module, "get_evp", get_evp)
+    monkeypatch.setattr(crypto_module, "get_aead", get_aead)
+    monkeypatch.setattr(crypto_module, "bytes_to_key_digest", bytes_to_key_digest)
+    monkeypatch.setattr(crypto_module, "_aead_supported", {})
+    client_crypto, server_crypto = Crypto("test"), Crypto("test")
+    crypto_time = int(time.time())
+    server_crypto.init_decrypt(crypto_time, client_crypto.init_encrypt(crypto_time))
+    client_crypto.init_decrypt(crypto_time, server_crypto.init_encrypt(crypto_time))
+    return client_crypto, server_crypto
+
+def feed_records(connection, records):
+    buffer = Buffer()
+    buffer.write(b"".join(records))
+    connection.on_data(connection._connection, buffer)
+
+def test_batch_ready_negotiates_smaller_size(create_pair):
+    pair = create_pair(4096)
+    assert pair.client._wbatch_size == 4096
+    assert pair.server._wbatch_size == 4096
+
+    pair = create_pair(0)
+    assert pair.client._wbatch_size == 0
+    assert pair.server._wbatch_size == 0
+
+def test_batch_frames_in_one_record(create_pair):
+    pair = create_pair(4096)
+    pair.records[:] = []
+    payloads = [os.urandom(100 + i) for i in range(8)]
+    for i, payload in enumerate(payloads):
+        assert pair.client.write(create_stream_frame(i + 1, payload))
+    assert not pair.records
+    pair.run()
+
+    records = get_records(pair)
+    assert len(records) == 1
+    assert records[0][5] == ACTION_BATCH
+    assert pair.server_frames == [(0, i + 1, 0, 1, i + 1, payload) for i, payload in enumerate(payloads)]
+
+def test_batch_single_frame_record_has_no_batch_header(create_pair):
+    pair = create_pair(4096)
+    pair.records[:] = []
+    payload = os.urandom(200)
+    pair.client.write(create_stream_frame(1, payload))
+    pair.run()
+
+    records = get_records(pair)
+    assert len(records) == 1
+    assert records[0][5] == 0
+    assert struct.unpack("!H", records[0][3:5])[0] == len(payload) + 17
+    assert pair.server_frames == [(0, 1, 0, 1, 1, payload)]
+
+def test_batch_fills_exactly_to_size(create_pair):
+    batch_size = 4096
+    pair = create_pair(batch_size)
+    pair.records[:] = []
+    frame_len = (batch_size // 4) - 2
+    payloads = [os.urandom(frame_len - 17) for _ in range(4)]
+    for i, payload in enumerate(payloads):
+        pair.client.write(create_stream_frame(i + 1, payload))
+    pair.run()
+
+    records = get_records(pair)
+    assert len(records) == 1
+    assert struct.unpack("!H", records[0][3:5])[0] == batch_size + 1
+    assert [frame[-1] for frame in pair.server_frames] == payloads
+
+def test_batch_flushes_when_next_frame_overflows(create_pair):
+    batch_size = 4096
+    pair = create_pair(batch_size)
+    pair.records[:] = []
+    payloads = [os.urandom(1500) for _ in range(3)]
+    for i, payload in enumerate(payloads):
+        pair.client.write(create_stream_frame(i + 1, payload))
+    pair.run()
+
+    records = get_records(pair)
+    assert len(records) == 2
+    assert all(struct.unpack("!H", record[3:5])[0] <= batch_size + 1 for record in records)
+    assert [frame[-1] for frame in pair.server_frames] == payloads
+
+def test_batch_oversized_frame_bypasses_batch(create_pair):
+    batch_size = 4096
+    pair = create_pair(batch_size)
+    pair.records[:] = []
+    small, large = os.urandom(100), os.urandom(batch_size)
+    pair.client.write(create_stream_frame(1, small))
+    pair.client.write(create_stream_frame(2, large))
+    pair.run()
+
+    records = get_records(pair)
+    assert len(records) == 2
+    assert struct.unpack("!H", records[1][3:5])[0] == len(large) + 17
+    assert [frame[-1] for frame in pair.server_frames] == [small, large]
+
+def test_batch_max_size_fits_record_length(create_pair):
+    pair = create_pair(0xffe0)
+    pair.records[:] = []
+    payloads = [os.urandom(0xffe0 // 4 - 2 - 17) for _ in range(8)]
+    for i, payload in enumerate(payloads):
+        pair.client.write(create_stream_frame(i + 1, payload))
+    pair.run()
+
+    records = get_records(pair)
+    assert [struct.unpack("!H", record[3:5])[0] for record in records] == [0xffe1, 0xffe1]
+    assert [frame[-1] for frame in pair.server_frames] == payloads
+
+def test_batch_record_split_across_reads(create_pair):
+    pair = create_pair(4096)
+    payloads = [os.urandom(300) for _ in range(4)]
+    for i, payload in enumerate(payloads):
+        pair.client.write(create_stream_frame(i + 1, payload))
+    pair.records[:] = []
+    pair.client.flush_batch()
+    record = get_records(pair)[0]
+    assert record[5] == ACTION_BATCH
+
+    buffer = Buffer()
+    for start, end in ((0, 3), (3, 700), (700, len(record))):
+        buffer.write(record[start:end])
+        pair.server.on_data(pair.link.server_socket, buffer)
+    assert [frame[-1] for frame in pair.server_frames] == payloads
+
+def test_aead_negotiated_when_both_sides_support(create_pair, monkeypatch):
+    client_crypto, server_crypto = create_crypto_pair(monkeypatch)
+    pair = create_pair(aead_alg="aes_256_gcm", client_crypto=client_crypto, server_crypto=server_crypto)
+    assert pair.client._waead and pair.client._raead
+    assert pair.server._waead and pair.server._raead
+
+    pair.records[:] = []
+    payload = os.urandom(300)
+    pair.client.write(create_stream_frame(1, payload))
+    pair.server.write(create_stream_frame(1, payload))
+    pair.run()
+    assert [struct.unpack("!H", record[3:5])[0] for record in get_records(pair)] == [len(payload) + 17 + AEAD_TAG_LEN]
+    assert pair.server_frames == [(0, 1, 0, 1, 1, payload)]
+    assert pair.client_frames == [(0, 1, 0, 1, 1, payload)]
+
+def test_aead_falls_back_when_one_side_unsupported(create_pair, monkeypatch):
+    client_crypto, server_crypto = create_crypto_pair(monkeypatch)
+    pair = create_pair(aead_alg="aes_256_gcm", client_crypto=client_crypto, server_crypto=LegacyCrypto(server_crypto))
+    assert not pair.client._waead and not pair.client._raead
+    assert not pair.server._waead and not pair.server._raead
+
+    pair.records[:] = []
+    payload = os.urandom(300)
+    pair.client.write(create_stream_frame(1, payload))
+    pair.server.write(create_stream_frame(1, payload))
+    pair.run()
+    assert [struct.unpack("!H", record[3:5])[0] for record in get_records(pair)] == [len(payload) + 17]
+    assert pair.server_frames == [(0, 1, 0, 1, 1, payload)]
+    assert pair.client_frames == [(0, 1, 0, 1, 1, payload)]
+
+def test_aead_rejects_tampered_tag(create_pair, monkeypatch):
+    client_crypto, server_crypto = create_crypto_pair(monkeypatch)
+    pair = create_pair(aead_alg="aes_256_gcm", client_crypto=client_crypto, server_crypto=server_crypto)
+    pair.records[:] = []
+    pair.client.write(create_stream_frame(1, os.urandom(300)))
+    record = bytearray(get_records(pair)[0])
+    record[-1] ^= 0x01
+
+    feed_records(pair.server, [bytes(record)])
+    assert pair.link.server_socket._state == tcp.STATE_CLOSED
+    assert not pair.server_frames
+
+def test_aead_record_in_same_read_as_start(create_pair, monkeypatch):
+    client_crypto, server_crypto = create_crypto_pair(monkeypatch)
+    pair = create_pair(client_crypto=client_crypto, server_crypto=server_crypto)
+    pair.records[:] = []
+    payload = os.urandom(300)
+    pair.server.on_action(ACTION_AEAD_READY, struct.pack("!B", AEAD_ALGS.index("aes_256_gcm")))
+    pair.server.write(create_stream_frame(1, payload))
+    assert pair.server._waead and not pair.client._raead
+
+    feed_records(pair.client, get_records(pair, "server"))
+    assert pair.client._raead
+    assert pair.client_frames == [(0, 1, 0, 1, 1, payload)]
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import json
+import pytest
+from xstream import crypto
+from xstream.openssl import OpenSSLCrypto, OpenSSLAEADCrypto, AEAD_TAG_LEN
+
+def test_update_into_checks_buffer_len():
+    encipher = OpenSSLCrypto("aes-256-cfb", b"\x01" * 32, b"\x02" * 16, 1)
+    decipher = OpenSSLCrypto("aes-256-cfb", b"\x01" * 32, b"\x02" * 16, 0)
+    data = os.urandom(1000)
+    with pytest.raises(Exception):
+        encipher.update_into(data, bytearray(len(data)))
+
+    buf, out = bytearray(len(data) + 16), bytearray(len(data) + 16)
+    data_len = encipher.update_into(data, buf)
+    assert decipher.update_into(buf[:data_len], out) == len(data)
+    assert out[:len(data)] == data
+
+def test_aead_encrypt_into_checks_buffer_len():
+    encipher = OpenSSLAEADCrypto("aes-256-gcm", b"\x01" * 32, 1)
+    data = os.urandom(1000)
+    with pytest.raises(Exception):
+        encipher.encrypt_into(b"\x00" * 12, data, bytearray(len(data) + AEAD_TAG_LEN))
+    assert encipher.encrypt_into(b"\x00" * 12, data, bytearray(len(data) + AEAD_TAG_LEN + 16)) == len(data) + AEAD_TAG_LEN
+
+def test_auto_backend_benchmarks_configured_alg_lazily(tmpdir, monkeypatch):
+    monkeypatch.delenv("XSTREAM_CRYPTO_CACHE", raising=False)
+    monkeypatch.setattr(crypto, "CRYPTO_BACKEND", "auto")
+    monkeypatch.setattr(crypto, "CRYPTO_BACKEND_STATS", {"backend": "auto", "mode": "auto", "algs": {}})
+    monkeypatch.setattr(crypto, "_alg_backends", {})
+    monkeypatch.chdir(str(tmpdir))
+    session_path = str(tmpdir.join("session_path"))
+
+    crypto.load_crypto_backend("aes_128_ctr", session_path)
+    assert list(crypto.CRYPTO_BACKEND_STATS["algs"]) == ["aes_128_ctr"]
+    assert not crypto.CRYPTO_BACKEND_STATS["algs"]["aes_128_ctr"]["cached"]
+    with open(os.path.join(session_path, "crypto_backend"), encoding="utf-8") as fp:
+        assert [entry["alg"] for entry in json.load(fp).values()] == ["aes_128_ctr"]
+    assert not os.path.exists(str(tmpdir.join("session")))
+
+    monkeypatch.setattr(crypto, "_alg_backends", {})
+    crypto.load_crypto_backend("aes_128_ctr", session_path)
+    assert crypto.CRYPTO_BACKEND_STATS["algs"]["aes_128_ctr"]["cached"]
+    assert crypto.get_auto_evp("aes_128_ctr", b"\x01" * 16, b"\x02" * 16, 1) is not None
+
+def test_cryptography_backend_update_into():
+    pytest.importorskip("cryptography")
+    get_evp, get_aead, rand_string, sign_string, bytes_to_key_digest = crypto.get_cryptography()
+    encipher = get_evp("aes_256_cfb", b"\x01" * 32, b"\x02" * 16, 1)
+    decipher = get_evp("aes_256_cfb", b"\x01" * 32, b"\x02" * 16, 0)
+    data = os.urandom(1000)
+    with pytest.raises(Exception):
+        encipher.update_into(data, bytearray(len(data)))
+
+    buf, out = bytearray(len(data) + 16), bytearray(len(data) + 16)
+    data_len = encipher.update_into(memoryview(data), memoryview(buf))
+    assert decipher.update(bytes(buf[:data_len])) == data
+    assert encipher.update(data) != data
+
+    digest = bytes_to_key_digest()
+    digest.update(b"xstream")
+    assert len(digest.digest()) == 20
+    assert len(sign_string(b"xstream")) == 16
+
+def test_cryptography_backend_aead_into():
+    pytest.importorskip("cryptography")
+    get_aead = crypto.get_cryptography()[1]
+    encipher, decipher = get_aead("aes_256_gcm", b"\x01" * 32, 1), get_aead("aes_256_gcm", b"\x01" * 32, 0)
+    data = os.urandom(1000)
+    buf, out = bytearray(len(data) + 64), bytearray(len(data) + 64)
+    data_len = encipher.encrypt_into(b"\x00" * 12, memoryview(data), memoryview(buf)[5:])
+    assert data_len == len(data) + AEAD_TAG_LEN
+    assert decipher.decrypt_into(b"\x00" * 12, memoryview(buf)[5:5 + data_len], out) == len(data)
+    assert out[:len(data)] == data
+
+    buf[5 + data_len - 1] ^= 0x01
+    assert decipher.decrypt_into(b"\x00" * 12, memoryview(buf)[5:5 + data_len], out) == -1
+
+def test_auto_backend_cache_defaults_outside_cwd(tmpdir, monkeypatch):
+    for name in ("XSTREAM_CRYPTO_CACHE", "SESSION_PATH"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir.join("cache")))
+    monkeypatch.setattr(crypto, "CRYPTO_BACKEND", "auto")
+    monkeypatch.setattr(crypto, "CRYPTO_BACKEND_STATS", {"backend": "auto", "mode": "auto", "algs": {}})
+    monkeypatch.setattr(crypto, "_alg_backends", {})
+    monkeypatch.chdir(str(tmpdir))
+
+    assert crypto.get_auto_evp("aes_128_ctr", b"\x01" * 16, b"\x02" * 16, 1) is not None
+    assert os.path.exists(str(tmpdir.join("cache", "xstream", "crypto_backend")))
+    assert not os.path.exists(str(tmpdir.join("session")))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+from xstream.frame import Frame, FrameWindow, FramePool
+
+def create_frames(indexes):
+    return [Frame(1, index, 0, b'') for index in indexes]
+
+def test_window_wraps_around_slots():
+    window = FrameWindow(8)
+    for frame in create_frames(range(5, 13)):
+        assert window.add(frame)
+    assert len(window.slots) == 8
+    assert [frame.index for frame in window] == list(range(5, 13))
+
+    assert [frame.index for frame in window.pop_until(8)] == [5, 6, 7, 8]
+    for frame in create_frames(range(13, 17)):
+        assert window.add(frame)
+    assert len(window.slots) == 8
+    assert (window.start, window.end, len(window)) == (9, 17, 8)
+    assert [window.get(index).index for index in range(9, 17)] == list(range(9, 17))
+    assert window.get(8) is None and window.get(17) is None
+
+def test_window_rejects_duplicates():
+    window = FrameWindow(8)
+    frame, duplicate = create_frames([3, 3])
+    assert window.add(frame)
+    assert not window.add(duplicate)
+    assert window.get(3) is frame and len(window) == 1
+
+def test_window_resize_keeps_frames():
+    window = FrameWindow(8)
+    for frame in create_frames([6, 7, 8, 9]):
+        assert window.add(frame)
+    assert window.add(create_frames([30])[0])
+    assert len(window.slots) >= 2 * (31 - 6)
+    assert [frame.index for frame in window] == [6, 7, 8, 9, 30]
+    assert window.get(10) is None and window.get(30).index == 30
+
+    assert window.add(create_frames([2])[0])
+    assert (window.start, window.end) == (2, 31)
+    assert [frame.index for frame in window] == [2, 6, 7, 8, 9, 30]
+
+def test_window_max_size():
+    window = FrameWindow(8, max_size=16)
+    assert window.add(create_frames([0])[0])
+    assert window.add(create_frames([15])[0])
+    assert not window.add(create_frames([16])[0])
+    assert (window.start, window.end, len(window)) == (0, 16, 2)
+
+def test_window_pop_until_skips_gaps():
+    window = FrameWindow(8)
+    for frame in create_frames([1, 2, 4, 7, 9]):
+        assert window.add(frame)
+    assert [frame.index for frame in window.pop_until(5)] == [1, 2, 4]
+    assert window.first().index == 7 and window.start == 7
+    assert window.pop_until(6) == []
+
+    assert window.remove(9).index == 9
+    assert (window.start, window.end) == (7, 8)
+    assert [frame.index for frame in window.pop_until(100)] == [7]
+    assert (window.start, window.end, len(window)) == (0, 0, 0)
+    assert window.first() is None and window.pop_first() is None
+
+def test_pool_reuse_resets_frame_fields():
+    frame_pool = FramePool()
+    stream_frame = frame_pool.stream_frame(3, 0x01, 7, b'data')
+    stream_frame.send_time, stream_frame.recv_time = 1, 2
+    frame = frame_pool.frame(0, 11, 5, stream_frame, connection=object())
+    frame.use_connection(object())
+    frame.send_time = frame.recv_time = frame.ack_time = frame.resend_time = 10
+    frame.resend_count, frame.send_timeout_count = 2, 3
+    frame_pool.release(frame)
+    assert frame.data is None and frame.connection is None
+    assert stream_frame.data is None
+
+    reused_stream_frame = frame_pool.stream_frame(5, 0x02, 1, b'next')
+    reused_frame = frame_pool.frame(1, 12, 6, b'action')
+    assert reused_frame is frame and reused_stream_frame is stream_frame
+    assert frame_pool.reused_count == 2 and frame_pool.frame_count == 1 and frame_pool.stream_frame_count == 1
+    assert (reused_stream_frame.stream_id, reused_stream_frame.flag, reused_stream_frame.index, reused_stream_frame.data) == (5, 0x02, 1, b'next')
+    assert (reused_stream_frame.send_time, reused_stream_frame.recv_time) == (0, 0)
+    assert (reused_frame.action, reused_frame.index, reused_frame.ack, reused_frame.data) == (1, 12, 6, b'action')
+    assert reused_frame.connection is None and reused_frame.used_connections is None
+    assert (reused_frame.send_time, reused_frame.recv_time, reused_frame.ack_time, reused_frame.resend_time) == (0, 0, 0, 0)
+    assert (reused_frame.resend_count, reused_frame.send_timeout_count) == (0, 0)
+    assert reused_frame.has_unused_connection({id(object())})
+
+def test_pool_release_keeps_shared_stream_frame():
+    frame_pool = FramePool()
+    stream_frame = frame_pool.stream_frame(3, 0x01, 7, b'data')
+    frame_pool.release(frame_pool.frame(0, 11, 5, stream_frame), False)
+    assert stream_frame.data == b'data'
+    assert frame_pool.stream_frame(5, 0x01, 1, b'next') is not stream_frame
+
+def test_pool_max_size():
+    frame_pool = FramePool(max_size=2)
+    frames = [frame_pool.frame(1, index, 0, b'') for index in range(3)]
+    for frame in frames:
+        frame_pool.release(frame)
+    assert len(frame_pool.frames) == 2
+    assert frames[2].data == b''
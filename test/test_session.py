@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import pytest
+from xstream.session import Session
+from xstream.bench.simulator import Simulator
+
+@pytest.fixture
+def session():
+    simulator = Simulator(connections=0)
+    simulator.start()
+    yield simulator.server_session
+    simulator.stop()
+
+def test_fork_auth_times_accept_out_of_order(session):
+    now = 1700000000
+    for crypto_time in (now + 2, now, now + 3, now + 1):
+        assert session.is_fresh_auth_time(crypto_time)
+        session.set_last_auth_time(crypto_time)
+    assert session.get_last_auth_time() == now + 3
+
+def test_fork_auth_times_reject_replay(session):
+    now = 1700000000
+    session.set_last_auth_time(now)
+    session.set_last_auth_time(now - 5)
+    assert not session.is_fresh_auth_time(now)
+    assert not session.is_fresh_auth_time(now - 5)
+    assert session.is_fresh_auth_time(now - 4)
+
+def test_fork_auth_times_reject_outside_window(session):
+    now = 1700000000
+    session.set_last_auth_time(now - Session.AUTH_TIME_WINDOW)
+    session.set_last_auth_time(now)
+    assert not session.is_fresh_auth_time(now - Session.AUTH_TIME_WINDOW)
+    assert session.is_fresh_auth_time(now - Session.AUTH_TIME_WINDOW + 1)
+    assert session._auth_times == {now}
+
+def test_fork_auth_times_persist(session):
+    now = 1700000000
+    session.set_last_auth_time(now)
+    session.set_last_auth_time(now - 3)
+    fork_crypto_time = session.get_fork_crypto_time()
+
+    loaded = Session.loads(session.dumps())
+    assert not loaded.is_fresh_auth_time(now)
+    assert not loaded.is_fresh_auth_time(now - 3)
+    assert loaded.is_fresh_auth_time(now - 2)
+    assert loaded.get_fork_crypto_time() > fork_crypto_time
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import pytest
+from xstream import clock
+from xstream.timer import TimerWheel
+from xstream.bench.simulator import VirtualLoop
+
+@pytest.fixture
+def loop():
+    loop = VirtualLoop()
+    clock.install(loop.time, lambda: loop)
+    yield loop
+    clock.install()
+
+def test_timer_wheel_fires_in_order_across_turns(loop):
+    timer_wheel = TimerWheel(loop, tick=0.1, size=8)
+    fired = []
+    start_time = loop.time()
+    for timeout in (2.05, 0.35, 1.15, 0.95, 0.36, 3.3):
+        timer_wheel.add_timeout(timeout, lambda timeout: fired.append((timeout, loop.time() - start_time)), timeout)
+
+    loop.run(5)
+    assert [timeout for timeout, _ in fired] == [0.35, 0.36, 0.95, 1.15, 2.05, 3.3]
+    for timeout, fire_time in fired:
+        assert timeout <= fire_time + 1e-6 < timeout + timer_wheel.tick * 2
+    assert timer_wheel.count == 0 and timer_wheel.timer is None
+
+def test_timer_wheel_keeps_later_turns_in_shared_slot(loop):
+    timer_wheel = TimerWheel(loop, tick=0.1, size=8)
+    fired = []
+    timer_wheel.add_timeout(0.3, fired.append, "first")
+    timer_wheel.add_timeout(0.3 + 0.8 * 2, fired.append, "third")
+    timer_wheel.add_timeout(0.3 + 0.8, fired.append, "second")
+
+    loop.run(0.5)
+    assert fired == ["first"]
+    loop.run(0.8)
+    assert fired == ["first", "second"]
+    loop.run(1)
+    assert fired == ["first", "second", "third"]
+
+def test_timer_wheel_cancel(loop):
+    timer_wheel = TimerWheel(loop, tick=0.1, size=8)
+    fired = []
+    handler = timer_wheel.add_timeout(0.5, fired.append, "canceled")
+    timer_wheel.add_timeout(1.5, fired.append, "kept")
+    timer_wheel.cancel_timeout(handler)
+    timer_wheel.cancel_timeout(handler)
+    assert handler.canceled and timer_wheel.count == 1
+
+    loop.run(2)
+    assert fired == ["kept"]
+    assert timer_wheel.count == 0
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
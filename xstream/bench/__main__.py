@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+from .loopback import main
+
+if __name__ == "__main__":
+    main()
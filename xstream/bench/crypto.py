@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import sys
+import time
+import json
+import argparse
+from .. import crypto
+
+def get_cipher(get_backend, alg):
+    key_len, iv_len = crypto.ALG_KEY_IV_LEN[alg]
+    get_evp = get_backend()[0]
+    cipher = get_evp(alg, os.urandom(key_len), os.urandom(iv_len), 1)
+    if cipher is None:
+        raise Exception("unsupported alg %s" % alg)
+    return cipher
+
+def measure(cipher, size, total_bytes):
+    data = os.urandom(size)
+    buf = bytearray(size + 64)
+    view = memoryview(buf)[5:]
+    count = max(total_bytes // size, 1)
+    result = {}
+
+    start_time = time.perf_counter()
+    for _ in range(count):
+        cipher.update(data)
+    run_time = time.perf_counter() - start_time
+    result["update_us"] = run_time / count * 1000000
+    result["update_mbps"] = size * count / run_time / 1048576
+
+    if hasattr(cipher, "update_into"):
+        start_time = time.perf_counter()
+        for _ in range(count):
+            cipher.update_into(data, view)
+        run_time = time.perf_counter() - start_time
+        result["update_into_us"] = run_time / count * 1000000
+        result["update_into_mbps"] = size * count / run_time / 1048576
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream crypto backend update/update_into benchmark")
+    parser.add_argument("--alg", default="aes_256_cfb")
+    parser.add_argument("--sizes", default="64,1024,16384,65536")
+    parser.add_argument("--bytes", type=int, default=64 * 1024 * 1024, help="bytes encrypted per size")
+    parser.add_argument("--backends", default=",".join(name for name, _ in crypto.CRYPTO_BACKENDS))
+    args = parser.parse_args(argv)
+
+    backends = args.backends.split(",")
+    results = {}
+    for name, get_backend in crypto.CRYPTO_BACKENDS:
+        if name not in backends:
+            continue
+        try:
+            cipher = get_cipher(get_backend, args.alg)
+            cipher.update(b"\x00" * 16)
+        except Exception as e:
+            results[name] = {"error": "%s: %s" % (e.__class__.__name__, e)}
+            continue
+        results[name] = {size: measure(cipher, int(size), args.bytes) for size in args.sizes.split(",")}
+    json.dump({"alg": args.alg, "backends": results}, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import sys
+import gc
+import time
+import json
+import argparse
+import tracemalloc
+from collections import deque
+from ..frame import Frame, StreamFrame, FramePool
+
+class DictFrame(object):
+    def __init__(self, action, index, ack, data, connection=None):
+        self.action = action
+        self.index = index
+        self.ack = ack
+        self.data = data
+        self.connection = connection
+        self.used_connections = set([])
+        self.send_time = 0
+        self.recv_time = 0
+        self.ack_time = 0
+        self.resend_time = 0
+        self.resend_count = 0
+        self.send_timeout_count = 0
+
+class DictStreamFrame(object):
+    def __init__(self, stream_id, flag, index, data):
+        self.stream_id = stream_id
+        self.flag = flag
+        self.index = index
+        self.data = data
+        self.send_time = 0
+        self.recv_time = 0
+
+def run_dict(count, window, data):
+    frames = deque()
+    for i in range(count):
+        frames.append(DictFrame(0, i + 1, i, DictStreamFrame(1, 1, i + 1, data)))
+        if len(frames) > window:
+            frames.popleft()
+
+def run_slots(count, window, data):
+    frames = deque()
+    for i in range(count):
+        frames.append(Frame(0, i + 1, i, StreamFrame(1, 1, i + 1, data)))
+        if len(frames) > window:
+            frames.popleft()
+
+def run_pool(count, window, data):
+    frame_pool = FramePool()
+    frames = deque()
+    for i in range(count):
+        frames.append(frame_pool.frame(0, i + 1, i, frame_pool.stream_frame(1, 1, i + 1, data)))
+        if len(frames) > window:
+            frame_pool.release(frames.popleft())
+
+def measure(func, count, window, data):
+    tracemalloc.start()
+    func(window * 2, window, data)
+    _, peak_size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    gc_collections = sum(stat["collections"] for stat in gc.get_stats())
+    start_time = time.perf_counter()
+    func(count, window, data)
+    run_time = time.perf_counter() - start_time
+    return {
+        "peak_bytes": peak_size,
+        "frame_bytes": float(peak_size) / window,
+        "gc_collections": sum(stat["collections"] for stat in gc.get_stats()) - gc_collections,
+        "frames_per_second": count / run_time,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream frame allocation benchmark")
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument("--window", type=int, default=4096)
+    args = parser.parse_args(argv)
+
+    data = b"x" * 1400
+    results = {}
+    for name, func in (("dict", run_dict), ("slots", run_slots), ("pool", run_pool)):
+        results[name] = measure(func, args.count, args.window, data)
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
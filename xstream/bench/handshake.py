@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+import sevent
+from sevent import current
+
+def run_server(args):
+    from ..server import Server
+
+    loop = sevent.instance()
+    sessions, state = [], {"start_time": 0, "cpu_time": 0}
+    count = args.clients * args.connections
+
+    def on_session(server, session):
+        if not state["start_time"]:
+            state["start_time"], state["cpu_time"] = time.time(), time.process_time()
+        sessions.append(session)
+
+    def on_check(start_time):
+        accepted = sum(len(session._connections) for session in sessions)
+        if accepted < count and time.time() - start_time < args.timeout:
+            return current().add_timeout(0.01, on_check, start_time)
+        seconds = max(time.time() - (state["start_time"] or start_time), 0.000001)
+        cpu_seconds = time.process_time() - (state["cpu_time"] or 0)
+        json.dump({
+            "clients": args.clients,
+            "connections": args.connections,
+            "sessions": len(sessions),
+            "accepted": accepted,
+            "seconds": seconds,
+            "connections_per_second": accepted / seconds,
+            "cpu_per_connection_ms": cpu_seconds / max(accepted, 1) * 1000,
+        }, sys.stdout)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+        os._exit(0)
+
+    session_path = tempfile.mkdtemp()
+    os.environ["SESSION_PATH"] = session_path
+    try:
+        server = Server(args.port, "127.0.0.1", crypto_key="bench", crypto_alg=args.crypto_alg)
+        server.on("session", on_session)
+        server.start()
+        current().add_timeout(0.01, on_check, time.time())
+        loop.start()
+    finally:
+        shutil.rmtree(session_path, True)
+
+def run_clients(args):
+    from ..client import Client
+
+    class BenchClient(Client):
+        def __init__(self, session_path, *args, **kwargs):
+            super(BenchClient, self).__init__(*args, **kwargs)
+            self._bench_session_path = session_path
+
+        def get_session_path(self):
+            return self._bench_session_path
+
+    loop = sevent.instance()
+    argv = [sys.executable, "-m", "xstream.bench.handshake", "--run", "server"]
+    for key in ("clients", "connections", "port", "crypto_alg", "timeout"):
+        argv.extend(["--" + key.replace("_", "-"), str(getattr(args, key))])
+    server = subprocess.Popen(argv, stdout=subprocess.PIPE)
+    session_path = tempfile.mkdtemp()
+    clients = []
+
+    def on_start():
+        for i in range(args.clients):
+            client = BenchClient(os.path.join(session_path, str(i)), "127.0.0.1", args.port, max_connections=args.connections,
+                                 crypto_key="bench", crypto_alg=args.crypto_alg)
+            client.open()
+            clients.append(client)
+
+    def on_check():
+        if server.poll() is None:
+            return current().add_timeout(0.05, on_check)
+        loop.stop()
+
+    current().add_timeout(0.5, on_start)
+    current().add_timeout(0.05, on_check)
+    try:
+        loop.start()
+        result = json.loads(server.stdout.read().decode("utf-8").strip().splitlines()[-1])
+    finally:
+        if server.poll() is None:
+            server.kill()
+        shutil.rmtree(session_path, True)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream handshake storm benchmark, server runs in its own process")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--connections", type=int, default=1, help="data connections per client")
+    parser.add_argument("--port", type=int, default=30000 + os.getpid() % 10000)
+    parser.add_argument("--crypto-alg", default="aes_256_cfb")
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--run", default="")
+    args = parser.parse_args(argv)
+
+    if args.run == "server":
+        return run_server(args)
+    json.dump(run_clients(args), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
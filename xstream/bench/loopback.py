@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import sys
+import time
+import json
+import argparse
+import sevent
+from sevent import current
+from .utils import percentile, wait_connections, run_isolated, run_subprocess
+from .proxy import ImpairmentProxy, add_arguments, get_arguments
+
+def start_bulk(session, state, args):
+    def on_data(stream, buffer, start_time, recv):
+        recv[0] += len(buffer.read())
+        if recv[0] < args["size"]:
+            return
+        state["latencies"].append(time.time() - start_time)
+        state["bytes"] += args["size"]
+        state["done"] += 1
+
+    for _ in range(args["streams"]):
+        stream = session.stream()
+        stream.on("data", lambda s, buffer, start_time=time.time(), recv=[0]: on_data(s, buffer, start_time, recv))
+        stream.write(os.urandom(args["size"]))
+    return args["streams"]
+
+def start_rr(session, state, args):
+    def request(stream, data, requests):
+        stream_state = {"recv": 0, "count": 0, "start_time": time.time()}
+        def on_data(s, buffer):
+            stream_state["recv"] += len(buffer.read())
+            if stream_state["recv"] < len(data):
+                return
+            state["latencies"].append(time.time() - stream_state["start_time"])
+            state["bytes"] += len(data)
+            stream_state["recv"] = 0
+            stream_state["count"] += 1
+            if stream_state["count"] >= requests:
+                state["done"] += 1
+                return
+            stream_state["start_time"] = time.time()
+            s.write(data)
+        stream.on("data", on_data)
+        stream.write(data)
+
+    data = os.urandom(args["request_size"])
+    for _ in range(args["streams"]):
+        request(session.stream(), data, args["requests"])
+    return args["streams"]
+
+def start_small(session, state, args):
+    data = os.urandom(args["request_size"])
+    pending = [args["requests"]]
+
+    def open_stream():
+        if pending[0] <= 0:
+            return
+        pending[0] -= 1
+        stream_state = {"recv": 0, "start_time": time.time()}
+        def on_data(s, buffer):
+            stream_state["recv"] += len(buffer.read())
+            if stream_state["recv"] < len(data):
+                return
+            state["latencies"].append(time.time() - stream_state["start_time"])
+            state["bytes"] += len(data)
+            state["done"] += 1
+            s.close()
+            open_stream()
+        stream = session.stream()
+        stream.on("data", on_data)
+        stream.write(data)
+
+    for _ in range(args["streams"]):
+        open_stream()
+    return args["requests"]
+
+WORKLOADS = {
+    "bulk": start_bulk,
+    "rr": start_rr,
+    "small": start_small,
+}
+
+def run(workload, args, impairment):
+    from ..server import Server
+    from ..client import Client
+
+    loop = sevent.instance()
+    port = 20000 + os.getpid() % 10000
+    result = dict(args, workload=workload, impairment=impairment)
+    sessions = []
+
+    def on_server_session(server, session):
+        sessions.append(session)
+        def on_stream(session, stream):
+            stream.on("data", lambda s, buffer: s.write(buffer.read()))
+        session.on("stream", on_stream)
+
+    server = Server(port, "127.0.0.1", crypto_key="bench", crypto_alg=args["crypto_alg"])
+    server.on("session", on_server_session)
+    server.start()
+    proxy = None
+    if any(value for key, value in impairment.items() if key != "seed"):
+        proxy = ImpairmentProxy(port + 1, ("127.0.0.1", port), **impairment)
+        proxy.start()
+    client = Client("127.0.0.1", port + 1 if proxy else port, max_connections=args["connections"], crypto_key="bench", crypto_alg=args["crypto_alg"])
+
+    def on_session(client, session):
+        state = {"done": 0, "bytes": 0, "latencies": []}
+
+        def on_check(start_time, cpu_time, count):
+            if state["done"] < count:
+                return current().add_timeout(0.01, on_check, start_time, cpu_time, count)
+            seconds = time.time() - start_time
+            centers = [session._center] + [s._center for s in sessions if s._center]
+            result["seconds"] = seconds
+            result["bytes"] = state["bytes"]
+            result["throughput"] = state["bytes"] / seconds
+            result["latency_p50"] = percentile(state["latencies"], 50) * 1000
+            result["latency_p99"] = percentile(state["latencies"], 99) * 1000
+            result["cpu_per_gb"] = (time.process_time() - cpu_time) / (state["bytes"] * 2.0 / 0x40000000)
+            result["resended_count"] = sum(center.resended_count for center in centers)
+            result["droped_count"] = sum(center.droped_count for center in centers)
+            result["connections"] = len(session._connections)
+            if proxy:
+                result["proxy"] = proxy.get_stat()
+            loop.stop()
+
+        def start():
+            start_time, cpu_time = time.time(), time.process_time()
+            count = WORKLOADS[workload](session, state, args)
+            on_check(start_time, cpu_time, count)
+        wait_connections(client, session, args["connections"], start, sessions)
+
+    client.on("session", on_session)
+    client.open()
+    current().add_timeout(args["timeout"], loop.stop)
+    loop.start()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream loopback throughput and latency benchmark")
+    parser.add_argument("--workloads", default="bulk,rr,small")
+    parser.add_argument("--connections", type=int, default=2)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024, help="bulk bytes per stream")
+    parser.add_argument("--request-size", type=int, default=1024, help="rr and small request bytes")
+    parser.add_argument("--requests", type=int, default=1000, help="rr requests per stream, small streams in total")
+    parser.add_argument("--crypto-alg", default="aes_256_cfb")
+    parser.add_argument("--timeout", type=int, default=120)
+    parser.add_argument("--run", default="")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    run_args = {
+        "connections": args.connections,
+        "streams": args.streams,
+        "size": args.size,
+        "request_size": args.request_size,
+        "requests": args.requests,
+        "crypto_alg": args.crypto_alg,
+        "timeout": args.timeout,
+    }
+    impairment = get_arguments(args)
+    if args.run:
+        return run_isolated(run, args.run, run_args, impairment)
+
+    results = []
+    for workload in args.workloads.split(","):
+        argv = ["--run", workload]
+        for key, value in list(run_args.items()) + list(impairment.items()):
+            argv.extend(["--" + key.replace("_", "-"), value])
+        results.append(run_subprocess("xstream.bench.loopback", argv))
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import time
+import random
+import logging
+import argparse
+from collections import deque
+import sevent
+from sevent import tcp, current
+
+class ImpairmentPipe(object):
+    def __init__(self, socket, rand, delay=0, jitter=0, bandwidth=0, stall_interval=0, stall_time=0):
+        self.socket = socket
+        self.random = rand
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.stall_interval = stall_interval
+        self.stall_time = stall_time
+        self.queue = deque()
+        self.timer = None
+        self.closed = False
+        self.bandwidth_time = 0
+        self.deliver_time = 0
+        self.stall_start_time = time.time() + self.get_stall_interval() if stall_interval and stall_time else 0
+        self.stall_count = 0
+
+    def get_stall_interval(self):
+        return self.stall_interval * self.random.uniform(0.5, 1.5)
+
+    def get_deliver_time(self, now, data_len):
+        deliver_time = now
+        if self.bandwidth:
+            self.bandwidth_time = max(self.bandwidth_time, now) + data_len / float(self.bandwidth)
+            deliver_time = self.bandwidth_time
+        deliver_time += self.delay
+        if self.jitter:
+            deliver_time += self.random.uniform(0, self.jitter)
+
+        if self.stall_start_time:
+            while deliver_time >= self.stall_start_time + self.stall_time:
+                self.stall_start_time += self.stall_time + self.get_stall_interval()
+                self.stall_count += 1
+            if deliver_time >= self.stall_start_time:
+                deliver_time = self.stall_start_time + self.stall_time
+        self.deliver_time = max(deliver_time, self.deliver_time)
+        return self.deliver_time
+
+    def write(self, data):
+        if self.closed:
+            return
+        now = time.time()
+        deliver_time = self.get_deliver_time(now, len(data))
+        if deliver_time <= now and not self.queue:
+            return self.socket.write(data)
+        self.queue.append((deliver_time, data))
+        if self.timer is None:
+            self.timer = current().add_timeout(deliver_time - now, self.on_timeout)
+
+    def on_timeout(self):
+        self.timer = None
+        now = time.time()
+        while self.queue and self.queue[0][0] <= now:
+            try:
+                self.socket.write(self.queue.popleft()[1])
+            except Exception:
+                self.queue.clear()
+                return
+        if self.queue:
+            self.timer = current().add_timeout(self.queue[0][0] - now, self.on_timeout)
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        if self.timer is not None:
+            current().cancel_timeout(self.timer)
+            self.timer = None
+
+class ImpairmentProxy(object):
+    def __init__(self, port, target, delay=0, jitter=0, bandwidth=0, stall_interval=0, stall_time=0,
+                 reset_time=0, seed=None, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.target = target
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.stall_interval = stall_interval
+        self.stall_time = stall_time
+        self.reset_time = reset_time
+        self.random = random.Random(seed)
+        self.server = tcp.Server()
+        self.pipes = []
+        self.connection_count = 0
+        self.reset_count = 0
+
+    def start(self):
+        self.server.on("connection", self.on_connection)
+        self.server.listen((self.host, self.port))
+
+    def create_pipe(self, socket):
+        return ImpairmentPipe(socket, random.Random(self.random.random()), self.delay, self.jitter,
+                              self.bandwidth, self.stall_interval, self.stall_time)
+
+    def on_connection(self, server, connection):
+        upstream = tcp.Socket()
+        upstream_pipe, downstream_pipe = self.create_pipe(upstream), self.create_pipe(connection)
+        self.pipes.extend([upstream_pipe, downstream_pipe])
+        self.connection_count += 1
+
+        def on_close(s):
+            upstream_pipe.close()
+            downstream_pipe.close()
+            connection.end()
+            upstream.end()
+
+        connection.on("data", lambda s, buffer: upstream_pipe.write(buffer.read()))
+        upstream.on("data", lambda s, buffer: downstream_pipe.write(buffer.read()))
+        connection.on("close", on_close)
+        upstream.on("close", on_close)
+        upstream.connect(self.target)
+
+        if self.reset_time:
+            def on_reset():
+                if upstream_pipe.closed:
+                    return
+                self.reset_count += 1
+                logging.info("impairment proxy %s reset connection %s", self.port, connection.address)
+                upstream_pipe.close()
+                downstream_pipe.close()
+                connection.close()
+                upstream.close()
+            current().add_timeout(self.reset_time * self.random.uniform(0.5, 1.5), on_reset)
+
+    def get_stat(self):
+        return {
+            "connection_count": self.connection_count,
+            "reset_count": self.reset_count,
+            "stall_count": sum(pipe.stall_count for pipe in self.pipes),
+        }
+
+def add_arguments(parser):
+    parser.add_argument("--delay", type=float, default=0, help="one-way delay seconds")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random one-way delay seconds")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes per second per direction")
+    parser.add_argument("--stall-interval", type=float, default=0, help="mean seconds between stalls")
+    parser.add_argument("--stall-time", type=float, default=0, help="stall seconds")
+    parser.add_argument("--reset-time", type=float, default=0, help="mean seconds before a connection is reset")
+    parser.add_argument("--seed", type=int, default=0)
+
+def get_arguments(args):
+    return {
+        "delay": args.delay,
+        "jitter": args.jitter,
+        "bandwidth": args.bandwidth,
+        "stall_interval": args.stall_interval,
+        "stall_time": args.stall_time,
+        "reset_time": args.reset_time,
+        "seed": args.seed,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="loopback tcp proxy with delay, jitter, bandwidth, stall and reset impairments")
+    parser.add_argument("--listen", default="127.0.0.1:8000")
+    parser.add_argument("--target", required=True)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    host, port = args.listen.rsplit(":", 1)
+    target_host, target_port = args.target.rsplit(":", 1)
+    proxy = ImpairmentProxy(int(port), (target_host, int(target_port)), host=host, **get_arguments(args))
+    proxy.start()
+    sevent.instance().start()
+
+if __name__ == "__main__":
+    main()
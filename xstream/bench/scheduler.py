@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import sys
+import time
+import json
+import argparse
+import sevent
+from sevent import current
+from .utils import wait_connections, run_isolated, run_subprocess
+from .proxy import ImpairmentProxy
+
+def get_connection_stat(connection):
+    stat = {"srtt": connection._srtt, "wdata_len": connection._wdata_len}
+    if connection._congestion:
+        stat["cwnd"] = connection._congestion.cwnd
+        stat["lost_count"] = connection._congestion.lost_count
+    return stat
+
+def run(scheduler, delays, size, streams, timeout):
+    from ..server import Server
+    from ..client import Client
+    from ..scheduler import create_scheduler
+
+    loop = sevent.instance()
+    port = 20000 + os.getpid() % 10000
+    result = {"scheduler": scheduler, "delays": delays}
+    sessions = []
+
+    def on_server_session(server, session):
+        session._center.scheduler = create_scheduler(session._center, scheduler)
+        sessions.append(session)
+        def on_stream(session, stream):
+            stream.on("data", lambda s, buffer: s.write(buffer.read()))
+        session.on("stream", on_stream)
+
+    server = Server(port, "127.0.0.1", crypto_key="bench", crypto_alg="aes_256_cfb")
+    server.on("session", on_server_session)
+    server.start()
+    hosts = []
+    for i, delay in enumerate(delays):
+        ImpairmentProxy(port + 1 + i, ("127.0.0.1", port), delay=delay).start()
+        hosts.append(("127.0.0.1", port + 1 + i))
+    client = Client(hosts, None, max_connections=len(delays), crypto_key="bench", crypto_alg="aes_256_cfb")
+
+    def on_session(client, session):
+        center = session._center
+        center.scheduler = create_scheduler(center, scheduler)
+        state = {"done": 0, "start_time": 0, "max_recv_frames": 0}
+
+        def on_sample():
+            state["max_recv_frames"] = max(state["max_recv_frames"], len(center.recv_frames))
+            if state["done"] < streams:
+                current().add_timeout(0.01, on_sample)
+
+        def on_data(stream, buffer, recv=[0]):
+            recv[0] += len(buffer.read())
+            if recv[0] < size:
+                return
+            state["done"] += 1
+            if state["done"] == streams:
+                result["seconds"] = time.time() - state["start_time"]
+                result["max_recv_frames"] = state["max_recv_frames"]
+                result["connections"] = [get_connection_stat(connection) for connection in session._connections]
+                result["server_connections"] = [get_connection_stat(connection) for s in sessions for connection in s._connections]
+                loop.stop()
+
+        def start():
+            state["start_time"] = time.time()
+            for _ in range(streams):
+                stream = session.stream()
+                stream.on("data", lambda s, buffer, recv=[0]: on_data(s, buffer, recv))
+                stream.write(os.urandom(size))
+            on_sample()
+        wait_connections(client, session, len(delays), start, sessions)
+
+    client.on("session", on_session)
+    client.open()
+    current().add_timeout(timeout, loop.stop)
+    loop.start()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream connection scheduler benchmark with asymmetric delay")
+    parser.add_argument("--schedulers", default="roundrobin,minrtt")
+    parser.add_argument("--delays", default="0,0.2", help="one-way delay seconds per connection")
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--timeout", type=int, default=120)
+    parser.add_argument("--run", default="")
+    args = parser.parse_args(argv)
+
+    delays = [float(d) for d in args.delays.split(",")]
+    if args.run:
+        return run_isolated(run, args.run, delays, args.size, args.streams, args.timeout)
+
+    results = []
+    for scheduler in args.schedulers.split(","):
+        results.append(run_subprocess("xstream.bench.scheduler", ["--run", scheduler, "--delays", args.delays,
+                                                                  "--size", args.size, "--streams", args.streams,
+                                                                  "--timeout", args.timeout]))
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
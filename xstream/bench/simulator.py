@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import sys
+import time
+import json
+import heapq
+import random
+import logging
+import argparse
+from collections import deque
+from sevent import EventEmitter, Buffer, tcp
+from sevent.errors import SocketClosed
+from .. import clock
+
+class VirtualTimeoutHandler(object):
+    __slots__ = ("callback", "deadline", "args", "kwargs")
+
+    def __init__(self, callback, deadline, args, kwargs):
+        self.callback = callback
+        self.deadline = deadline
+        self.args = args
+        self.kwargs = kwargs
+
+class VirtualLoop(object):
+    def __init__(self, start_time=1700000000.0):
+        self.now = start_time
+        self.handlers = []
+        self.asyncs = deque()
+        self.sequence = 0
+        self.running = False
+
+    def time(self):
+        return self.now
+
+    def add_timeout(self, timeout, callback, *args, **kwargs):
+        handler = VirtualTimeoutHandler(callback, self.now + max(timeout, 0), args, kwargs)
+        self.sequence += 1
+        heapq.heappush(self.handlers, (handler.deadline, self.sequence, handler))
+        return handler
+
+    def cancel_timeout(self, handler):
+        if handler is not None:
+            handler.callback = None
+            handler.args = None
+            handler.kwargs = None
+
+    def add_async(self, callback, *args, **kwargs):
+        self.asyncs.append((callback, args, kwargs))
+
+    def run_asyncs(self):
+        for _ in range(len(self.asyncs)):
+            callback, args, kwargs = self.asyncs.popleft()
+            try:
+                callback(*args, **kwargs)
+            except Exception as e:
+                logging.exception("virtual loop callback error: %s", e)
+
+    def run(self, seconds):
+        end_time = self.now + seconds
+        self.running = True
+        while self.running:
+            while self.asyncs:
+                self.run_asyncs()
+            if not self.handlers or self.handlers[0][0] > end_time:
+                break
+            deadline, _, handler = heapq.heappop(self.handlers)
+            if handler.callback is None:
+                continue
+            self.now = max(self.now, deadline)
+            try:
+                handler.callback(*handler.args, **handler.kwargs)
+            except Exception as e:
+                logging.exception("virtual loop callback error: %s", e)
+        if self.running:
+            self.now = max(self.now, end_time)
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+class VirtualCrypto(object):
+    def __init__(self):
+        self._key = "simulator"
+        self._alg = "none"
+        self._ensecret = (b"", b"")
+        self._desecret = (b"", b"")
+
+    def encrypt(self, data):
+        return data
+
+    def decrypt(self, data):
+        return bytes(data)
+
+    def encrypt_into(self, data, buf):
+        buf[:len(data)] = data
+        return len(data)
+
+    def decrypt_into(self, data, buf):
+        buf[:len(data)] = data
+        return len(data)
+
+class VirtualSocket(EventEmitter):
+    def __init__(self, link, address, crypto_time):
+        super(VirtualSocket, self).__init__()
+        self.link = link
+        self.peer = None
+        self.address = address
+        self.crypto = VirtualCrypto()
+        self.crypto_time = crypto_time
+        self.buffer = Buffer()
+        self.socket = None
+        self._socket = None
+        self._state = tcp.STATE_STREAMING
+        self.send_time = 0
+        self.deliver_time = 0
+        self.drain_timeout = None
+
+    def write(self, data, is_header=False):
+        if self._state == tcp.STATE_CLOSED:
+            raise SocketClosed()
+
+        loop, link = self.link.loop, self.link
+        now = loop.now
+        self.send_time = max(self.send_time, now) + (len(data) / float(link.bandwidth) if link.bandwidth else 0)
+        if not is_header:
+            link.on_write(self, data)
+        if is_header or not link.loss or link.random.random() >= link.loss:
+            deliver_time = self.send_time + link.delay + (link.random.uniform(0, link.jitter) if link.jitter else 0)
+            self.deliver_time = max(self.deliver_time, deliver_time)
+            loop.add_timeout(self.deliver_time - now, self.peer.on_deliver, data)
+        else:
+            link.simulator.lost_count += 1
+        if self.drain_timeout is None:
+            self.drain_timeout = loop.add_timeout(self.send_time - now, self.on_drain_timeout)
+
+    def on_drain_timeout(self):
+        self.drain_timeout = None
+        if self._state != tcp.STATE_CLOSED:
+            self.emit_drain(self)
+
+    def on_deliver(self, data):
+        if self._state == tcp.STATE_CLOSED:
+            return
+        self.buffer.write(data)
+        self.emit_data(self, self.buffer)
+
+    def end(self):
+        self.close()
+
+    def close(self):
+        if self._state == tcp.STATE_CLOSED:
+            return
+        self._state = tcp.STATE_CLOSED
+        self.link.loop.add_async(self.emit_close, self)
+        if self.peer:
+            self.link.loop.add_timeout(self.link.delay, self.peer.close)
+
+class VirtualLink(object):
+    def __init__(self, simulator, index, crypto_time):
+        self.loop = simulator.loop
+        self.simulator = simulator
+        self.random = random.Random(simulator.random.random())
+        self.delay = simulator.delay
+        self.jitter = simulator.jitter
+        self.bandwidth = simulator.bandwidth
+        self.loss = simulator.loss
+        self.client_socket = VirtualSocket(self, ("client", index), crypto_time)
+        self.server_socket = VirtualSocket(self, ("server", index), crypto_time)
+        self.client_socket.peer, self.server_socket.peer = self.server_socket, self.client_socket
+        self.client_socket.write(b"\x00" * 51, True)
+        self.server_socket.write(b"\x00" * 51, True)
+
+    def on_write(self, socket, data):
+        if len(data) > 6 and data[5] == 0 and data[6] < 0x80:
+            self.simulator.action_counts[data[6]] = self.simulator.action_counts.get(data[6], 0) + 1
+
+class Simulator(object):
+    def __init__(self, connections=2, delay=0.05, jitter=0, bandwidth=1024 * 1024, loss=0,
+                 reset_interval=0, seed=0):
+        self.loop = VirtualLoop()
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.connections = connections
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.reset_interval = reset_interval
+        self.links = []
+        self.link_count = 0
+        self.reset_count = 0
+        self.lost_count = 0
+        self.action_counts = {}
+        self.client_session = None
+        self.server_session = None
+
+    def start(self):
+        from ..session import Session
+        from ..frame import StreamFrame
+
+        random.seed(self.seed)
+        clock.install(self.loop.time, lambda: self.loop)
+        self.client_session = Session(1, b"simulator", False, VirtualCrypto(), StreamFrame.FRAME_LEN)
+        self.server_session = Session(1, b"simulator", True, VirtualCrypto(), StreamFrame.FRAME_LEN)
+        for _ in range(self.connections):
+            self.open_link()
+        self.client_session.write_action(0x01)
+        self.server_session.write_action(0x01)
+        if self.reset_interval:
+            self.loop.add_timeout(self.reset_interval * self.random.uniform(0.5, 1.5), self.on_reset)
+
+    def stop(self):
+        from ..timer import _timer_wheels
+        _timer_wheels.pop(self.loop, None)
+        clock.install()
+
+    def open_link(self):
+        self.link_count += 1
+        link = VirtualLink(self, self.link_count, int(self.loop.now) + self.link_count)
+        client_connection = self.client_session.add_connection(link.client_socket)
+        self.server_session.add_connection(link.server_socket)
+        link.client_socket.on("close", lambda s: self.on_link_close(link))
+        self.links.append(link)
+        if client_connection:
+            self.loop.add_async(client_connection.on_ping_loop)
+        return link
+
+    def on_link_close(self, link):
+        if link not in self.links:
+            return
+        self.links.remove(link)
+        self.client_session.remove_connection(link.client_socket)
+        self.loop.add_timeout(link.delay, self.server_session.remove_connection, link.server_socket)
+        self.loop.add_timeout(1, self.open_link)
+
+    def on_reset(self):
+        if self.links:
+            self.reset_count += 1
+            self.random.choice(self.links).client_socket.close()
+        self.loop.add_timeout(self.reset_interval * self.random.uniform(0.5, 1.5), self.on_reset)
+
+    def run(self, seconds):
+        self.loop.run(seconds)
+
+def run(args):
+    from ..center import ACTION_ACK, ACTION_RESEND, ACTION_INDEX_RESET, ACTION_TTL, ACTION_TTL_ACK, ACTION_SACK
+
+    simulator = Simulator(args.connections, args.delay, args.jitter, args.bandwidth, args.loss,
+                          args.reset_interval, args.seed)
+    result = {
+        "connections": args.connections,
+        "delay": args.delay,
+        "jitter": args.jitter,
+        "bandwidth": args.bandwidth,
+        "loss": args.loss,
+        "reset_interval": args.reset_interval,
+        "seed": args.seed,
+        "streams": args.streams,
+        "size": args.size,
+    }
+    start_time, state = time.time(), {"done": 0, "bytes": 0, "finish_time": 0}
+    simulator.start()
+    try:
+        def on_server_stream(session, stream):
+            stream.on("data", lambda s, buffer: s.write(buffer.read()))
+        simulator.server_session.on("stream", on_server_stream)
+
+        def on_data(stream, buffer, recv):
+            recv[0] += len(buffer.read())
+            if recv[0] < args.size:
+                return
+            state["done"] += 1
+            if state["done"] == args.streams:
+                state["finish_time"] = simulator.loop.now - start_loop_time
+
+        start_loop_time = simulator.loop.now
+        data = os.urandom(args.size)
+        for _ in range(args.streams):
+            stream = simulator.client_session.stream()
+            stream.on("data", lambda s, buffer, recv=[0]: on_data(s, buffer, recv))
+            stream.write(data)
+        simulator.run(args.duration)
+
+        centers = [simulator.client_session._center, simulator.server_session._center]
+        result["virtual_seconds"] = simulator.loop.now - start_loop_time
+        result["wall_seconds"] = time.time() - start_time
+        result["streams_done"] = state["done"]
+        result["transfer_seconds"] = state["finish_time"]
+        result["resended_count"] = sum(center.resended_count for center in centers if center)
+        result["droped_count"] = sum(center.droped_count for center in centers if center)
+        result["lost_count"] = simulator.lost_count
+        result["reset_count"] = simulator.reset_count
+        action_names = {0: "data", ACTION_ACK: "ack", ACTION_RESEND: "resend", ACTION_INDEX_RESET: "index_reset",
+                        ACTION_TTL: "ttl", ACTION_TTL_ACK: "ttl_ack", ACTION_SACK: "sack"}
+        result["actions_per_minute"] = {action_names.get(action, str(action)): count * 60.0 / result["virtual_seconds"]
+                                        for action, count in sorted(simulator.action_counts.items())}
+    finally:
+        simulator.stop()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream virtual clock session simulator")
+    parser.add_argument("--connections", type=int, default=2)
+    parser.add_argument("--delay", type=float, default=0.05, help="one-way delay seconds")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random one-way delay seconds")
+    parser.add_argument("--bandwidth", type=int, default=1024 * 1024, help="bytes per second per direction")
+    parser.add_argument("--loss", type=float, default=0, help="record loss probability")
+    parser.add_argument("--reset-interval", type=float, default=0, help="mean seconds between connection resets")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--duration", type=float, default=3600, help="virtual seconds to run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    json.dump(run(args), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
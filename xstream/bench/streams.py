@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import sys
+import math
+import time
+import json
+import random
+import argparse
+from ..scheduler import StreamScheduler
+
+FRAME_LEN = 2900
+
+class BenchStream(object):
+    def __init__(self, weight=1):
+        now = time.time()
+        self._priority = 0
+        self._weight = weight
+        self._start_time = now - random.random() * 60
+        self._send_time = now
+        self._send_frame_count = random.randint(0, 10000)
+        self._send_is_set_ready = True
+        self._send_data_len = 0
+
+    @property
+    def priority(self):
+        t = time.time()
+        p = self._send_frame_count * 2.0 / (1 + math.sqrt(t - self._start_time))
+        if self._send_is_set_ready:
+            if t - self._send_time > 30:
+                return 0
+            return p / ((1 + t - self._send_time) ** 2)
+        return p
+
+    def do_write(self):
+        self._send_frame_count += 1
+        self._send_data_len += FRAME_LEN
+        self._send_time = time.time()
+        return True
+
+def run_sort(count, frames):
+    ready_streams = [BenchStream() for _ in range(count)]
+    start_time = time.time()
+    for _ in range(frames):
+        ready_streams = sorted(ready_streams, key=lambda s: s.priority)
+        ready_streams[0].do_write()
+    return frames / (time.time() - start_time)
+
+def run_drr(count, frames):
+    ready_streams = StreamScheduler()
+    for _ in range(count):
+        ready_streams.add(BenchStream())
+    start_time = time.time()
+    for _ in range(frames):
+        stream = ready_streams.first()
+        stream.do_write()
+        ready_streams.consume(stream, FRAME_LEN)
+    return frames / (time.time() - start_time)
+
+def run_weights(weights, frames):
+    ready_streams = StreamScheduler()
+    streams = [BenchStream(weight) for weight in weights]
+    for stream in streams:
+        ready_streams.add(stream)
+    for _ in range(frames):
+        stream = ready_streams.first()
+        stream.do_write()
+        ready_streams.consume(stream, FRAME_LEN)
+    total = float(sum(stream._send_data_len for stream in streams))
+    return [round(stream._send_data_len / total, 4) for stream in streams]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream stream scheduler benchmark")
+    parser.add_argument("--counts", default="10,100,1000")
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--weights", default="1,2,4")
+    args = parser.parse_args(argv)
+
+    results = []
+    for count in [int(c) for c in args.counts.split(",")]:
+        frames = max(args.frames // count, 100)
+        results.append({
+            "streams": count,
+            "sort_frames_per_second": round(run_sort(count, frames)),
+            "drr_frames_per_second": round(run_drr(count, args.frames)),
+        })
+    weights = [int(w) for w in args.weights.split(",")]
+    results.append({"weights": weights, "shares": run_weights(weights, args.frames)})
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
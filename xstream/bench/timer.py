@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import sys
+import time
+import json
+import random
+import argparse
+import sevent
+from ..timer import TimerWheel
+
+def noop():
+    pass
+
+def run(timer, timeouts):
+    handlers = []
+    start_time = time.perf_counter()
+    for timeout in timeouts:
+        handlers.append(timer.add_timeout(timeout, noop))
+    for handler in handlers:
+        timer.cancel_timeout(handler)
+    return len(timeouts) * 2 / (time.perf_counter() - start_time)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream timer arm/cancel benchmark")
+    parser.add_argument("--counts", default="1000,10000,100000")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for count in [int(c) for c in args.counts.split(",")]:
+        timeouts = [random.uniform(1, 60) for _ in range(count)]
+        loop = sevent.instance()
+        loop._timeout_handlers = []
+        wheel = TimerWheel(loop)
+        results[count] = {
+            "loop": run(loop, timeouts),
+            "wheel": run(wheel, timeouts),
+        }
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+from sevent import current
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+def wait_connections(client, session, count, callback, server_sessions=None):
+    from ..session import STATUS_OPENING
+
+    def check():
+        if len(session._connections) < count:
+            if session._status == STATUS_OPENING and session._connections \
+                    and time.time() - max(c._start_time for c in session._connections) >= 1.2:
+                client.init_connection(False)
+            return current().add_timeout(0.1, check)
+        if not all(c._srtt for s in [session] + (server_sessions or []) for c in s._connections):
+            return current().add_timeout(0.1, check)
+        callback()
+    current().add_timeout(0.1, check)
+
+def run_isolated(run, *args):
+    session_path = tempfile.mkdtemp()
+    os.environ["SESSION_PATH"] = session_path
+    try:
+        result = run(*args)
+    finally:
+        shutil.rmtree(session_path, True)
+    json.dump(result, sys.stdout)
+    sys.stdout.flush()
+    os._exit(0)
+
+def run_subprocess(module, argv):
+    output = subprocess.check_output([sys.executable, "-m", module] + [str(arg) for arg in argv])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import sys
+import time
+import json
+import random
+import bisect
+import argparse
+from ..frame import Frame, FrameWindow
+
+def run_list(frames, window, resend_indexes, send_frames=None):
+    if send_frames is None:
+        send_frames = []
+    for frame in frames:
+        if not send_frames or frame.index >= send_frames[-1].index:
+            send_frames.append(frame)
+        else:
+            bisect.insort(send_frames, frame)
+
+        if len(send_frames) > window:
+            ack_index = frame.index - window
+            while send_frames and send_frames[0].index <= ack_index:
+                send_frames.pop(0)
+
+            resend_index = resend_indexes[frame.index % len(resend_indexes)] + ack_index
+            for send_frame in send_frames:
+                if send_frame.index == resend_index:
+                    break
+    return send_frames
+
+def run_window(frames, window, resend_indexes, send_frames=None):
+    if send_frames is None:
+        send_frames = FrameWindow()
+    for frame in frames:
+        send_frames.add(frame)
+
+        if len(send_frames) > window:
+            ack_index = frame.index - window
+            send_frames.pop_until(ack_index)
+            send_frames.get(resend_indexes[frame.index % len(resend_indexes)] + ack_index)
+    return send_frames
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="xstream center send window benchmark")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--windows", default="100,1000,10000,100000")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for window in [int(w) for w in args.windows.split(",")]:
+        frames = [Frame(0, i + 1, 0, b'') for i in range(window + args.count)]
+        resend_indexes = [random.randint(1, window) for _ in range(1024)]
+        result = {}
+        for name, func in (("list", run_list), ("window", run_window)):
+            send_frames = func(frames[:window], window, resend_indexes)
+            start_time = time.perf_counter()
+            func(frames[window:], window, resend_indexes, send_frames)
+            result[name] = args.count / (time.perf_counter() - start_time)
+        results[window] = result
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,18 @@
 # 14/12/10
 # create by: snower
 
-import time
 import logging
 import struct
 import random
-import math
 from collections import deque
-import bisect
-from sevent import EventEmitter, current
-from .frame import Frame
+from sevent import EventEmitter
+from . import clock
+from .frame import FrameWindow
 from .crypto import rand_string
+from .timer import current_wheel, add_timeout
+from .scheduler import create_scheduler, StreamScheduler
+from .congestion import RttEstimator, QUICK_ACK_FRAMES
+from .stats import Histogram
 
 ACTION_ACK = 0x01
 ACTION_RESEND = 0x02
@@ -19,36 +21,54 @@ ACTION_INDEX_RESET = 0x03
 ACTION_INDEX_RESET_ACK = 0x04
 ACTION_TTL = 0x05
 ACTION_TTL_ACK = 0x06
+ACTION_SACK = 0x07
 
 class Center(EventEmitter):
+    SACK_RANGE_STRUCT = struct.Struct("!IH")
+    MAX_RESEND_INDEXES = 5776
+    MIN_ACK_DELAY = 0.01
+    MAX_ACK_DELAY = 2
+    SEND_TIMEOUT_CLOSE = 20
+    RECV_GAP_TIMEOUT_RTO = 6
+    MIN_RECV_GAP_TIMEOUT = 6
+
     def __init__(self, session):
         super(Center, self).__init__()
 
         self.session = session
-        self.ready_streams = []
-        self.frames = []
-        self.recv_frames = []
+        self.frame_pool = session._frame_pool
+        self.ready_streams = StreamScheduler()
+        self.action_frames = deque()
+        self.frames = FrameWindow()
+        self.recv_frames = FrameWindow()
         self.recv_uframes = {}
         self.recv_index = 1
-        self.send_frames = []
+        self.recv_gap_index = 0
+        self.send_frames = FrameWindow()
         self.send_index = 1
         self.drain_connections = deque()
+        self.scheduler = create_scheduler(self)
         self.ack_index = 0
         self.send_ack_index = 0
         self.ack_loop = False
         self.ack_timeout_loop = False
+        self.quick_ack = False
+        self.pacing_timeout = None
         self.send_timeout_loop = False
+        self.send_timeout_frame = None
         self.ttl = 50
+        self.rtt = RttEstimator()
         self.ttl_index = 0
         self.ttl_changing = False
         self.ttl_remote_delay = 0
         self.closed = False
-        self.ready_streams_lookup_timeout = None
         self.droped_count = 0
         self.resended_count = 0
         self.rframe_count = 0
         self.sframe_count = 0
         self.ack_count = 0
+        self.ack_histogram = Histogram()
+        self.reorder_histogram = Histogram()
 
         self.write_ttl()
 
@@ -57,36 +77,35 @@ class Center(EventEmitter):
         connection.on("drain", self.on_drain)
 
     def remove_connection(self, connection):
-        def check_send_frames():
-            send_frames, send_count = [], 0
-            connections = {id(c) for c in self.session._connections} if self.session else set([])
+        def check_send_frames(retry=False):
+            send_count, wait_count = 0, 0
+            connections = {id(c) for c in self.session._connections
+                           if c is not connection and not c._closed} if self.session else set([])
             for send_frame in self.send_frames:
                 if connection != send_frame.connection:
-                    send_frames.append(send_frame)
                     continue
 
                 if connection._finaled and send_frame.index <= connection._wlast_index:
-                    send_frames.append(send_frame)
                     continue
 
-                if not (connections - send_frame.used_connections):
-                    send_frames.append(send_frame)
+                if not send_frame.has_unused_connection(connections):
+                    wait_count += 1
                     continue
 
-                if not self.frames or send_frame.index >= self.frames[-1].index:
-                    self.frames.append(send_frame)
-                else:
-                    bisect.insort(self.frames, send_frame)
+                self.send_frames.remove(send_frame.index)
+                self.frames.add(send_frame)
                 send_count += 1
 
-            self.send_frames = send_frames
             if send_count:
-                current().add_async(self.write_frame)
+                self.resended_count += send_count
+                clock.current().add_async(self.write_frame)
+            if wait_count and retry:
+                current_wheel().add_timeout(2.2, check_send_frames)
 
         if connection in self.drain_connections:
             self.drain_connections.remove(connection)
-        if not connection._finaled:
-            current().add_timeout(2.2, check_send_frames)
+        if not connection._finaled and not self.closed:
+            check_send_frames(True)
 
     def create_frame(self, data, action=0, index=None):
         if index is None:
@@ -96,79 +115,118 @@ class Center(EventEmitter):
                 logging.info("stream session %s center %s index reset", self.session, self)
 
             self.send_ack_index = self.recv_index - 1
-            frame = Frame(action, self.send_index, self.send_ack_index, data)
+            frame = self.frame_pool.frame(action, self.send_index, self.send_ack_index, data)
             self.send_index += 1
         else:
             self.send_ack_index = self.recv_index - 1
-            frame = Frame(action, index, self.send_ack_index, data)
+            frame = self.frame_pool.frame(action, index, self.send_ack_index, data)
         return frame
 
-    def sort_stream(self):
-        self.ready_streams = sorted(self.ready_streams, key=lambda s: s.priority)
+    def write_stream(self):
+        stream = self.ready_streams.first()
+        send_data_len = stream._send_data_len
+        if stream.do_write():
+            self.ready_streams.consume(stream, stream._send_data_len - send_data_len)
+        else:
+            self.ready_streams.remove(stream)
 
     def ready_write(self, stream, is_ready=True):
         if self.closed:
             return False
 
         if not is_ready:
-            if stream in self.ready_streams:
-                self.ready_streams.remove(stream)
+            self.ready_streams.remove(stream)
             return
 
         if stream not in self.ready_streams:
-            self.ready_streams.append(stream)
-            if not self.ready_streams_lookup_timeout and len(self.ready_streams) > 1:
-                self.ready_streams_lookup_timeout = current().add_timeout(2, self.on_ready_streams_lookup)
+            self.ready_streams.add(stream)
 
         if not self.drain_connections:
             return True
-        if self.frames:
+        if self.action_frames or self.frames:
             self.write_frame()
             return True
         if not self.ready_streams:
             return True
-        self.sort_stream()
-        stream = self.ready_streams[0]
-        if not stream.do_write():
-            self.ready_streams.pop(0)
+        self.write_stream()
         return True
 
     def write(self, data):
         frame = self.create_frame(data)
-        if not self.frames or frame.index >= self.frames[-1].index:
-            self.frames.append(frame)
-        else:
-            bisect.insort(self.frames, frame)
+        self.frames.add(frame)
         self.write_frame()
         return frame
 
     def write_frame(self):
+        if self.frames and self.drain_connections:
+            self.write_resend_frame()
+
+        skip_connections = set()
         for _ in range(len(self.drain_connections)):
-            if not self.frames or self.frames[0].index > 0x7fffffff:
+            if not self.action_frames and (not self.frames or self.frames.start > 0x7fffffff):
                 return
-            
-            connection = self.drain_connections.popleft()
-            if connection._closed:
+
+            if self.action_frames:
+                connection = self.scheduler.select(self.drain_connections, skip_connections)
+            else:
+                connection = self.scheduler.select(self.drain_connections, skip_connections | self.get_congested_connections())
+            if connection is None:
+                return
+            if self.write_next(connection) is None:
+                skip_connections.add(connection)
+
+    def write_resend_frame(self):
+        frame = self.frames.get(self.frames.start)
+        if frame is None or frame.used_connections is None:
+            return
+        for connection in self.drain_connections:
+            if not connection._closed and not frame.is_used_connection(connection):
+                self.drain_connections.remove(connection)
+                self.write_next(connection)
+                return
+
+    def get_congested_connections(self):
+        congested_connections, now, pacing_time = set(), clock.time(), 0
+        for connection in self.drain_connections:
+            congestion = connection._congestion
+            if congestion is None or congestion.is_writable(now):
                 continue
-            self.write_next(connection)
+            congested_connections.add(connection)
+            if congestion.inflight < congestion.cwnd and (not pacing_time or congestion.pacing_time < pacing_time):
+                pacing_time = congestion.pacing_time
+
+        if pacing_time and not self.pacing_timeout:
+            self.pacing_timeout = clock.current().add_timeout(max(pacing_time - now, 0.001), self.on_pacing_timeout)
+        return congested_connections
+
+    def on_pacing_timeout(self):
+        self.pacing_timeout = None
+        if not self.closed and (self.action_frames or self.frames):
+            self.write_frame()
 
     def get_write_connection_frame(self, connection):
-        frame = self.frames.pop(0)
-        while frame.index <= self.ack_index and frame.index > 0:
-            if not self.frames:
-                return None
-            frame = self.frames.pop(0)
-
-        if id(connection) in frame.used_connections:
-            frames = []
-            while frame and id(connection) in frame.used_connections:
-                if not frames or frame.index >= frames[-1].index:
-                    frames.append(frame)
-                else:
-                    bisect.insort(frames, frame)
-                frame = self.frames.pop(0) if self.frames else None
-            self.frames = frames + self.frames
-        return frame
+        if self.action_frames:
+            return self.action_frames.popleft()
+
+        index = self.frames.start
+        while index < self.frames.end and index <= 0x7fffffff:
+            frame = self.frames.get(index)
+            index += 1
+            if frame is None:
+                continue
+
+            if frame.index <= self.ack_index:
+                self.retire_frame(self.frames.remove(frame.index))
+                continue
+            if not frame.is_used_connection(connection):
+                return self.frames.remove(frame.index)
+        return None
+
+    def retire_frame(self, frame):
+        if frame is self.send_timeout_frame:
+            frame.ack_time = clock.time()
+        else:
+            self.frame_pool.release(frame)
 
     def write_next(self, connection):
         frame = self.get_write_connection_frame(connection)
@@ -177,140 +235,129 @@ class Center(EventEmitter):
             if self.ready_streams:
                 def continue_write_next():
                     if self.ready_streams:
-                        stream = self.ready_streams[0]
-                        if not stream.do_write():
-                            self.ready_streams.pop(0)
-                current().add_async(continue_write_next)
+                        self.write_stream()
+                clock.current().add_async(continue_write_next)
             return None
 
         frame.connection = connection
-        if frame.index != 0:
-            frame.used_connections.add(id(connection))
-            frame.send_time = time.time()
-            frame.ack_time = 0
-            if not self.send_frames or frame.index >= self.send_frames[-1].index:
-                self.send_frames.append(frame)
-            else:
-                bisect.insort(self.send_frames, frame)
-
-            if not self.send_timeout_loop:
-                for send_frame in self.send_frames:
-                    if send_frame.index != 0:
-                        current().add_timeout(min(60, math.sqrt(self.ttl * 20)), self.on_send_timeout_loop, send_frame, self.ack_index)
-                        self.send_timeout_loop = True
-                        break
-
         if not connection.write(frame):
-            if not self.frames or frame.index >= self.frames[-1].index:
-                self.frames.append(frame)
+            if frame.index == 0:
+                self.action_frames.appendleft(frame)
             else:
-                bisect.insort(self.frames, frame)
+                self.frames.add(frame)
             return None
         self.sframe_count += 1
+        if connection.is_batch_writable() and connection not in self.drain_connections:
+            self.drain_connections.append(connection)
+
+        if frame.index == 0:
+            self.frame_pool.release(frame)
+            return frame
+
+        frame.use_connection(connection)
+        frame.send_time = clock.time()
+        frame.ack_time = 0
+        self.send_frames.add(frame)
+        if connection._congestion:
+            connection._congestion.on_sent(frame.send_time)
+
+        if not self.send_timeout_loop:
+            send_frame = self.send_frames.first()
+            add_timeout(self.get_send_timeout(send_frame), self.on_send_timeout_loop, send_frame, self.ack_index)
+            self.send_timeout_loop = True
+            self.send_timeout_frame = send_frame
         return frame
 
     def on_frame(self, connection, frame):
-        frame.recv_time = time.time()
+        recv_time = frame.recv_time = clock.time()
         self.rframe_count += 1
 
         if frame.ack != self.ack_index:
             self.ack_index = frame.ack
-            while self.send_frames and self.send_frames[0].index <= self.ack_index:
-                send_frame = self.send_frames.pop(0)
-                send_frame.ack_time = time.time()
+            congestion_acked = False
+            for send_frame in self.send_frames.pop_until(self.ack_index):
+                self.ack_histogram.record((recv_time - send_frame.send_time) * 1000)
+                if send_frame.connection._congestion:
+                    send_frame.connection._congestion.on_acked(frame.recv_time - send_frame.send_time)
+                    congestion_acked = True
+                self.retire_frame(send_frame)
+            if congestion_acked and (self.action_frames or self.frames) and self.drain_connections:
+                clock.current().add_async(self.write_frame)
 
         if frame.index == 0:
-            return self.emit_frame(self, frame)
+            self.emit_frame(self, frame)
+            self.frame_pool.release(frame, False)
+            return
 
         if frame.index < self.recv_index or frame.index in self.recv_uframes \
                 or abs(frame.index - self.recv_index) > 0x7fffffff:
             self.droped_count += 1
+            self.frame_pool.release(frame)
             return
 
         if frame.index == self.recv_index:
             self.emit_frame(self, frame)
             self.recv_index += 1
+            self.frame_pool.release(frame, False)
 
-            while self.recv_frames and self.recv_frames[0].index <= self.recv_index:
-                frame = self.recv_frames[0]
+            while self.recv_frames and self.recv_frames.start <= self.recv_index:
+                frame = self.recv_frames.pop_first()
                 if frame.index == self.recv_index:
+                    self.reorder_histogram.record((recv_time - frame.recv_time) * 1000)
                     if frame.index in self.recv_uframes:
-                        self.recv_uframes.pop(self.recv_frames[0].index, None)
+                        self.recv_uframes.pop(frame.index, None)
                     else:
                         self.emit_frame(self, frame)
                     self.recv_index += 1
                 else:
                     self.droped_count += 1
-                self.recv_frames.pop(0)
+                self.frame_pool.release(frame, False)
 
             if not self.ack_loop:
-                current().add_timeout(2, self.on_ack_loop, self.sframe_count)
+                add_timeout(self.get_ack_delay(), self.on_ack_loop, self.sframe_count)
                 self.ack_loop = True
+            if QUICK_ACK_FRAMES and not self.quick_ack and self.recv_index - 1 - self.send_ack_index >= QUICK_ACK_FRAMES:
+                clock.current().add_async(self.on_quick_ack)
+                self.quick_ack = True
         else:
-            if not self.recv_frames or frame.index >= self.recv_frames[-1].index:
-                self.recv_frames.append(frame)
-            else:
-                bisect.insort_left(self.recv_frames, frame)
-            if frame.action == 0 and (frame.data.flag & 0x02 != 0 or frame.data.stream_id in self.session._streams):
+            if frame.action == 0:
+                frame.data.detach()
+            if not self.recv_frames.add(frame):
+                self.droped_count += 1
+                self.frame_pool.release(frame)
+            elif frame.action == 0 and (frame.data.flag & 0x02 != 0 or frame.data.stream_id in self.session._streams):
                 self.emit_frame(self, frame)
                 self.recv_uframes[frame.index] = frame
 
-        if not self.ack_timeout_loop and self.recv_frames:
-            current().add_timeout(3, self.on_ack_timeout_loop)
-            self.ack_timeout_loop = True
+        if self.recv_frames:
+            self.check_recv_gap()
+            if not self.ack_timeout_loop:
+                add_timeout(self.get_ack_timeout_interval(), self.on_ack_timeout_loop)
+                self.ack_timeout_loop = True
 
     def on_drain(self, connection):
-        self.drain_connections.append(connection)
-        if self.frames:
+        if connection not in self.drain_connections:
+            self.drain_connections.append(connection)
+        if self.action_frames or self.frames:
             return self.write_frame()
 
-        while not self.frames and self.ready_streams:
-            stream = self.ready_streams[0]
-            if not stream.do_write():
-                self.ready_streams.pop(0)
+        while not self.action_frames and not self.frames and self.ready_streams:
+            self.write_stream()
 
     def on_action(self, action, data):
         if action == ACTION_ACK:
             start_time, remote_time = struct.unpack("!QQ", data[:16])
-            self.ttl_remote_delay = time.time() * 1000000 - remote_time
+            self.ttl_remote_delay = clock.time() * 1000000 - remote_time
             if start_time:
-                ack_time = time.time() * 1000 - float(start_time) / 1000
-                self.ttl = max(float(self.ttl + ack_time) / 2.0, 50)
+                self.update_rtt(clock.time() - float(start_time) / 1000000)
         elif action == ACTION_RESEND:
             resend_count, = struct.unpack("!I", data[:4])
-            now = time.time()
-            resend_frame_ids = []
-            waiting_frames = []
-            connections = {id(c) for c in self.session._connections} if self.session else set([])
-
-            for i in range(resend_count):
-                resend_index, = struct.unpack("!I", data[4 + i * 4: 8 + i * 4])
-                while self.send_frames:
-                    frame = self.send_frames.pop(0)
-                    if resend_index == frame.index:
-                        if frame.resend_count >= 60:
-                            return self.session.close()
-
-                        if now - frame.send_time >= self.ttl / 1000.0 and now - frame.resend_time >= self.ttl / 1000.0 \
-                                and frame.resend_time <= frame.send_time and (connections - frame.used_connections):
-                            if not self.frames or frame.index >= self.frames[-1].index:
-                                self.frames.append(frame)
-                            else:
-                                bisect.insort(self.frames, frame)
-                            resend_frame_ids.append(frame.index)
-                            frame.resend_time = now
-                            frame.resend_count += 1
-                            self.resended_count += 1
-                            break
-                        waiting_frames.append(frame)
-                        break
-                    waiting_frames.append(frame)
-
-            if waiting_frames:
-                self.send_frames = waiting_frames + self.send_frames
-            if resend_frame_ids:
-                current().add_async(self.write_frame)
-            logging.info("stream session %s center %s index resend action %s %s %s", self.session, self, self.ack_index, resend_count, resend_frame_ids)
+            resend_ranges = [(struct.unpack("!I", data[4 + i * 4: 8 + i * 4])[0], 1) for i in range(resend_count)]
+            self.on_resend(resend_ranges, resend_count)
+        elif action == ACTION_SACK:
+            range_count, = struct.unpack("!H", data[:2])
+            resend_ranges = [self.SACK_RANGE_STRUCT.unpack_from(data, 2 + i * 6) for i in range(range_count)]
+            self.on_resend(resend_ranges, sum(count for _, count in resend_ranges))
         elif action == ACTION_INDEX_RESET:
             if self.send_index >= 0x7fffffff:
                 self.write_action(ACTION_INDEX_RESET_ACK)
@@ -318,41 +365,49 @@ class Center(EventEmitter):
                 self.write_action(ACTION_INDEX_RESET_ACK, index=self.send_index)
                 self.send_index += 1
             self.recv_index = 1
+            self.recv_gap_index = 0
+            for connection in self.session._connections:
+                connection._rmax_index = 0
             self.send_ack_index = 0
             if self.recv_frames:
-                self.recv_frames = []
+                self.recv_frames.clear()
             if self.recv_uframes:
                 self.recv_uframes = {}
             logging.info("stream session %s center %s index reset action", self.session, self)
         elif action == ACTION_INDEX_RESET_ACK:
             self.send_index = 1
-            for frame in self.frames:
-                if frame.index > 0x7fffffff:
-                    frame.index -= 0x7fffffff
+            frames = list(self.frames)
+            self.frames.clear()
+            for frame in frames:
+                if frame.index <= 0x7fffffff:
+                    self.retire_frame(frame)
+                    continue
+                frame.index -= 0x7fffffff
                 if frame.index + 1 > self.send_index:
                     self.send_index = frame.index + 1
+                self.frames.add(frame)
             self.ack_index = 0
             if self.send_frames:
-                self.send_frames = []
+                for send_frame in self.send_frames:
+                    if send_frame.connection._congestion:
+                        send_frame.connection._congestion.on_acked(0)
+                self.send_frames.clear()
 
-            if not self.frames and self.ready_streams:
-                stream = self.ready_streams[0]
-                if not stream.do_write():
-                    self.ready_streams.pop(0)
+            if not self.action_frames and not self.frames and self.ready_streams:
+                self.write_stream()
 
-            if self.frames:
-                current().add_async(self.write_frame)
+            if self.action_frames or self.frames:
+                clock.current().add_async(self.write_frame)
             logging.info("stream session %s center %s index reset ack action", self.session, self)
         elif action == ACTION_TTL:
             self.write_action(ACTION_TTL_ACK, data[:12], index=0, sort_ttl=False)
             remote_time, ttl_index, ttl, = struct.unpack("!QII", data[:16])
-            self.ttl_remote_delay = time.time() * 1000000 - remote_time
-            self.ttl = max((self.ttl + float(ttl) / 1000.0) / 2.0, 50)
+            self.ttl_remote_delay = clock.time() * 1000000 - remote_time
             logging.info("stream session %s center passive <%s, (%s %s %s %s) (%s %s %s %s) (%s %s %s %s %s) > ttl %.3fms %s",
                          self.session, self,
                          self.send_index, self.ack_index, len(self.frames), len(self.send_frames),
-                         self.recv_index, len(self.recv_frames), self.recv_frames[0].index if self.recv_frames else 0,
-                         self.recv_frames[-1].index if self.recv_frames else 0,
+                         self.recv_index, len(self.recv_frames), self.recv_frames.start if self.recv_frames else 0,
+                         self.recv_frames.end - 1 if self.recv_frames else 0,
                          self.droped_count, self.resended_count, self.sframe_count, self.rframe_count, self.ack_count,
                          self.ttl, self.session.get_ttl_info() if self.session else "")
         elif action == ACTION_TTL_ACK:
@@ -360,7 +415,39 @@ class Center(EventEmitter):
             if ttl_index < self.ttl_index:
                 return
 
-            self.on_ttl_ack(time.time() * 1000 - float(start_time) / 1000)
+            self.on_ttl_ack(clock.time() * 1000 - float(start_time) / 1000)
+
+    def on_resend(self, resend_ranges, resend_count):
+        now = clock.time()
+        resend_frame_ids = []
+        connections = {id(c) for c in self.session._connections} if self.session else set([])
+
+        for start_index, count in resend_ranges:
+            if start_index + count <= self.send_frames.start or start_index >= self.send_frames.end:
+                continue
+
+            for resend_index in range(max(start_index, self.send_frames.start), min(start_index + count, self.send_frames.end)):
+                frame = self.send_frames.get(resend_index)
+                if frame is None:
+                    continue
+
+                if frame.resend_count >= 60:
+                    return self.session.close()
+
+                srtt = self.get_frame_srtt(frame)
+                if now - frame.send_time >= srtt and now - frame.resend_time >= srtt \
+                        and frame.resend_time <= frame.send_time and frame.has_unused_connection(connections):
+                    self.frames.add(self.send_frames.remove(resend_index))
+                    if frame.connection._congestion:
+                        frame.connection._congestion.on_lost()
+                    resend_frame_ids.append(frame.index)
+                    frame.resend_time = now
+                    frame.resend_count += 1
+                    self.resended_count += 1
+
+        if resend_frame_ids:
+            clock.current().add_async(self.write_frame)
+        logging.info("stream session %s center %s index resend action %s %s %s", self.session, self, self.ack_index, resend_count, resend_frame_ids)
 
     def write_action(self, action, data=b'', index=None, sort_ttl=True):
         if index is True:
@@ -368,16 +455,16 @@ class Center(EventEmitter):
 
         data += rand_string(random.randint(1, 256)) if len(data) < 512 else b''
         frame = self.create_frame(data, action=action, index=index)
-        if not self.frames or frame.index >= self.frames[-1].index:
-            self.frames.append(frame)
+        if frame.index == 0:
+            self.action_frames.append(frame)
         else:
-            bisect.insort(self.frames, frame)
+            self.frames.add(frame)
 
         if not sort_ttl:
             self.write_frame()
             return frame
 
-        while self.frames and self.frames[0].index == 0 and self.drain_connections:
+        while self.action_frames and self.drain_connections:
             min_ttl_connection = None
             for _ in range(len(self.drain_connections)):
                 connection = self.drain_connections.popleft()
@@ -385,6 +472,8 @@ class Center(EventEmitter):
                     continue
 
                 if not min_ttl_connection or min_ttl_connection._ttl > connection._ttl:
+                    if min_ttl_connection:
+                        self.drain_connections.append(min_ttl_connection)
                     min_ttl_connection = connection
                 else:
                     self.drain_connections.append(connection)
@@ -392,7 +481,7 @@ class Center(EventEmitter):
             if min_ttl_connection:
                 self.write_next(min_ttl_connection)
 
-        if self.frames and self.drain_connections:
+        if (self.action_frames or self.frames) and self.drain_connections:
             self.write_frame()
         return frame
 
@@ -401,17 +490,26 @@ class Center(EventEmitter):
             self.ack_loop = False
             return
 
-        now = time.time()
+        now, ack_delay = clock.time(), self.get_ack_delay()
         if self.sframe_count != last_sframe_count:
-            current().add_timeout(3, self.on_ack_loop, self.sframe_count, now)
+            add_timeout(ack_delay, self.on_ack_loop, self.sframe_count, now)
+            return
+
+        if self.recv_index - self.send_ack_index <= 8 and (start_time <= 0 or now - start_time < self.rtt.rto):
+            add_timeout(ack_delay, self.on_ack_loop, self.sframe_count, (now - ack_delay) if start_time <= 0 else start_time)
             return
 
-        if self.recv_index - self.send_ack_index <= 8 and (start_time <= 0 or now - start_time < 8):
-            current().add_timeout(3, self.on_ack_loop, self.sframe_count, (now - 2) if start_time <= 0 else start_time)
+        add_timeout(ack_delay, self.on_ack_loop, self.sframe_count + 1, now)
+        self.write_ack()
+
+    def on_quick_ack(self):
+        self.quick_ack = False
+        if self.closed or self.recv_index - 1 - self.send_ack_index < QUICK_ACK_FRAMES:
             return
+        self.write_ack()
 
-        current().add_timeout(3, self.on_ack_loop, self.sframe_count + 1, now)
-        now = int(time.time() * 1000000)
+    def write_ack(self):
+        now = int(clock.time() * 1000000)
         data = struct.pack("!QQ", int(now - self.ttl_remote_delay) if self.ttl_remote_delay else 0, now)
         self.write_action(ACTION_ACK, data, index=0, sort_ttl=False)
         self.ack_count += 1
@@ -423,20 +521,17 @@ class Center(EventEmitter):
 
         if len(self.session._connections) > 1 and self.ttl < 2200:
             data = []
-            current_index, last_index = self.recv_index, self.recv_frames[-1].index
+            current_index, last_index = self.recv_index, self.recv_frames.end - 1
 
-            now = time.time()
-            index, cdata, max_timeout = 0, [], max(self.ttl / 1000 * 6, 6)
+            now, lost_index = clock.time(), self.get_recv_lost_index()
+            cdata, cstart, lost_timeout = [], 0, self.rtt.rto
+            gap_timeout = max(self.rtt.rto * self.RECV_GAP_TIMEOUT_RTO, self.MIN_RECV_GAP_TIMEOUT)
             while current_index <= last_index:
-                if index >= len(self.recv_frames):
-                    break
-
-                recv_frame = self.recv_frames[index]
-                if recv_frame.index < current_index:
-                    index += 1
-                    continue
-
-                if recv_frame.index == current_index:
+                recv_frame = self.recv_frames.get(current_index)
+                if recv_frame is not None:
+                    if cstart:
+                        cdata.append((cstart, current_index - cstart))
+                    max_timeout = lost_timeout if current_index <= lost_index else gap_timeout
                     if cdata and recv_frame.resend_time:
                         if now - recv_frame.resend_time > max_timeout * 2:
                             data.extend(cdata)
@@ -445,56 +540,120 @@ class Center(EventEmitter):
                         data.extend(cdata)
                         recv_frame.resend_time = now
 
-                    cdata = []
-                    index += 1
-                else:
-                    cdata.append(struct.pack("!I", current_index))
+                    cdata, cstart = [], 0
+                elif not cstart:
+                    cstart = current_index
+                elif current_index - cstart >= 0xffff:
+                    cdata.append((cstart, current_index - cstart))
+                    cstart = current_index
                 current_index += 1
-                if len(data) >= 5776:
+                if len(data) >= 964:
                     break
 
             if len(data) > 0:
-                self.write_action(ACTION_RESEND, struct.pack("!I", len(data)) + b"".join(data), index=0)
-                current().add_timeout(2, self.on_ack_timeout_loop)
+                self.write_resend(data)
+                add_timeout(self.get_ack_timeout_interval(), self.on_ack_timeout_loop)
                 return
-        current().add_timeout(2, self.on_ack_timeout_loop)
+        add_timeout(self.get_ack_timeout_interval(), self.on_ack_timeout_loop)
+
+    def get_recv_lost_index(self):
+        lost_index = 0
+        for connection in self.session._connections:
+            if connection._closed:
+                continue
+            if not connection._rmax_index:
+                return 0
+            if not lost_index or connection._rmax_index < lost_index:
+                lost_index = connection._rmax_index
+        return lost_index
+
+    def check_recv_gap(self):
+        if not self.session or len(self.session._connections) <= 1:
+            return
+
+        current_index = max(self.recv_index, self.recv_gap_index)
+        lost_index = min(self.get_recv_lost_index(), self.recv_frames.end - 1)
+        if lost_index < current_index:
+            return
+
+        now = clock.time()
+        data, cstart = [], 0
+        while current_index <= lost_index:
+            recv_frame = self.recv_frames.get(current_index)
+            if recv_frame is not None:
+                if cstart:
+                    data.append((cstart, current_index - cstart))
+                    recv_frame.resend_time = now
+                cstart = 0
+            elif not cstart:
+                cstart = current_index
+            elif current_index - cstart >= 0xffff:
+                data.append((cstart, current_index - cstart))
+                cstart = current_index
+            current_index += 1
+            if len(data) >= 964:
+                break
+        self.recv_gap_index = cstart or current_index
+
+        if data:
+            self.write_resend(data)
+
+    def is_sack_supported(self):
+        for connection in self.session._connections:
+            if connection._sack and not connection._closed:
+                return True
+        return False
+
+    def write_resend(self, resend_ranges):
+        if self.is_sack_supported():
+            data = b"".join([self.SACK_RANGE_STRUCT.pack(start_index, count) for start_index, count in resend_ranges])
+            return self.write_action(ACTION_SACK, struct.pack("!H", len(resend_ranges)) + data, index=0)
+
+        resend_indexes = []
+        for start_index, count in resend_ranges:
+            resend_indexes.extend(range(start_index, min(start_index + count, start_index + self.MAX_RESEND_INDEXES - len(resend_indexes))))
+            if len(resend_indexes) >= self.MAX_RESEND_INDEXES:
+                break
+        self.write_action(ACTION_RESEND, struct.pack("!I%dI" % len(resend_indexes), len(resend_indexes), *resend_indexes), index=0)
 
     def on_send_timeout_loop(self, frame, ack_index):
         if self.closed:
             return
 
         if frame.ack_time == 0 and frame.index <= self.ack_index:
-            frame.ack_time = time.time()
+            frame.ack_time = clock.time()
 
         if frame.ack_time == 0 and abs(self.ack_index - ack_index) < 250 and len(self.send_frames) >= 32:
-            send_frames = []
             send_count = 0
             connections = {id(c) for c in self.session._connections} if self.session else set([])
-            for send_frame in self.send_frames:
-                if frame.connection == send_frame.connection and send_count < 32 and (connections - frame.used_connections):
-                    if not self.frames or send_frame.index >= self.frames[-1].index:
-                        self.frames.append(send_frame)
-                    else:
-                        bisect.insort(self.frames, send_frame)
+            if frame.has_unused_connection(connections):
+                for send_frame in self.send_frames:
+                    if frame.connection != send_frame.connection:
+                        continue
+                    self.frames.add(self.send_frames.remove(send_frame.index))
+                    if send_frame.connection._congestion:
+                        send_frame.connection._congestion.on_lost()
                     send_count += 1
                     self.resended_count += 1
-                else:
-                    send_frames.append(send_frame)
-            self.send_frames = send_frames
-            if frame.connection and frame.connection._connection and frame.send_timeout_count >= 2:
+                    if send_count >= 32:
+                        break
+            if frame.connection and frame.connection._connection and frame.send_timeout_count >= 2 \
+                    and clock.time() - frame.send_time >= self.SEND_TIMEOUT_CLOSE:
                 connection = frame.connection._connection
                 connection.close()
                 logging.info("xstream session %s center %s %s send timeout close %s %s %s %s", self.session, self, connection, frame.index, self.send_index, self.ack_index, frame.send_timeout_count)
-            current().add_async(self.write_frame)
+            clock.current().add_async(self.write_frame)
 
         if self.send_frames:
-            for send_frame in self.send_frames:
-                if send_frame.index != 0:
-                    current().add_timeout(max(min(60, math.sqrt(self.ttl * 20) - (time.time() - send_frame.send_time)), 20), self.on_send_timeout_loop, send_frame, self.ack_index)
-                    self.send_timeout_loop = True
-                    send_frame.send_timeout_count += 1
-                    return
+            send_frame = self.send_frames.first()
+            add_timeout(max(self.get_send_timeout(send_frame) - (clock.time() - send_frame.send_time), self.rtt.GRANULARITY),
+                        self.on_send_timeout_loop, send_frame, self.ack_index)
+            self.send_timeout_loop = True
+            self.send_timeout_frame = send_frame
+            send_frame.send_timeout_count += 1
+            return
         self.send_timeout_loop = False
+        self.send_timeout_frame = None
 
     def write_ttl(self, last_write_ttl_time=0, last_send_index=0, last_recv_index=0, rewrite_timeout=0):
         if self.closed:
@@ -502,9 +661,9 @@ class Center(EventEmitter):
 
         try:
             if self.ttl_changing:
-                self.on_ttl_ack(5000)
+                self.on_ttl_timeout()
 
-            now = time.time()
+            now = clock.time()
             require_write = False
 
             if last_write_ttl_time and last_send_index and last_recv_index:
@@ -520,9 +679,9 @@ class Center(EventEmitter):
                         require_write = True
                     elif p_send_index >= 1077 or p_recv_index >= 1077:
                         require_write = True
-                    elif len(self.recv_frames) >= 8 and now - self.recv_frames[0].recv_time >= 8:
+                    elif len(self.recv_frames) >= 8 and now - self.recv_frames.first().recv_time >= 8:
                         require_write = True
-                    elif len(self.send_frames) >= 16 and now - self.send_frames[0].send_time >= 8:
+                    elif len(self.send_frames) >= 16 and now - self.send_frames.first().send_time >= 8:
                         require_write = True
 
                 if not require_write and last_write_ttl_timeout >= 13:
@@ -530,9 +689,9 @@ class Center(EventEmitter):
                         require_write = True
                     elif p_send_index >= 538 or p_recv_index >= 538:
                         require_write = True
-                    elif self.recv_frames and len(self.recv_frames) < 8 and now - self.recv_frames[0].recv_time >= 12:
+                    elif self.recv_frames and len(self.recv_frames) < 8 and now - self.recv_frames.first().recv_time >= 12:
                         require_write = True
-                    elif self.send_frames and len(self.send_frames) < 16 and now - self.send_frames[0].send_time >= 12:
+                    elif self.send_frames and len(self.send_frames) < 16 and now - self.send_frames.first().send_time >= 12:
                         require_write = True
                     elif len(self.recv_frames) >= 16 and p_recv_index <= 16:
                         require_write = True
@@ -542,9 +701,9 @@ class Center(EventEmitter):
                 if not require_write and last_write_ttl_timeout >= 28:
                     if p_send_index >= 359 or p_recv_index >= 359:
                         require_write = True
-                    elif len(self.recv_frames) >= 2 and now - self.recv_frames[0].recv_time >= 43:
+                    elif len(self.recv_frames) >= 2 and now - self.recv_frames.first().recv_time >= 43:
                         require_write = True
-                    elif len(self.send_frames) >= 4 and now - self.send_frames[0].send_time >= 43:
+                    elif len(self.send_frames) >= 4 and now - self.send_frames.first().send_time >= 43:
                         require_write = True
 
                 if not require_write and last_write_ttl_timeout >= 58:
@@ -566,34 +725,78 @@ class Center(EventEmitter):
             self.ttl_changing = True
             last_write_ttl_time, rewrite_timeout = now, random.randint(300, 600)
         finally:
-            current().add_timeout(5, self.write_ttl, last_write_ttl_time, self.send_index,
+            current_wheel().add_timeout(5, self.write_ttl, last_write_ttl_time, self.send_index,
                                   self.recv_index, rewrite_timeout)
 
+    def update_rtt(self, rtt):
+        self.rtt.update(rtt)
+        self.ttl = max(self.rtt.srtt * 1000, 50)
+
+    def get_ack_delay(self):
+        if not self.rtt.sample_count:
+            return self.MAX_ACK_DELAY
+        return min(max(self.rtt.srtt / 2.0, self.MIN_ACK_DELAY), self.MAX_ACK_DELAY)
+
+    def get_ack_timeout_interval(self):
+        return min(max(self.rtt.rto / 2.0, self.MIN_ACK_DELAY), self.MAX_ACK_DELAY)
+
+    def get_frame_srtt(self, frame):
+        if frame.connection and frame.connection._rtt.sample_count:
+            return max(frame.connection._rtt.srtt, self.rtt.GRANULARITY)
+        return max(self.rtt.srtt, self.rtt.GRANULARITY)
+
+    def get_send_timeout(self, frame):
+        connection, rto = frame.connection, self.rtt.get_backoff_rto(frame.send_timeout_count)
+        if connection:
+            rto = max(connection._rtt.get_backoff_rto(frame.send_timeout_count), rto) + connection.get_queue_time()
+        return min(rto + self.get_ack_delay() * 2, self.rtt.MAX_RTO)
+
     def on_ttl_ack(self, ack_time):
         self.ttl_changing = False
-        self.ttl = max(float(self.ttl + ack_time) / 2.0, 50)
+        self.update_rtt(ack_time / 1000.0)
         logging.info("stream session %s center proactive <%s, (%s %s %s %s) (%s %s %s %s) (%s %s %s %s %s) > ttl %.3fms %s", self.session, self,
                      self.send_index, self.ack_index, len(self.frames), len(self.send_frames),
-                     self.recv_index, len(self.recv_frames), self.recv_frames[0].index if self.recv_frames else 0,
-                     self.recv_frames[-1].index if self.recv_frames else 0,
+                     self.recv_index, len(self.recv_frames), self.recv_frames.start if self.recv_frames else 0,
+                     self.recv_frames.end - 1 if self.recv_frames else 0,
                      self.droped_count, self.resended_count, self.sframe_count, self.rframe_count, self.ack_count,
                      self.ttl, self.session.get_ttl_info() if self.session else "")
 
-    def on_ready_streams_lookup(self):
-        self.sort_stream()
-        if self.ready_streams and len(self.ready_streams) > 1 and not self.closed:
-            self.ready_streams_lookup_timeout = current().add_timeout(1, self.on_ready_streams_lookup)
-        else:
-            self.ready_streams_lookup_timeout = None
+    def on_ttl_timeout(self):
+        self.ttl_changing = False
+        self.rtt.on_timeout()
+        logging.info("stream session %s center ttl timeout rto %.3fms", self.session, self.rtt.rto * 1000)
 
     def close(self):
         if not self.closed:
             while self.ready_streams:
-                stream = self.ready_streams.pop(0)
+                stream = self.ready_streams.first()
+                self.ready_streams.remove(stream)
                 stream.do_close()
             self.closed = True
             self.remove_all_listeners()
             logging.info("xstream session %s center %s close", self.session, self)
 
+    def stats(self):
+        return {
+            "send_index": self.send_index,
+            "ack_index": self.ack_index,
+            "recv_index": self.recv_index,
+            "frames": len(self.frames),
+            "send_frames": len(self.send_frames),
+            "recv_frames": len(self.recv_frames),
+            "ready_streams": len(self.ready_streams),
+            "ttl": self.ttl,
+            "srtt": self.rtt.srtt * 1000,
+            "rttvar": self.rtt.rttvar * 1000,
+            "rto": self.rtt.rto * 1000,
+            "droped_count": self.droped_count,
+            "resended_count": self.resended_count,
+            "sframe_count": self.sframe_count,
+            "rframe_count": self.rframe_count,
+            "ack_count": self.ack_count,
+            "ack_histogram": self.ack_histogram.stats(),
+            "reorder_histogram": self.reorder_histogram.stats(),
+        }
+
     def __del__(self):
         self.close()
@@ -11,25 +11,148 @@ import random
 import hashlib
 from sevent import EventEmitter, current, tcp
 from .session import Session
-from .crypto import Crypto, rand_string, xor_string, sign_string, CIPHER_SUITES
+from .crypto import Crypto, rand_string, xor_string, sign_string, get_backend_stats, load_crypto_backend, CIPHER_SUITES
 from .frame import StreamFrame
+from .timer import current_wheel
+from . import stats
+
+try:
+    RAMP_UP_CONNECTIONS = max(int(os.environ.get("XSTREAM_RAMP_UP_CONNECTIONS", 4)), 1)
+except:
+    RAMP_UP_CONNECTIONS = 4
+
+RAMP_UP_RATE = 262144
+RAMP_UP_QUEUE_FRAMES = 64
+RAMP_UP_CHECK_TIME = 1 if RAMP_UP_CONNECTIONS > 1 else 5
+
+class ConnectionAutoscaler(object):
+    UTILIZATION = 0.75
+    PROBE_GAIN = 1.1
+    RATE_DECAY = 0.98
+    SHRINK_CHECK_COUNT = 30
+    LIMIT_TIMEOUT = 120
+    PROBE_TIMEOUT = 15
+
+    def __init__(self, min_connections, max_connections):
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.target = min_connections
+        self.limit = max_connections
+        self.limit_time = 0
+        self.goodput = 0
+        self.bandwidth = 0
+        self.connection_rate = 0
+        self.rtt = 0
+        self.needed = min_connections
+        self.grow_target = 0
+        self.probe_count = 0
+        self.probe_goodput = 0
+        self.probe_connection_count = 0
+        self.probe_time = 0
+        self.shrink_count = 0
+        self.action = ""
+        self.action_time = 0
+
+    def get_bdp(self):
+        return self.bandwidth * self.rtt
+
+    def get_window(self):
+        return max(self.connection_rate, RAMP_UP_RATE) * self.rtt
+
+    def get_needed(self, connection_count, backlogged):
+        connection_rate = max(self.connection_rate, RAMP_UP_RATE)
+        if backlogged and self.goodput >= connection_count * RAMP_UP_RATE / 4.0:
+            return max(int(math.ceil(self.bandwidth / connection_rate)), connection_count) * 2
+        return int(math.ceil(self.goodput / (connection_rate * self.UTILIZATION)))
+
+    def is_ramp_up(self, goodput, connection_count, backlogged):
+        return backlogged or goodput >= connection_count * max(self.connection_rate, RAMP_UP_RATE)
+
+    def update(self, now, goodput, connection_rates, rtt, connection_count, backlogged):
+        self.goodput = goodput
+        self.bandwidth = max(goodput, self.bandwidth * self.RATE_DECAY)
+        if backlogged and connection_rates:
+            self.connection_rate = max(max(connection_rates), self.connection_rate * self.RATE_DECAY)
+        if rtt:
+            self.rtt = rtt
+        if self.limit < self.max_connections and now - self.limit_time >= self.LIMIT_TIMEOUT:
+            self.limit = self.max_connections
+
+        if self.probe_count and connection_count >= self.probe_count:
+            if backlogged and goodput < self.probe_goodput * self.PROBE_GAIN:
+                self.limit, self.limit_time = max(self.probe_connection_count, self.min_connections), now
+                self.set_action(now, "saturated")
+            self.probe_count = 0
+        elif self.probe_count and now - self.probe_time >= self.PROBE_TIMEOUT:
+            self.probe_count = 0
+
+        self.needed = self.get_needed(connection_count, backlogged)
+        target = min(max(self.needed, self.min_connections), self.limit, self.max_connections)
+        if target > connection_count:
+            self.shrink_count = 0
+            self.target = target
+            grow_target = min(self.needed, target)
+            if grow_target <= connection_count:
+                self.grow_target = 0
+                return 0
+            if grow_target != self.grow_target:
+                if not self.probe_count and connection_count:
+                    self.probe_count, self.probe_goodput = grow_target, goodput
+                    self.probe_connection_count, self.probe_time = connection_count, now
+                self.grow_target = grow_target
+                self.set_action(now, "grow")
+            return grow_target - connection_count
+        self.grow_target = 0
+        if target < connection_count:
+            self.shrink_count += 1
+            if self.shrink_count >= self.SHRINK_CHECK_COUNT or connection_count > self.limit:
+                self.shrink_count = 0
+                self.target = target
+                self.set_action(now, "shrink")
+                return -1
+            return 0
+        self.shrink_count = 0
+        self.target = target
+        return 0
+
+    def set_action(self, now, action):
+        self.action = action
+        self.action_time = now
+
+    def stats(self):
+        return {
+            "target": self.target,
+            "needed": self.needed,
+            "limit": self.limit,
+            "goodput": self.goodput,
+            "bandwidth": self.bandwidth,
+            "connection_rate": self.connection_rate,
+            "rtt": self.rtt * 1000,
+            "bdp": self.get_bdp(),
+            "window": self.get_window(),
+            "action": self.action,
+            "action_time": self.action_time,
+        }
 
 class Client(EventEmitter):
-    def __init__(self, host, port, max_connections=4, crypto_key='', crypto_alg='', session_id=0):
+    def __init__(self, host, port, max_connections=4, crypto_key='', crypto_alg='', session_id=0, min_connections=None):
         super(Client, self).__init__()
 
         self._host = host
         self._port = port
         self._host_index = 0
         self._max_connections = max_connections
+        self._min_connections = max(min(min_connections or max_connections, max_connections), 1)
+        self._autoscaler = ConnectionAutoscaler(self._min_connections, max_connections)
         self._connections = []
+        self._expiring_connections = []
         self._init_session_id = session_id
         self._session = None
         self._auth_key = None
         self._crypto_key = crypto_key
         self._crypto_alg = crypto_alg
         self.fork_auth_session_id = rand_string(32)
-        self._connecting = None
+        self._connectings = []
         self._connecting_time = 0
         self._reconnect_count = 0
         self._fork_auth_fail_count = 0
@@ -101,14 +224,18 @@ class Client(EventEmitter):
         self._session_removed = True
         logging.info("xstream remove session %s %s %s", self, session_key, self._session)
 
-    def init_connection(self, is_delay = True, delay_rate = None, connect_next = False):
+    def get_connection_count(self):
+        expiring_connections = {connection._connection for connection in self._expiring_connections}
+        return len([connection for connection in self._connections if connection not in expiring_connections])
+
+    def init_connection(self, is_delay = True, delay_rate = None, connect_next = False, ramp_up = 0):
         if not self._session or self._session.closed:
             return
 
-        if self._connecting is not None:
+        if self._connectings and not ramp_up:
             return
 
-        if len(self._connections) >= self._max_connections:
+        if self.get_connection_count() >= self._autoscaler.target:
             if self.init_connection_timeout_handler:
                 current().cancel_timeout(self.init_connection_timeout_handler)
                 self.init_connection_timeout_handler = None
@@ -116,8 +243,8 @@ class Client(EventEmitter):
             self.init_connection_delay_rate = 1
             return
         
-        def do_init_connection():
-            if self._connecting is not None:
+        def do_init_connection(connect_count=1):
+            if self._connectings and not ramp_up:
                 return
 
             if self.init_connection_timeout_handler:
@@ -130,14 +257,14 @@ class Client(EventEmitter):
                     or (self._connections and not self._session.key_exchanged):
                 return
             
-            if len(self._connections) >= self._max_connections:
-                return
-            
-            self._connecting = self.fork_connection()
-            self._connecting_time = time.time()
+            for _ in range(min(connect_count, self._autoscaler.target - self.get_connection_count())):
+                self._connectings.append(self.fork_connection())
+                self._connecting_time = time.time()
 
         if not self._connections:
             do_init_connection()
+        elif self._session.key_exchanged and ramp_up:
+            do_init_connection(ramp_up - len(self._connectings))
         elif self._session.key_exchanged and not is_delay:
             do_init_connection()
         else:
@@ -159,28 +286,73 @@ class Client(EventEmitter):
             else:
                 self.init_connection_delay_rate = 1
 
-    def on_init_connection_timeout(self, session, last_rdata_lens):
-        if not self._session or self._session != session:
+    def on_connection_expiring(self, connection):
+        if connection in self._expiring_connections or connection._closed:
             return
+        self._expiring_connections.append(connection)
+        self.init_connection(False)
+        logging.info("xstream client %s connection expiring %s %s", self, connection, len(self._connections))
+
+    def close_expiring_connection(self):
+        while self._expiring_connections:
+            connection = self._expiring_connections.pop(0)
+            if not connection._closed:
+                connection.close()
+                logging.info("xstream client %s connection expiring close %s %s", self, connection, len(self._connections))
+                return
+
+    def close_surplus_connection(self):
+        if self._expiring_connections:
+            return self.close_expiring_connection()
 
-        if len(self._session._connections) >= self._max_connections:
-            current().add_timeout(5, self.on_init_connection_timeout, self._session, {})
+        connections = [conn for conn in self._session._connections if not conn._closed]
+        if len(connections) <= self._min_connections:
             return
+        connection = max(connections, key=lambda conn: (conn._srtt, -conn._start_time))
+        connection.close()
+        logging.info("xstream client %s connection surplus close %s %s", self, connection, len(self._connections))
 
-        rdata_counts, rdata_count = {}, 0
-        for conn in self._session._connections:
-            rdata_count += conn._rdata_len + conn._wdata_len - last_rdata_lens.get(id(conn), 0)
-            rdata_counts[id(conn)] = conn._rdata_len + conn._wdata_len
+    def is_center_backlogged(self):
+        center = self._session._center
+        if not center:
+            return False
+        return len(center.frames) >= RAMP_UP_QUEUE_FRAMES or bool(center.ready_streams and not center.drain_connections)
 
-        if last_rdata_lens:
-            if rdata_count > len(self._session._connections) * 1310720:
-                self.init_connection(False)
-            elif self._session._center.ttl >= len(self._session._connections) * 720:
-                self.init_connection(False)
+    def on_init_connection_timeout(self, session, last_rdata_lens, last_time=0):
+        if not self._session or self._session != session:
+            return
 
-        current().add_timeout(5, self.on_init_connection_timeout, self._session, rdata_counts)
+        now, rdata_counts, rdata_count, connection_rates, rtts = time.time(), {}, 0, [], []
+        for conn in self._session._connections:
+            data_len = conn._rdata_len + conn._wdata_len
+            rdata_counts[id(conn)] = data_len
+            if conn._closed or conn in self._expiring_connections:
+                continue
+            if id(conn) in last_rdata_lens and now > last_time:
+                connection_rates.append((data_len - last_rdata_lens[id(conn)]) / (now - last_time))
+            rdata_count += data_len - last_rdata_lens.get(id(conn), 0)
+            if conn._rtt.sample_count:
+                rtts.append(conn._rtt.srtt)
+
+        if last_rdata_lens and now > last_time:
+            connection_count = len([conn for conn in self._session._connections
+                                    if not conn._closed and conn not in self._expiring_connections])
+            goodput, backlogged = rdata_count / (now - last_time), self.is_center_backlogged()
+            connect_count = self._autoscaler.update(now, goodput, connection_rates,
+                                                    sum(rtts) / len(rtts) if rtts else 0, connection_count,
+                                                    backlogged)
+            if connect_count > 0 and self._autoscaler.is_ramp_up(goodput, connection_count, backlogged):
+                self.init_connection(False, ramp_up=min(connect_count, RAMP_UP_CONNECTIONS))
+            elif connect_count > 0:
+                self.init_connection()
+            elif connect_count < 0:
+                self.close_surplus_connection()
+
+        current().add_timeout(RAMP_UP_CHECK_TIME, self.on_init_connection_timeout, self._session, rdata_counts, now)
 
     def open(self):
+        load_crypto_backend(self._crypto_alg, self.get_session_path())
+        stats.register(self)
         session = self.load_session()
         if session:
             self._session = session
@@ -190,14 +362,14 @@ class Client(EventEmitter):
 
             self.running = True
             self.init_connection(False)
-            current().add_timeout(5, self.on_init_connection_timeout, self._session, {})
+            current().add_timeout(RAMP_UP_CHECK_TIME, self.on_init_connection_timeout, self._session, {})
             self._session.write_action(0x01)
             logging.info("xstream client %s session open", self)
             return
 
         self.opening = True
         self._connections = []
-        self._connecting = None
+        self._connectings = []
         self._auth_key = self.get_auth_key()
         connection = tcp.Socket()
         connection.enable_nodelay()
@@ -229,6 +401,20 @@ class Client(EventEmitter):
         for connection in self._connections:
             connection.close()
 
+    def stats(self):
+        return {
+            "host": self._host,
+            "port": self._port,
+            "max_connections": self._max_connections,
+            "min_connections": self._min_connections,
+            "target_connections": self._autoscaler.target,
+            "autoscaler": self._autoscaler.stats(),
+            "crypto": get_backend_stats(),
+            "connection_count": len(self._connections),
+            "connecting": len(self._connectings),
+            "session": self._session.stats() if self._session else None,
+        }
+
     def on_connect(self, connection):
         connection.is_connected = True
         crypto_time = int(time.time())
@@ -265,7 +451,7 @@ class Client(EventEmitter):
             self._session_removed = False
             self.save_session()
             self._session.write_action(0x01)
-            current().add_timeout(5, self.on_init_connection_timeout, self._session, {})
+            current().add_timeout(RAMP_UP_CHECK_TIME, self.on_init_connection_timeout, self._session, {})
             logging.info("xstream client %s session %s open", self, self._session)
             return
         connection.close()
@@ -308,7 +494,7 @@ class Client(EventEmitter):
         if not self._session:
             return connection.close()
 
-        crypto_time = int(time.time())
+        crypto_time = self._session.get_fork_crypto_time()
         cipher_suites = {cs: True for cs in CIPHER_SUITES}
         session_id = self._session.id
         rcipher_suites = [struct.pack("!H", session_id)]
@@ -388,19 +574,23 @@ class Client(EventEmitter):
                     return
 
                 current().add_async(connection.on_ping_loop)
+                connection.on("expiring", self.on_connection_expiring)
                 def on_expried(is_close=False):
                     if self._session and not self._session.key_exchanged and len(self._connections) <= 1:
-                        current().add_timeout(random.randint(5, 15), on_expried)
-                    elif not is_close and len(self._connections) <= 1:
-                        self.init_connection(False)
-                        current().add_timeout(random.randint(5, 15), on_expried, True)
+                        connection._expried_seconds_timer = current_wheel().add_timeout(random.randint(5, 15), on_expried)
+                    elif not is_close:
+                        connection.expiring()
+                        connection._expried_seconds_timer = current_wheel().add_timeout(connection.EXPRIED_LEAD_TIME, on_expried, True)
                     else:
                         connection.on_expried()
-                connection._expried_seconds_timer = current().add_timeout(connection._expried_seconds, on_expried)
-                connection._expried_data_timer = current().add_timeout(15, connection.on_check_data_loop)
+                connection._expried_seconds_timer = current_wheel().add_timeout(max(connection._expried_seconds - connection.EXPRIED_LEAD_TIME,
+                                                                                    connection._expried_seconds / 2.0), on_expried)
+                connection._expried_data_timer = current_wheel().add_timeout(15, connection.on_check_data_loop)
+                self.close_expiring_connection()
 
             current().add_async(add_connection, connection)
-            self._connecting = None
+            if connection in self._connectings:
+                self._connectings.remove(connection)
             self._reconnect_count = 0
             self.init_connection()
             connection.is_connected_session = True
@@ -419,8 +609,9 @@ class Client(EventEmitter):
         conn = self._session.remove_connection(connection)
         if connection in self._connections:
             self._connections.remove(connection)
-        if self._connecting == connection:
-            self._connecting = None
+        self._expiring_connections = [c for c in self._expiring_connections if c._connection is not connection]
+        if connection in self._connectings:
+            self._connectings.remove(connection)
 
         if connection.is_connected_xstream and not connection.is_connected_session and not self._connections:
             self._fork_auth_fail_count += 1
@@ -480,7 +671,8 @@ class Client(EventEmitter):
             self.save_session()
             self._session = None
             self._connections = []
-            self._connecting = None
+            self._expiring_connections = []
+            self._connectings = []
             self.opening = False
             self.running = False
             self.init_connection_timeout = None
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import time as _time
+from sevent import current as _current
+
+time = _time.time
+current = _current
+
+def install(time_func=None, current_func=None):
+    global time, current
+    time = time_func or _time.time
+    current = current_func or _current
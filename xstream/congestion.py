@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+from . import clock
+
+try:
+    INIT_CWND = min(int(os.environ.get("XSTREAM_CWND", 0)), 0x10000)
+except:
+    INIT_CWND = 0
+
+try:
+    PACING_GAIN = float(os.environ.get("XSTREAM_PACING", 0))
+except:
+    PACING_GAIN = 0
+
+try:
+    MIN_RTO = max(float(os.environ.get("XSTREAM_MIN_RTO", 0.2)), 0.01)
+except:
+    MIN_RTO = 0.2
+
+QUICK_ACK_FRAMES = max(INIT_CWND // 4, 4) if INIT_CWND else 0
+
+class RttEstimator(object):
+    ALPHA = 0.125
+    BETA = 0.25
+    K = 4
+    GRANULARITY = 0.01
+    INIT_RTO = 1
+    MAX_RTO = 60
+
+    def __init__(self, min_rto=MIN_RTO):
+        self.min_rto = min_rto
+        self.srtt = 0
+        self.rttvar = 0
+        self.rto = self.INIT_RTO
+        self.sample_count = 0
+
+    def update(self, rtt):
+        if rtt < 0:
+            return
+        if not self.sample_count:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.sample_count += 1
+        self.rto = min(max(self.srtt + max(self.GRANULARITY, self.K * self.rttvar), self.min_rto), self.MAX_RTO)
+
+    def on_timeout(self):
+        self.rto = min(self.rto * 2, self.MAX_RTO)
+
+    def get_backoff_rto(self, count):
+        return min(self.rto * (2 ** min(count, 8)), self.MAX_RTO)
+
+    def stats(self):
+        return {
+            "srtt": self.srtt * 1000,
+            "rttvar": self.rttvar * 1000,
+            "rto": self.rto * 1000,
+        }
+
+class CongestionControl(object):
+    MIN_CWND = 4
+    MAX_CWND = 0x10000
+
+    def __init__(self, connection, cwnd=INIT_CWND, pacing_gain=PACING_GAIN):
+        self.connection = connection
+        self.cwnd = float(max(cwnd, self.MIN_CWND))
+        self.ssthresh = self.MAX_CWND
+        self.inflight = 0
+        self.loss_time = 0
+        self.pacing_gain = pacing_gain
+        self.pacing_time = 0
+        self.min_rtt = 0
+        self.acked_count = 0
+        self.lost_count = 0
+
+    def is_writable(self, now):
+        return self.inflight < self.cwnd and (not self.pacing_gain or self.pacing_time <= now)
+
+    def on_sent(self, now):
+        self.inflight += 1
+        if self.pacing_gain and self.connection._srtt:
+            self.pacing_time = max(self.pacing_time, now) + self.connection._srtt / 1000.0 / (self.cwnd * self.pacing_gain)
+
+    def on_acked(self, rtt):
+        self.inflight = max(self.inflight - 1, 0)
+        self.acked_count += 1
+        if not self.min_rtt or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        elif rtt > self.min_rtt * 2 + 0.01:
+            return
+        if self.cwnd < self.ssthresh:
+            self.cwnd = min(self.cwnd + 1, self.MAX_CWND)
+        else:
+            self.cwnd = min(self.cwnd + 1.0 / self.cwnd, self.MAX_CWND)
+
+    def on_lost(self):
+        self.inflight = max(self.inflight - 1, 0)
+        self.lost_count += 1
+        now = clock.time()
+        if now - self.loss_time < max(self.connection._srtt / 1000.0, 0.05):
+            return
+        self.loss_time = now
+        self.ssthresh = max(self.cwnd / 2.0, self.MIN_CWND)
+        self.cwnd = self.ssthresh
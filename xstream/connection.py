@@ -2,34 +2,57 @@
 #14-4-24
 # create by: snower
 
-import time
+import os
 import logging
 import random
 import struct
 import socket
-from sevent import EventEmitter, current
+from sevent import EventEmitter
 from sevent.errors import SocketClosed
-from .crypto import rand_string
+from . import clock
+from .crypto import rand_string, is_aead_supported, AEAD_ALGS, AEAD_TAG_LEN
 from .utils import format_data_len
 from .frame import Frame, StreamFrame
+from .timer import current_wheel
+from .congestion import CongestionControl, RttEstimator, INIT_CWND
+from .stats import Histogram
 
 ACTION_CLOSE = 0x03
 ACTION_CLOSE_ACK = 0x04
 ACTION_READY = 0x05
 ACTION_NOISE = 0x06
+ACTION_BATCH = 0x07
+ACTION_BATCH_READY = 0x08
+ACTION_AEAD_READY = 0x09
+ACTION_AEAD_START = 0x0a
+ACTION_SACK_READY = 0x0b
 ACTION_PING = 0x11
 ACTION_PINGACKPING = 0x12
 ACTION_PINGACK = 0x13
 ACTION_PINGACKACK = 0x14
 
+try:
+    BATCH_WRITE_SIZE = min(int(os.environ.get("XSTREAM_BATCH_WRITE", 0)), 0xffe0)
+except:
+    BATCH_WRITE_SIZE = 0
+
+AEAD_ALG = os.environ.get("XSTREAM_AEAD", "").lower()
+if AEAD_ALG not in AEAD_ALGS:
+    AEAD_ALG = ""
+
 class Connection(EventEmitter):
     FRAME_STRUCT = struct.Struct("!BBII")
     STREAM_FRAME_STRUCT = struct.Struct("!BBIIHBI")
     LEN_STRUCT = struct.Struct("!H")
+    MIN_PING_TIMEOUT = 15
+    MAX_PING_TIMEOUT = 60
+    PING_INTERVAL_RTO = 100
+    PING_DELAYED_RTO = 3
+    EXPRIED_LEAD_TIME = 30
 
     def __init__(self, connection, session):
         super(Connection, self).__init__()
-        self.loop = current()
+        self.loop = clock.current()
         self._connection = connection
         self._session = session
         self._crypto = connection.crypto
@@ -43,32 +66,57 @@ class Connection(EventEmitter):
         self._connection.on_drain(self.on_drain)
 
         self._read_header = False
-        self._start_time = time.time()
+        self._start_time = clock.time()
         self._brdata_len = 5
         self._bwdata_len = 0
-        self._wait_head = True
+        self._rbuffer = b''
+        self._rcrypto_buffer = bytearray(65536)
+        self._rcrypto_view = memoryview(self._rcrypto_buffer)
+        self._wcrypto_buffer = bytearray(b'\x17\x03\x03') + bytearray(65536)
+        self._wcrypto_view = memoryview(self._wcrypto_buffer)
+        self._raead = False
+        self._waead = False
+        self._sack = False
+        self._wbatch = []
+        self._wbatch_len = 0
+        self._wbatch_size = 0
+        self._wbatch_flushing = False
         self._closed = False
         self._finaled = False
-        self._data_time = time.time()
+        self._data_time = clock.time()
         self._ping_time = 0
         self._ping_ack_time = 0
         self._ping_timer = None
         self._ping_delayed_count = 0
         self._ttl = 0
+        self._srtt = 0
+        self._rtt = RttEstimator()
+        self._rtt_histogram = Histogram()
+        self._wqueue_len = 0
+        self._wqueue_time = 0
+        self._wrate = 0
+        self._congestion = CongestionControl(self) if INIT_CWND else None
         self._rdata_len = 0
         self._wdata_len = 0
         self._rpdata_count = 0
         self._wpdata_count = 0
         self._rfdata_count = 0
         self._wfdata_count = 0
-        self._rlast_index = 0
+        self._rmax_index = 0
         self._wlast_index = 0
         self._expried_seconds = random.randint(180, 1800)
         self._expried_seconds_timer = None
         self._expried_data = random.randint(8 * 1024 * 1024, 16 * 1024 * 1024)
         self._expried_data_timer = None
+        self._expiring = False
         self._close_timeout_timer = None
 
+        if BATCH_WRITE_SIZE:
+            self.write_action(ACTION_BATCH_READY, self.LEN_STRUCT.pack(BATCH_WRITE_SIZE))
+        if AEAD_ALG and self.is_aead_supported(AEAD_ALG):
+            self.write_action(ACTION_AEAD_READY, struct.pack("!B", AEAD_ALGS.index(AEAD_ALG)))
+        self.write_action(ACTION_SACK_READY)
+
     def start(self):
         self.loop.add_async(self.emit_drain, self)
 
@@ -79,12 +127,16 @@ class Connection(EventEmitter):
             buffer.read(51)
             self._read_header = True
 
-        self._data_time = time.time()
+        self._data_time = clock.time()
         self._rpdata_count += 1
         if buffer._len >= self._brdata_len:
             self.read(buffer)
 
     def on_drain(self, connection):
+        if self._wqueue_len:
+            wrate = self._wqueue_len / max(clock.time() - self._wqueue_time, 0.001)
+            self._wrate = (self._wrate * 0.875 + wrate * 0.125) if self._wrate else wrate
+            self._wqueue_len = 0
         self.emit_drain(self)
 
     def on_close(self, connection):
@@ -93,76 +145,161 @@ class Connection(EventEmitter):
         self._session, session = None, self._session
         self.remove_all_listeners()
         if self._ping_timer:
-            self.loop.cancel_timeout(self._ping_timer)
+            current_wheel().cancel_timeout(self._ping_timer)
             self._ping_timer = None
         if self._expried_seconds_timer:
-            self.loop.cancel_timeout(self._expried_seconds_timer)
+            current_wheel().cancel_timeout(self._expried_seconds_timer)
             self._expried_seconds_timer = None
         if self._expried_data_timer:
-            self.loop.cancel_timeout(self._expried_data_timer)
+            current_wheel().cancel_timeout(self._expried_data_timer)
             self._expried_data_timer = None
         if self._close_timeout_timer:
-            self.loop.cancel_timeout(self._close_timeout_timer)
+            current_wheel().cancel_timeout(self._close_timeout_timer)
             self._close_timeout_timer = None
         logging.info("xstream session %s connection %s close %.2fs %s %s %s %s %s %s", session, self,
-                     time.time() - self._start_time, 
+                     clock.time() - self._start_time, 
                      format_data_len(self._rdata_len), self._rfdata_count, self._rpdata_count,
                      format_data_len(self._wdata_len), self._wfdata_count, self._wpdata_count)
 
     def read(self, buffer):
-        while buffer._len >= self._brdata_len:
-            data = buffer.read(self._brdata_len)
-            if self._wait_head:
-                self._wait_head = False
-                self._brdata_len, = self.LEN_STRUCT.unpack(data[3:])
+        data = buffer.read()
+        if self._rbuffer:
+            data = self._rbuffer + data
+        data_len, index = len(data), 0
+        view = memoryview(data)
+
+        while data_len - index >= 5:
+            record_len, = self.LEN_STRUCT.unpack_from(data, index + 3)
+            if data_len - index - 5 < record_len:
+                break
+            if self.read_record(view[index + 5: index + 5 + record_len]) is False:
+                return
+            self._rdata_len += record_len + 5
+            index += record_len + 5
+
+        if index >= data_len:
+            self._rbuffer = b''
+            self._brdata_len = 5
+        else:
+            self._rbuffer = data[index:]
+            if data_len - index < 5:
+                self._brdata_len = 5 - (data_len - index)
             else:
-                self._wait_head = True
-                self._brdata_len = 5
-                data = self._crypto.decrypt(data)
-
-                if data[0] == 0:
-                    if data[1] == 0 and len(data) >= 17:
-                        unpack_data = Frame.STREAM_FRAME_STRUCT.unpack(data[1:17])
-                        stream_frame = StreamFrame(*unpack_data[3:], data=data[17:])
-                        frame = Frame(*unpack_data[:3], data=stream_frame, connection=self)
-                    else:
-                        frame = Frame(*Frame.FRAME_STRUCT.unpack(data[1:10]), data=data[10:], connection=self)
-                    self._rlast_index = frame.index or self._rlast_index
-                    self.emit_frame(self, frame)
-                    self._rfdata_count += 1
-                else:
-                    self.on_action(data[0], data[1:])
-                self._rdata_len += len(data) + 5
+                self._brdata_len = self.LEN_STRUCT.unpack_from(data, index + 3)[0] + 5 - (data_len - index)
+
+    def read_record(self, record):
+        if len(record) + 32 > len(self._rcrypto_buffer):
+            self._rcrypto_buffer = bytearray(len(record) * 2 + 32)
+            self._rcrypto_view = memoryview(self._rcrypto_buffer)
+        if self._raead:
+            data_len = self._crypto.aead_decrypt_into(record, self._rcrypto_buffer)
+            if data_len <= 0:
+                logging.info("xstream session %s connection %s record authentication fail", self._session, self)
+                self._rbuffer = b''
+                self._connection.close()
+                return False
+        else:
+            data_len = self._crypto.decrypt_into(record, self._rcrypto_buffer)
+        data = self._rcrypto_view[:data_len]
+
+        if data[0] != ACTION_BATCH:
+            return self.read_frame(data)
+
+        index = 1
+        while data_len - index >= 2:
+            frame_len, = self.LEN_STRUCT.unpack_from(data, index)
+            if not frame_len:
+                break
+            self.read_frame(data[index + 2: index + 2 + frame_len])
+            index += frame_len + 2
+
+    def read_frame(self, data):
+        if data[0] != 0:
+            return self.on_action(data[0], data[1:])
+
+        frame_pool = self._session._frame_pool
+        if data[1] == 0 and len(data) >= 17:
+            action, index, ack, stream_id, flag, stream_index = Frame.STREAM_FRAME_STRUCT.unpack_from(data, 1)
+            stream_frame = frame_pool.stream_frame(stream_id, flag, stream_index, data[17:])
+            frame = frame_pool.frame(action, index, ack, stream_frame, self)
+        else:
+            action, index, ack = Frame.FRAME_STRUCT.unpack_from(data, 1)
+            frame = frame_pool.frame(action, index, ack, data[10:].tobytes(), self)
+        if frame.index > self._rmax_index:
+            self._rmax_index = frame.index
+        self.emit_frame(self, frame)
+        self._rfdata_count += 1
 
     def write(self, data):
         if data.__class__ == Frame:
             if data.index > 0:
                 self._wlast_index = data.index
             if data.data.__class__ == StreamFrame:
-                data = self._crypto.encrypt(self.STREAM_FRAME_STRUCT.pack(0, data.action, data.index, data.ack,
-                                                        data.data.stream_id, data.data.flag,
-                                                        data.data.index) + data.data.data)
+                data = self.STREAM_FRAME_STRUCT.pack(0, data.action, data.index, data.ack, data.data.stream_id,
+                                                     data.data.flag, data.data.index) + data.data.data
             else:
-                data = self._crypto.encrypt(self.FRAME_STRUCT.pack(0, data.action, data.index, data.ack) + data.data)
+                data = self.FRAME_STRUCT.pack(0, data.action, data.index, data.ack) + data.data
         else:
-            data = self._crypto.encrypt(b'\x00' + data)
-        data = b"".join([b'\x17\x03\x03', self.LEN_STRUCT.pack(len(data)), data])
-        self._wdata_len += len(data)
-        self._wpdata_count += 1
+            data = b'\x00' + data
+
         self._wfdata_count += 1
-        try:
-            self._connection.write(data)
-        except SocketClosed:
-            return False
-        return True
+        if self._wbatch_size and len(data) + 2 < self._wbatch_size:
+            return self.write_batch(data)
+        return self.write_record(data)
 
     def write_action(self, action, data=b''):
         data += rand_string(random.randint(64, 256))
-        data = self._crypto.encrypt(struct.pack("!B", action) + data)
-        data = b"".join([b'\x17\x03\x03', struct.pack("!H", len(data)), data])
+        self._wfdata_count += 1
+        return self.write_record(struct.pack("!B", action) + data)
+
+    def write_batch(self, data):
+        if self._wbatch_len + len(data) + 2 > self._wbatch_size and not self.flush_batch():
+            return False
+
+        self._wbatch.append(self.LEN_STRUCT.pack(len(data)))
+        self._wbatch.append(data)
+        self._wbatch_len += len(data) + 2
+        if self._wbatch_len + 64 >= self._wbatch_size:
+            return self.flush_batch()
+
+        if not self._wbatch_flushing:
+            self._wbatch_flushing = True
+            self.loop.add_async(self.flush_batch)
+        return True
+
+    def flush_batch(self):
+        self._wbatch_flushing = False
+        if not self._wbatch:
+            return True
+
+        if len(self._wbatch) == 2:
+            data = self._wbatch[1]
+        else:
+            data = b"".join([b'\x07'] + self._wbatch)
+        self._wbatch, self._wbatch_len = [], 0
+        return self.write_record(data, False)
+
+    def is_batch_writable(self):
+        return self._wbatch_len > 0 and self._wbatch_len + 64 < self._wbatch_size
+
+    def write_record(self, data, flush=True):
+        if flush and self._wbatch and not self.flush_batch():
+            return False
+
+        if len(data) + AEAD_TAG_LEN + 32 + 5 > len(self._wcrypto_buffer):
+            self._wcrypto_buffer = bytearray(b'\x17\x03\x03') + bytearray(len(data) * 2 + AEAD_TAG_LEN + 32)
+            self._wcrypto_view = memoryview(self._wcrypto_buffer)
+        if self._waead:
+            data_len = self._crypto.aead_encrypt_into(data, self._wcrypto_view[5:])
+        else:
+            data_len = self._crypto.encrypt_into(data, self._wcrypto_view[5:])
+        self.LEN_STRUCT.pack_into(self._wcrypto_buffer, 3, data_len)
+        data = self._wcrypto_view[:data_len + 5].tobytes()
         self._wdata_len += len(data)
         self._wpdata_count += 1
-        self._wfdata_count += 1
+        if not self._wqueue_len:
+            self._wqueue_time = clock.time()
+        self._wqueue_len += len(data)
         try:
             self._connection.write(data)
         except SocketClosed:
@@ -172,18 +309,22 @@ class Connection(EventEmitter):
     def on_action(self, action, data):
         if action == ACTION_PING:
             self.write_action(ACTION_PINGACKPING)
-            self._ping_time = time.time()
+            self._ping_time = clock.time()
             self._ping_ack_time = 0
         elif action == ACTION_PINGACKPING:
             self.write_action(ACTION_PINGACK)
-            self._ping_ack_time = time.time()
+            self._ping_ack_time = clock.time()
             self._ttl = (self._ping_ack_time - self._ping_time) * 1000
+            self.on_rtt_sample(self._ttl / 1000.0)
+            self._rtt_histogram.record(self._ttl)
             logging.info("xstream session %s connection %s ping %.2fms", self._session, self, self._ttl)
             self.check_ping_delayed()
         elif action == ACTION_PINGACK:
             self.write_action(ACTION_PINGACKACK)
-            self._ping_ack_time = time.time()
+            self._ping_ack_time = clock.time()
             self._ttl = (self._ping_ack_time - self._ping_time) * 1000
+            self.on_rtt_sample(self._ttl / 1000.0)
+            self._rtt_histogram.record(self._ttl)
             logging.info("xstream session %s connection %s ping %.2fms", self._session, self, self._ttl)
             self.check_ping_delayed()
         elif action == ACTION_PINGACKACK:
@@ -200,6 +341,48 @@ class Connection(EventEmitter):
         elif action == ACTION_READY:
             self.write_action(ACTION_NOISE, rand_string(random.randint(16, 128)))
             logging.info('xstream session %s connection ready', self)
+        elif action == ACTION_BATCH_READY:
+            if BATCH_WRITE_SIZE:
+                self._wbatch_size = min(BATCH_WRITE_SIZE, self.LEN_STRUCT.unpack_from(data)[0])
+                logging.info("xstream session %s connection %s batch write %s", self._session, self, self._wbatch_size)
+        elif action == ACTION_SACK_READY:
+            self._sack = True
+        elif action == ACTION_AEAD_READY:
+            if not self._waead and data[0] < len(AEAD_ALGS) and self.is_aead_supported(AEAD_ALGS[data[0]]):
+                self.write_action(ACTION_AEAD_START, struct.pack("!B", data[0]))
+                self._crypto.init_aead_encrypt(AEAD_ALGS[data[0]])
+                self._waead = True
+                logging.info("xstream session %s connection %s aead write %s", self._session, self, AEAD_ALGS[data[0]])
+        elif action == ACTION_AEAD_START:
+            if data[0] >= len(AEAD_ALGS) or not self.is_aead_supported(AEAD_ALGS[data[0]]):
+                logging.info("xstream session %s connection %s aead unsupported %s", self._session, self, data[0])
+                return self._connection.close()
+            self._crypto.init_aead_decrypt(AEAD_ALGS[data[0]])
+            self._raead = True
+            logging.info("xstream session %s connection %s aead read %s", self._session, self, AEAD_ALGS[data[0]])
+
+    def is_aead_supported(self, alg):
+        return hasattr(self._crypto, "init_aead_encrypt") and is_aead_supported(alg)
+
+    def on_rtt_sample(self, rtt):
+        self._rtt.update(rtt)
+        self._srtt = self._rtt.srtt * 1000
+        if self._session and self._session._center:
+            self._session._center.update_rtt(rtt)
+
+    def get_queue_time(self):
+        if not self._wqueue_len or not self._wrate:
+            return 0
+        return self._wqueue_len / self._wrate
+
+    def get_ping_timeout(self):
+        return min(max(self._rtt.rto * 8 + self.get_queue_time(), self.MIN_PING_TIMEOUT), self.MAX_PING_TIMEOUT)
+
+    def get_ping_interval(self, reping_timeout):
+        rtos = [rtt.rto for rtt in (self._session._center.rtt, self._rtt) if rtt.sample_count]
+        if not rtos:
+            return reping_timeout
+        return min(max(self.PING_INTERVAL_RTO / max(rtos), self.MIN_PING_TIMEOUT), reping_timeout)
 
     def on_expried(self):
         if self._closed:
@@ -215,48 +398,34 @@ class Connection(EventEmitter):
         if reping_timeout <= 0:
             reping_timeout = random.randint(240, 300)
 
-        session_ttl = self._session._center.ttl
-        if session_ttl <= 400:
-            timeout = reping_timeout
-        elif session_ttl <= 800:
-            timeout = 120
-        elif session_ttl <= 1800:
-            timeout = 60
-        elif session_ttl <= 3000:
-            timeout = 30
-        elif session_ttl <= 4000:
-            timeout = 20
-        else:
-            timeout = 15
-
-        if self._ttl > 4000:
-            timeout = min(30, timeout)
-        elif self._ttl > 8000:
-            timeout = min(15, timeout)
-
-        session_delayed = (session_ttl >= 3000) if len(self._session._connections) <= 2 else (session_ttl >= 1000)
-        if self._ttl <= 0 or time.time() - self._data_time >= reping_timeout \
-            or (time.time() - self._ping_time >= timeout and (self._ttl > 3000 or session_delayed)):
+        timeout = self.get_ping_interval(reping_timeout)
+        center_rtt = self._session._center.rtt
+        delayed_rto = self.PING_DELAYED_RTO if len(self._session._connections) <= 2 else self.PING_DELAYED_RTO / 3.0
+        session_delayed = center_rtt.sample_count > 0 and center_rtt.rto >= delayed_rto
+        connection_delayed = self._rtt.sample_count > 0 and self._rtt.rto >= self.PING_DELAYED_RTO
+        if self._ttl <= 0 or clock.time() - self._data_time >= reping_timeout \
+            or (clock.time() - self._ping_time >= timeout and (connection_delayed or session_delayed)):
             self.write_action(ACTION_PING)
-            self._ping_time = time.time()
+            self._ping_time = clock.time()
             self._ping_ack_time = 0
-            self._ping_timer = current().add_timeout(5, self.on_ping_timeout)
+            self._ping_timer = current_wheel().add_timeout(5, self.on_ping_timeout)
         else:
-            self._ping_timer = current().add_timeout(5, self.on_ping_loop, reping_timeout)
+            self._ping_timer = current_wheel().add_timeout(5, self.on_ping_loop, reping_timeout)
 
     def on_ping_timeout(self):
         if self._closed:
             return
 
         if self._ping_ack_time == 0:
-            if time.time() - self._ping_time <= 15:
-                self._ping_timer = current().add_timeout(5, self.on_ping_timeout)
+            ping_timeout = self.get_ping_timeout() - (clock.time() - self._ping_time)
+            if ping_timeout > 0:
+                self._ping_timer = current_wheel().add_timeout(min(ping_timeout, 5), self.on_ping_timeout)
                 return
             self._closed = True
             self._connection.close()
             logging.info("xstream session %s connection %s ping timeout", self._session, self)
         else:
-            self._ping_timer = current().add_timeout(5, self.on_ping_loop)
+            self._ping_timer = current_wheel().add_timeout(5, self.on_ping_loop)
 
     def check_ping_delayed(self):
         if self._ttl > 4000:
@@ -271,35 +440,77 @@ class Connection(EventEmitter):
         self._connection.close()
         logging.info("xstream session %s connection %s ping delayed", self._session, self)
 
+    def is_data_expried(self, etime, data_len):
+        if data_len <= self._expried_data:
+            if data_len <= self._expried_data / 2.0 or etime < self._expried_seconds * 0.6:
+                return False
+
+        if etime < self._expried_seconds / 2.0:
+            if etime < self._expried_seconds / (2.0 * float(data_len) / float(self._expried_data)):
+                return False
+        return True
+
     def on_check_data_loop(self):
         if self._closed:
             return
 
-        etime = time.time() - self._start_time
-        if self._rdata_len + self._wdata_len <= self._expried_data:
-            if self._rdata_len + self._wdata_len <= self._expried_data / 2.0 or etime < self._expried_seconds * 0.6:
-                self._expried_data_timer = current().add_timeout(15, self.on_check_data_loop)
-                return
-
-        if etime < self._expried_seconds / 2.0:
-            if etime < self._expried_seconds / (2.0 * float(self._rdata_len + self._wdata_len) / float(self._expried_data)):
-                self._expried_data_timer = current().add_timeout(15, self.on_check_data_loop)
-                return
-
-        if not self._session.key_exchanged:
-            self._expried_data_timer = current().add_timeout(15, self.on_check_data_loop)
+        etime, data_len = clock.time() - self._start_time, self._rdata_len + self._wdata_len
+        if not self.is_data_expried(etime, data_len) or not self._session.key_exchanged:
+            if not self._expiring and self.is_data_expried(etime + self.EXPRIED_LEAD_TIME,
+                                                           data_len + data_len / max(etime, 1.0) * self.EXPRIED_LEAD_TIME):
+                self.expiring()
+            self._expried_data_timer = current_wheel().add_timeout(15, self.on_check_data_loop)
             return
 
         self.close()
         logging.info("xstream session %s connection %s data len out", self._session, self)
 
+    def expiring(self):
+        if self._expiring or self._closed:
+            return
+        self._expiring = True
+        self.emit_expiring(self)
+        logging.info("xstream session %s connection %s expiring", self._session, self)
+
     def close(self):
         if self._closed:
             return
 
         self._closed = True
         self.write_action(ACTION_CLOSE)
-        self._close_timeout_timer = current().add_timeout(30, self._connection.close)
+        self._close_timeout_timer = current_wheel().add_timeout(30, self._connection.close)
+
+    def stats(self):
+        stats = {
+            "address": self._connection.address,
+            "start_time": self._start_time,
+            "data_time": self._data_time,
+            "closed": self._closed,
+            "ttl": self._ttl,
+            "srtt": self._srtt,
+            "rttvar": self._rtt.rttvar * 1000,
+            "rto": self._rtt.rto * 1000,
+            "wrate": self._wrate,
+            "wqueue_len": self._wqueue_len,
+            "rdata_len": self._rdata_len,
+            "wdata_len": self._wdata_len,
+            "rpdata_count": self._rpdata_count,
+            "wpdata_count": self._wpdata_count,
+            "rfdata_count": self._rfdata_count,
+            "wfdata_count": self._wfdata_count,
+            "raead": self._raead,
+            "waead": self._waead,
+            "sack": self._sack,
+            "rtt_histogram": self._rtt_histogram.stats(),
+        }
+        if self._congestion:
+            stats.update({
+                "cwnd": self._congestion.cwnd,
+                "inflight": self._congestion.inflight,
+                "acked_count": self._congestion.acked_count,
+                "lost_count": self._congestion.lost_count,
+            })
+        return stats
 
     def __del__(self):
         self.close()
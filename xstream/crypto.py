@@ -3,9 +3,14 @@
 # create by: snower
 
 import os
+import sys
+import ssl
 import time
+import json
 import random
 import struct
+import hashlib
+import logging
 
 CIPHER_SUITES = [
     0xc02f,
@@ -57,34 +62,100 @@ ALG_KEY_IV_LEN = {
         'seed_cfb': (16, 16),
     }
 
+AEAD_ALGS = ('aes_128_gcm', 'aes_256_gcm', 'chacha20_poly1305')
+
+AEAD_KEY_IV_LEN = {
+        'aes_128_gcm': (16, 12),
+        'aes_256_gcm': (32, 12),
+        'chacha20_poly1305': (32, 12),
+    }
+
+AEAD_TAG_LEN = 16
+
+try:
+    CRYPTO_BENCH_BYTES = max(int(os.environ.get("XSTREAM_CRYPTO_BENCH_BYTES", 4 * 1024 * 1024)), 65536)
+except:
+    CRYPTO_BENCH_BYTES = 4 * 1024 * 1024
+
 def get_cryptography():
     from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
     from cryptography.hazmat.primitives.hashes import Hash, MD5, SHA1
-    from cryptography.hazmat.backends import default_backend
-    backend = default_backend()
-    buf = bytearray(262144)
-    ffi_buf = backend._ffi.cast("unsigned char *", backend._ffi.from_buffer(buf))
-    outlen = backend._ffi.new("int *")
-
-    def update_warp(backend, cryptor, buf, ffi_buf, outlen):
-        def update(data):
-            data_len = len(data)
-            if data_len > 261120:
-                udata = b''
-                for i in range((data_len % 261120) + 1):
-                    udata += update(data[i*261120: (i+1) * 261120])
-                return udata
-            backend._lib.EVP_CipherUpdate(cryptor._ctx._ctx, ffi_buf, outlen, backend._ffi.from_buffer(data), data_len)
-            return bytes(buf[:outlen[0]])
-        return update
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.exceptions import InvalidTag
+    try:
+        from cryptography.hazmat.decrepit.ciphers import modes as decrepit_modes
+    except ImportError:
+        decrepit_modes = modes
+
+    class CipherContext(object):
+        def __init__(self, cryptor, block_size):
+            self.cryptor = cryptor
+            self.block_size = block_size
+            self.update = cryptor.update
+
+        def update_into(self, data, buf):
+            if len(buf) < len(data) + self.block_size:
+                raise Exception("cipher output buffer too small %d < %d" % (len(buf), len(data) + self.block_size))
+            return self.cryptor.update_into(data, buf)
+
+    class HashDigest(object):
+        def __init__(self, algorithm):
+            self.hash = Hash(algorithm)
+
+        def update(self, data):
+            self.hash.update(data)
+
+        def digest(self):
+            return self.hash.finalize()
 
     def get_evp(alg_key, key, iv, op):
         if "aes" not in alg_key:
             return
-        cipher = Cipher(algorithms.AES(key), getattr(modes, alg_key.split("_")[-1].upper())(iv), backend=backend)
-        cryptor = cipher.encryptor() if op == 1 else cipher.decryptor()
-        setattr(cryptor, "update", update_warp(backend, cryptor, buf, ffi_buf, outlen))
-        return cryptor
+        mode = alg_key.split("_")[-1].upper()
+        cipher = Cipher(algorithms.AES(key), (getattr(decrepit_modes, mode, None) or getattr(modes, mode))(iv))
+        return CipherContext(cipher.encryptor() if op == 1 else cipher.decryptor(), algorithms.AES.block_size // 8)
+
+    class AEADCipher(object):
+        def __init__(self, cipher):
+            self.cipher = cipher
+            if not hasattr(cipher, "encrypt_into"):
+                self.encrypt_into, self.decrypt_into = self.encrypt_copy_into, self.decrypt_copy_into
+
+        def encrypt_into(self, nonce, data, buf):
+            data_len = len(data) + AEAD_TAG_LEN
+            if len(buf) < data_len:
+                raise Exception("cipher output buffer too small %d < %d" % (len(buf), data_len))
+            return self.cipher.encrypt_into(nonce, data, None, memoryview(buf)[:data_len])
+
+        def decrypt_into(self, nonce, data, buf):
+            data_len = len(data) - AEAD_TAG_LEN
+            if data_len < 0:
+                return -1
+            if len(buf) < data_len:
+                raise Exception("cipher output buffer too small %d < %d" % (len(buf), data_len))
+            try:
+                return self.cipher.decrypt_into(nonce, data, None, memoryview(buf)[:data_len])
+            except InvalidTag:
+                return -1
+
+        # cryptography before 47 has no encrypt_into/decrypt_into, so each record is copied three times
+        def encrypt_copy_into(self, nonce, data, buf):
+            data = self.cipher.encrypt(nonce, bytes(data), None)
+            buf[:len(data)] = data
+            return len(data)
+
+        def decrypt_copy_into(self, nonce, data, buf):
+            try:
+                data = self.cipher.decrypt(nonce, bytes(data), None)
+            except InvalidTag:
+                return -1
+            buf[:len(data)] = data
+            return len(data)
+
+    def get_aead(alg_key, key, op):
+        if alg_key not in AEAD_KEY_IV_LEN:
+            return
+        return AEADCipher(ChaCha20Poly1305(key) if alg_key == "chacha20_poly1305" else AESGCM(key))
 
     def rand_string(length):
         return os.urandom(length)
@@ -92,17 +163,15 @@ def get_cryptography():
     def sign_string(data):
         d = b''
         for t in (MD5, SHA1, MD5):
-            s = Hash(t(), backend=backend)
+            s = Hash(t())
             s.update(data + d)
             d = s.finalize()
         return d
 
     def bytes_to_key_digest():
-        s = Hash(SHA1(), backend=backend)
-        setattr(s, "digest", s.finalize)
-        return s
+        return HashDigest(SHA1())
 
-    return get_evp, rand_string, sign_string, bytes_to_key_digest
+    return get_evp, get_aead, rand_string, sign_string, bytes_to_key_digest
 
 def get_m2crypto():
     from M2Crypto import Rand,EVP
@@ -112,6 +181,9 @@ def get_m2crypto():
             return
         return EVP.Cipher(alg_key, key, iv, op, 0)
 
+    def get_aead(alg_key, key, op):
+        return None
+
     def rand_string(length):
         return Rand.rand_bytes(length)
 
@@ -126,17 +198,22 @@ def get_m2crypto():
     def bytes_to_key_digest():
         return EVP.MessageDigest('sha1')
 
-    return get_evp, rand_string, sign_string, bytes_to_key_digest
+    return get_evp, get_aead, rand_string, sign_string, bytes_to_key_digest
 
 def get_openssl():
     import hashlib
-    from .openssl import OpenSSLCrypto
+    from .openssl import OpenSSLCrypto, OpenSSLAEADCrypto
 
     def get_evp(alg_key, key, iv, op):
         if alg_key not in ALG_KEY_IV_LEN:
             return
         return OpenSSLCrypto(alg_key.replace("_", "-"), key, iv, op)
 
+    def get_aead(alg_key, key, op):
+        if alg_key not in AEAD_KEY_IV_LEN:
+            return
+        return OpenSSLAEADCrypto(alg_key.replace("_", "-"), key, op)
+
     def rand_string(length):
         return os.urandom(length)
 
@@ -151,14 +228,142 @@ def get_openssl():
     def bytes_to_key_digest():
         return hashlib.sha1()
 
-    return get_evp, rand_string, sign_string, bytes_to_key_digest
-
-if os.environ.get("XSTREAM_CRYPTO", "cryptography").lower() == "cryptography":
-    get_evp, rand_string, sign_string, bytes_to_key_digest = get_cryptography()
-elif os.environ.get("XSTREAM_CRYPTO", "m2crypto").lower() == "m2crypto":
-    get_evp, rand_string, sign_string, bytes_to_key_digest = get_m2crypto()
+    return get_evp, get_aead, rand_string, sign_string, bytes_to_key_digest
+
+CRYPTO_BACKENDS = (
+    ("cryptography", get_cryptography),
+    ("m2crypto", get_m2crypto),
+    ("openssl", get_openssl),
+)
+
+def bench_crypto_backend(backend, alg, frame_size, bench_bytes=CRYPTO_BENCH_BYTES):
+    get_evp, get_aead, rand_string, sign_string, bytes_to_key_digest = backend
+    s = bytes_to_key_digest()
+    s.update(b"xstream")
+    s.digest()
+    sign_string(b"xstream")
+
+    key_len, iv_len = ALG_KEY_IV_LEN[alg]
+    encipher = get_evp(alg, b"\x01" * key_len, b"\x02" * iv_len, 1)
+    decipher = get_evp(alg, b"\x01" * key_len, b"\x02" * iv_len, 0)
+    data = os.urandom(frame_size)
+    if encipher is None or decipher is None or decipher.update(encipher.update(data)) != data:
+        raise Exception("crypto backend self test fail")
+
+    buf = bytearray(frame_size + 64)
+    update_into = getattr(encipher, "update_into", None)
+    count = max(bench_bytes // frame_size, 1)
+    start_time = time.perf_counter()
+    if update_into:
+        for _ in range(count):
+            update_into(data, buf)
+    else:
+        for _ in range(count):
+            encipher.update(data)
+    return frame_size * count / max(time.perf_counter() - start_time, 0.000001)
+
+def get_crypto_cache_path(session_path=None):
+    cache_path = os.environ.get("XSTREAM_CRYPTO_CACHE")
+    if cache_path:
+        return os.path.abspath(cache_path)
+    session_path = session_path or os.environ.get("SESSION_PATH")
+    if session_path:
+        return os.path.join(os.path.abspath(session_path), "crypto_backend")
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(os.path.abspath(cache_home), "xstream", "crypto_backend")
+
+def get_crypto_cache_key(alg, frame_size):
+    versions = [alg, str(frame_size), sys.version.split()[0], ssl.OPENSSL_VERSION]
+    for module_name in ("cryptography", "M2Crypto"):
+        try:
+            versions.append("%s %s" % (module_name, __import__(module_name).__version__))
+        except Exception:
+            pass
+    return hashlib.md5("|".join(versions).encode("utf-8")).hexdigest()
+
+def select_crypto_backend(alg, frame_size, session_path=None):
+    cache_path, cache_key = get_crypto_cache_path(session_path), get_crypto_cache_key(alg, frame_size)
+    try:
+        with open(cache_path, encoding="utf-8") as fp:
+            cache = json.load(fp)
+    except Exception:
+        cache = {}
+
+    if cache_key in cache:
+        for name, get_backend in CRYPTO_BACKENDS:
+            if name != cache[cache_key]["backend"]:
+                continue
+            try:
+                return name, get_backend(), dict(cache[cache_key], mode="auto", cached=True)
+            except Exception as e:
+                logging.info("xstream crypto cached backend %s load error %s", name, e)
+
+    backends, results = {}, {}
+    for name, get_backend in CRYPTO_BACKENDS:
+        try:
+            backends[name] = get_backend()
+            results[name] = bench_crypto_backend(backends[name], alg, frame_size)
+        except Exception as e:
+            results[name] = None
+            logging.info("xstream crypto backend %s unavailable %s", name, e)
+    names = [name for name, result in results.items() if result]
+    if not names:
+        raise Exception("no crypto backend available")
+
+    name = max(names, key=lambda name: results[name])
+    cache[cache_key] = {"backend": name, "alg": alg, "frame_size": frame_size, "results": results, "time": int(time.time())}
+    try:
+        if not os.path.exists(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        with open(cache_path, "w", encoding="utf-8") as fp:
+            json.dump(cache, fp)
+    except Exception as e:
+        logging.info("xstream crypto backend cache save error %s", e)
+    logging.info("xstream crypto backend select %s %s", name, results)
+    return name, backends[name], dict(cache[cache_key], mode="auto", cached=False)
+
+_alg_backends = {}
+
+def load_crypto_backend(alg, session_path=None):
+    if CRYPTO_BACKEND != "auto" or alg in _alg_backends or alg not in ALG_KEY_IV_LEN:
+        return
+    from .frame import StreamFrame
+    name, backend, backend_stats = select_crypto_backend(alg, StreamFrame.FRAME_LEN, session_path)
+    _alg_backends[alg] = backend
+    CRYPTO_BACKEND_STATS["algs"][alg] = backend_stats
+
+def get_auto_evp(alg_key, key, iv, op):
+    if alg_key not in ALG_KEY_IV_LEN:
+        return
+    load_crypto_backend(alg_key)
+    return _alg_backends[alg_key][0](alg_key, key, iv, op)
+
+CRYPTO_BACKEND = os.environ.get("XSTREAM_CRYPTO", "cryptography").lower()
+if CRYPTO_BACKEND == "auto":
+    _backend = (get_auto_evp,) + get_openssl()[1:]
+    CRYPTO_BACKEND_STATS = {"backend": CRYPTO_BACKEND, "mode": "auto", "algs": {}}
 else:
-    get_evp, rand_string, sign_string, bytes_to_key_digest = get_openssl()
+    if CRYPTO_BACKEND == "cryptography":
+        _backend = get_cryptography()
+    elif CRYPTO_BACKEND == "m2crypto":
+        _backend = get_m2crypto()
+    else:
+        CRYPTO_BACKEND, _backend = "openssl", get_openssl()
+    CRYPTO_BACKEND_STATS = {"backend": CRYPTO_BACKEND, "mode": "env"}
+get_evp, get_aead, rand_string, sign_string, bytes_to_key_digest = _backend
+
+def get_backend_stats():
+    return dict(CRYPTO_BACKEND_STATS)
+
+_aead_supported = {}
+
+def is_aead_supported(alg):
+    if alg not in _aead_supported:
+        try:
+            _aead_supported[alg] = alg in AEAD_KEY_IV_LEN and get_aead(alg, b"\x00" * AEAD_KEY_IV_LEN[alg][0], 1) is not None
+        except Exception:
+            _aead_supported[alg] = False
+    return _aead_supported[alg]
 
 def xor_string(key, data, encrypt=True):
     if isinstance(key, str):
@@ -217,12 +422,15 @@ class Crypto(object):
             self._ensecret = secret
         else:
             self._ensecret = (secret[:28], secret[28:]) if secret else (rand_string(28), rand_string(16))
+        self._ensalt = (crypto_time, session_secret)
         self._encipher = get_evp(
             self._alg,
             self.bytes_to_key(self._ensecret[0] + session_secret, crypto_time, ALG_KEY_IV_LEN.get(self._alg)[0]),
             self.bytes_to_key(self._ensecret[1] + session_secret, crypto_time, ALG_KEY_IV_LEN.get(self._alg)[1]),
             1)
         self.encrypt = self._encipher.update
+        if hasattr(self._encipher, "update_into"):
+            self.encrypt_into = self._encipher.update_into
         return b"".join(self._ensecret)
 
     def init_decrypt(self, crypto_time, secret, session_secret=b""):
@@ -230,12 +438,15 @@ class Crypto(object):
             self._ensecret = secret
         else:
             self._desecret= (secret[:28], secret[28:])
+        self._desalt = (crypto_time, session_secret)
         self._decipher = get_evp(
             self._alg,
             self.bytes_to_key(self._desecret[0] + session_secret, crypto_time, ALG_KEY_IV_LEN.get(self._alg)[0]),
             self.bytes_to_key(self._desecret[1] + session_secret, crypto_time, ALG_KEY_IV_LEN.get(self._alg)[1]),
             0)
         self.decrypt = self._decipher.update
+        if hasattr(self._decipher, "update_into"):
+            self.decrypt_into = self._decipher.update_into
 
     def encrypt(self, data):
         return self._encipher.update(data)
@@ -243,6 +454,40 @@ class Crypto(object):
     def decrypt(self, data):
         return self._decipher.update(data)
 
+    def encrypt_into(self, data, buf):
+        data = self._encipher.update(bytes(data))
+        buf[:len(data)] = data
+        return len(data)
+
+    def decrypt_into(self, data, buf):
+        data = self._decipher.update(bytes(data))
+        buf[:len(data)] = data
+        return len(data)
+
+    def init_aead_encrypt(self, alg):
+        key_len, iv_len = AEAD_KEY_IV_LEN[alg]
+        crypto_time, session_secret = self._ensalt
+        self._aead_encipher = get_aead(alg, self.bytes_to_key(self._ensecret[0] + session_secret + b"aead", crypto_time, key_len), 1)
+        self._aead_eniv = int.from_bytes(self.bytes_to_key(self._ensecret[1] + session_secret + b"aead", crypto_time, iv_len), "big")
+        self._aead_encount = 0
+
+    def init_aead_decrypt(self, alg):
+        key_len, iv_len = AEAD_KEY_IV_LEN[alg]
+        crypto_time, session_secret = self._desalt
+        self._aead_decipher = get_aead(alg, self.bytes_to_key(self._desecret[0] + session_secret + b"aead", crypto_time, key_len), 0)
+        self._aead_deiv = int.from_bytes(self.bytes_to_key(self._desecret[1] + session_secret + b"aead", crypto_time, iv_len), "big")
+        self._aead_decount = 0
+
+    def aead_encrypt_into(self, data, buf):
+        nonce = (self._aead_eniv ^ self._aead_encount).to_bytes(12, "big")
+        self._aead_encount += 1
+        return self._aead_encipher.encrypt_into(nonce, data, buf)
+
+    def aead_decrypt_into(self, data, buf):
+        nonce = (self._aead_deiv ^ self._aead_decount).to_bytes(12, "big")
+        self._aead_decount += 1
+        return self._aead_decipher.decrypt_into(nonce, data, buf)
+
     def bytes_to_key(self, salt, crypto_time, key_len):
         crypto_time = str(crypto_time).encode("utf-8")
         key = self._key.encode('utf-8')
@@ -9,13 +9,16 @@ class Frame(object):
     FRAME_STRUCT = struct.Struct("!BII")
     STREAM_FRAME_STRUCT = struct.Struct("!BIIHBI")
 
+    __slots__ = ("action", "index", "ack", "data", "connection", "used_connections", "send_time", "recv_time",
+                 "ack_time", "resend_time", "resend_count", "send_timeout_count")
+
     def __init__(self, action, index, ack, data, connection=None):
         self.action = action
         self.index = index
         self.ack = ack
         self.data = data
         self.connection = connection
-        self.used_connections = set([])
+        self.used_connections = None
         self.send_time = 0
         self.recv_time = 0
         self.ack_time = 0
@@ -63,6 +66,20 @@ class Frame(object):
             return len(self.data.data) + 17
         return len(self.data) + 9
 
+    def use_connection(self, connection):
+        if self.used_connections is None:
+            self.used_connections = {id(connection)}
+        else:
+            self.used_connections.add(id(connection))
+
+    def is_used_connection(self, connection):
+        return self.used_connections is not None and id(connection) in self.used_connections
+
+    def has_unused_connection(self, connections):
+        if self.used_connections is None:
+            return bool(connections)
+        return bool(connections - self.used_connections)
+
     def close(self):
         self.data = b''
 
@@ -71,6 +88,8 @@ class StreamFrame(object):
     FRAME_LEN = 1455 * 2 - HEADER_LEN
     STREAM_STRUCT = struct.Struct("!HBI")
 
+    __slots__ = ("stream_id", "flag", "index", "data", "send_time", "recv_time")
+
     def __init__(self, stream_id, flag, index, data):
         self.stream_id = stream_id
         self.flag = flag
@@ -82,6 +101,10 @@ class StreamFrame(object):
     def dumps(self):
         return b"".join([self.STREAM_STRUCT.pack(self.stream_id, self.flag, self.index), self.data])
 
+    def detach(self):
+        if self.data.__class__ != bytes:
+            self.data = bytes(self.data)
+
     @classmethod
     def loads(cls, data):
         if data.__class__ == StreamFrame:
@@ -111,3 +134,175 @@ class StreamFrame(object):
 
     def __len__(self):
         return len(self.data) + 7
+
+class FramePool(object):
+    def __init__(self, max_size=2048):
+        self.max_size = max_size
+        self.frames = []
+        self.stream_frames = []
+        self.frame_count = 0
+        self.stream_frame_count = 0
+        self.reused_count = 0
+
+    def frame(self, action, index, ack, data, connection=None):
+        if not self.frames:
+            self.frame_count += 1
+            return Frame(action, index, ack, data, connection)
+
+        self.reused_count += 1
+        frame = self.frames.pop()
+        frame.action = action
+        frame.index = index
+        frame.ack = ack
+        frame.data = data
+        frame.connection = connection
+        return frame
+
+    def stream_frame(self, stream_id, flag, index, data):
+        if not self.stream_frames:
+            self.stream_frame_count += 1
+            return StreamFrame(stream_id, flag, index, data)
+
+        self.reused_count += 1
+        frame = self.stream_frames.pop()
+        frame.stream_id = stream_id
+        frame.flag = flag
+        frame.index = index
+        frame.data = data
+        return frame
+
+    def release(self, frame, release_data=True):
+        if release_data and frame.data.__class__ == StreamFrame:
+            self.release_stream_frame(frame.data)
+
+        if len(self.frames) >= self.max_size:
+            return
+        frame.data = None
+        frame.connection = None
+        frame.used_connections = None
+        frame.send_time = 0
+        frame.recv_time = 0
+        frame.ack_time = 0
+        frame.resend_time = 0
+        frame.resend_count = 0
+        frame.send_timeout_count = 0
+        self.frames.append(frame)
+
+    def release_stream_frame(self, frame):
+        if len(self.stream_frames) >= self.max_size:
+            return
+        frame.data = None
+        frame.send_time = 0
+        frame.recv_time = 0
+        self.stream_frames.append(frame)
+
+    def clear(self):
+        self.frames = []
+        self.stream_frames = []
+
+class FrameWindow(object):
+    def __init__(self, size=1024, max_size=0x400000):
+        self.init_size = size
+        self.max_size = max_size
+        self.slots = [None] * size
+        self.mask = size - 1
+        self.start = 0
+        self.end = 0
+        self.count = 0
+
+    def resize(self, start, end):
+        size = len(self.slots)
+        while size < (end - start) * 2:
+            size *= 2
+
+        slots, mask = [None] * size, size - 1
+        for index in range(self.start, self.end):
+            frame = self.slots[index & self.mask]
+            if frame is not None:
+                slots[index & mask] = frame
+        self.slots, self.mask = slots, mask
+
+    def add(self, frame):
+        index = frame.index
+        if not self.count:
+            self.start, self.end = index, index + 1
+        elif index < self.start or index >= self.end:
+            start, end = min(self.start, index), max(self.end, index + 1)
+            if end - start > self.max_size:
+                return False
+            if end - start > len(self.slots):
+                self.resize(start, end)
+            self.start, self.end = start, end
+        elif self.slots[index & self.mask] is not None:
+            return False
+        self.slots[index & self.mask] = frame
+        self.count += 1
+        return True
+
+    def get(self, index):
+        if self.start <= index < self.end:
+            return self.slots[index & self.mask]
+        return None
+
+    def remove(self, index):
+        frame = self.get(index)
+        if frame is None:
+            return None
+
+        slots, mask = self.slots, self.mask
+        slots[index & mask] = None
+        self.count -= 1
+        if not self.count:
+            self.start = self.end = 0
+            return frame
+
+        if index == self.start:
+            start = index + 1
+            while slots[start & mask] is None:
+                start += 1
+            self.start = start
+        elif index == self.end - 1:
+            end = index
+            while slots[(end - 1) & mask] is None:
+                end -= 1
+            self.end = end
+        return frame
+
+    def first(self):
+        if not self.count:
+            return None
+        return self.slots[self.start & self.mask]
+
+    def last(self):
+        if not self.count:
+            return None
+        return self.slots[(self.end - 1) & self.mask]
+
+    def pop_first(self):
+        if not self.count:
+            return None
+        return self.remove(self.start)
+
+    def pop_until(self, index):
+        frames = []
+        while self.count and self.start <= index:
+            frames.append(self.remove(self.start))
+        return frames
+
+    def clear(self):
+        self.slots = [None] * self.init_size
+        self.mask = self.init_size - 1
+        self.start = self.end = self.count = 0
+
+    def __iter__(self):
+        slots, mask = self.slots, self.mask
+        for index in range(self.start, self.end):
+            frame = slots[index & mask]
+            if frame is not None:
+                yield frame
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
@@ -19,8 +19,7 @@ from __future__ import absolute_import, division, print_function, \
 
 import os
 import logging
-from ctypes import c_char_p, c_int, c_long, byref,\
-    create_string_buffer, c_void_p
+from ctypes import c_char, c_char_p, c_int, byref, c_void_p
 
 __all__ = ['ciphers']
 
@@ -29,6 +28,10 @@ loaded = False
 
 buf_size = 2048
 
+EVP_CTRL_AEAD_GET_TAG = 0x10
+EVP_CTRL_AEAD_SET_TAG = 0x11
+AEAD_TAG_LEN = 16
+
 def to_bytes(s):
     if bytes != str:
         if type(s) == str:
@@ -116,7 +119,7 @@ def find_library(possible_lib_names, search_symbol, library_name):
 
 
 def load_openssl():
-    global loaded, libcrypto, buf, ctx_cleanup
+    global loaded, libcrypto, ctx_cleanup, cipher_block_size
 
     libcrypto = find_library(('crypto', 'eay32'),
                                   'EVP_get_cipherbyname',
@@ -131,7 +134,11 @@ def load_openssl():
                                             c_char_p, c_char_p, c_int)
 
     libcrypto.EVP_CipherUpdate.argtypes = (c_void_p, c_void_p, c_void_p,
-                                           c_char_p, c_int)
+                                           c_void_p, c_int)
+
+    libcrypto.EVP_CipherFinal_ex.argtypes = (c_void_p, c_void_p, c_void_p)
+
+    libcrypto.EVP_CIPHER_CTX_ctrl.argtypes = (c_void_p, c_int, c_int, c_void_p)
 
     try:
         libcrypto.EVP_CIPHER_CTX_cleanup.argtypes = (c_void_p,)
@@ -140,10 +147,14 @@ def load_openssl():
         libcrypto.EVP_CIPHER_CTX_reset.argtypes = (c_void_p,)
         ctx_cleanup = libcrypto.EVP_CIPHER_CTX_reset
     libcrypto.EVP_CIPHER_CTX_free.argtypes = (c_void_p,)
+    try:
+        cipher_block_size = libcrypto.EVP_CIPHER_get_block_size
+    except AttributeError:
+        cipher_block_size = libcrypto.EVP_CIPHER_block_size
+    cipher_block_size.argtypes = (c_void_p,)
     if hasattr(libcrypto, 'OpenSSL_add_all_ciphers'):
         libcrypto.OpenSSL_add_all_ciphers()
 
-    buf = create_string_buffer(buf_size)
     loaded = True
 
 
@@ -156,9 +167,24 @@ def load_cipher(cipher_name):
     return None
 
 
+def get_buffer_ptr(data):
+    if data.__class__ is bytes:
+        return data
+    try:
+        return byref(c_char.from_buffer(data))
+    except TypeError:
+        # ctypes can not point into a read-only buffer, so a record sliced from received bytes is copied here
+        return bytes(data)
+
+
 class OpenSSLCrypto(object):
     def __init__(self, cipher_name, key, iv, op):
         self._ctx = None
+        self._buf = bytearray(buf_size)
+        self._buf_view = memoryview(self._buf)
+        self._buf_ptr = byref(c_char.from_buffer(self._buf))
+        self._out_len = c_int(0)
+        self._out_len_ptr = byref(self._out_len)
         if not loaded:
             load_openssl()
         cipher_name = to_bytes(cipher_name)
@@ -167,6 +193,7 @@ class OpenSSLCrypto(object):
             cipher = load_cipher(cipher_name)
         if not cipher:
             raise Exception('cipher %s not found in libcrypto' % cipher_name)
+        self._block_size = max(cipher_block_size(cipher), 1)
         key_ptr = c_char_p(key)
         iv_ptr = c_char_p(iv)
         self._ctx = libcrypto.EVP_CIPHER_CTX_new()
@@ -179,16 +206,28 @@ class OpenSSLCrypto(object):
             raise Exception('can not initialize cipher context')
 
     def update(self, data):
-        global buf_size, buf
-        cipher_out_len = c_long(0)
         l = len(data)
-        if buf_size < l:
-            buf_size = l * 2
-            buf = create_string_buffer(buf_size)
-        libcrypto.EVP_CipherUpdate(self._ctx, byref(buf),
-                                   byref(cipher_out_len), c_char_p(data), l)
-        # buf is copied to a str object when we access buf.raw
-        return buf.raw[:cipher_out_len.value]
+        if not l:
+            return b''
+        if len(self._buf) < l + 32:
+            self._buf = bytearray(l * 2 + 32)
+            self._buf_view = memoryview(self._buf)
+            self._buf_ptr = byref(c_char.from_buffer(self._buf))
+        if not libcrypto.EVP_CipherUpdate(self._ctx, self._buf_ptr, self._out_len_ptr,
+                                          get_buffer_ptr(data), l):
+            raise Exception('cipher update fail')
+        return self._buf_view[:self._out_len.value].tobytes()
+
+    def update_into(self, data, buf):
+        l = len(data)
+        if not l:
+            return 0
+        if len(buf) < l + self._block_size:
+            raise Exception('cipher output buffer too small %d < %d' % (len(buf), l + self._block_size))
+        if not libcrypto.EVP_CipherUpdate(self._ctx, byref(c_char.from_buffer(buf)), self._out_len_ptr,
+                                          get_buffer_ptr(data), l):
+            raise Exception('cipher update fail')
+        return self._out_len.value
 
     def __del__(self):
         self.clean()
@@ -196,4 +235,43 @@ class OpenSSLCrypto(object):
     def clean(self):
         if self._ctx:
             ctx_cleanup(self._ctx)
-            libcrypto.EVP_CIPHER_CTX_free(self._ctx)
\ No newline at end of file
+            libcrypto.EVP_CIPHER_CTX_free(self._ctx)
+            self._ctx = None
+
+class OpenSSLAEADCrypto(OpenSSLCrypto):
+    def __init__(self, cipher_name, key, op):
+        super(OpenSSLAEADCrypto, self).__init__(cipher_name, key, None, op)
+
+    def encrypt_into(self, nonce, data, buf):
+        l = len(data)
+        if len(buf) < l + self._block_size + AEAD_TAG_LEN:
+            raise Exception('cipher output buffer too small %d < %d' % (len(buf), l + self._block_size + AEAD_TAG_LEN))
+        libcrypto.EVP_CipherInit_ex(self._ctx, None, None, None, nonce, c_int(-1))
+        if l:
+            if not libcrypto.EVP_CipherUpdate(self._ctx, byref(c_char.from_buffer(buf)), self._out_len_ptr,
+                                              get_buffer_ptr(data), l):
+                raise Exception('cipher update fail')
+            l = self._out_len.value
+        if libcrypto.EVP_CipherFinal_ex(self._ctx, self._buf_ptr, self._out_len_ptr) <= 0:
+            raise Exception('cipher final fail')
+        libcrypto.EVP_CIPHER_CTX_ctrl(self._ctx, EVP_CTRL_AEAD_GET_TAG, AEAD_TAG_LEN,
+                                      byref(c_char.from_buffer(buf, l)))
+        return l + AEAD_TAG_LEN
+
+    def decrypt_into(self, nonce, data, buf):
+        l = len(data) - AEAD_TAG_LEN
+        if l < 0:
+            return -1
+        if len(buf) < l + self._block_size:
+            raise Exception('cipher output buffer too small %d < %d' % (len(buf), l + self._block_size))
+        libcrypto.EVP_CipherInit_ex(self._ctx, None, None, None, nonce, c_int(-1))
+        libcrypto.EVP_CIPHER_CTX_ctrl(self._ctx, EVP_CTRL_AEAD_SET_TAG, AEAD_TAG_LEN,
+                                      bytes(data[l:]))
+        if l:
+            if not libcrypto.EVP_CipherUpdate(self._ctx, byref(c_char.from_buffer(buf)), self._out_len_ptr,
+                                              get_buffer_ptr(data), l):
+                raise Exception('cipher update fail')
+            l = self._out_len.value
+        if libcrypto.EVP_CipherFinal_ex(self._ctx, self._buf_ptr, self._out_len_ptr) <= 0:
+            return -1
+        return l
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+from collections import OrderedDict
+from . import clock
+
+SCHEDULER = os.environ.get("XSTREAM_SCHEDULER", "minrtt")
+
+try:
+    STREAM_QUANTUM = max(int(os.environ.get("XSTREAM_STREAM_QUANTUM", 0x2000)), 1)
+except:
+    STREAM_QUANTUM = 0x2000
+
+class RoundRobinScheduler(object):
+    def __init__(self, center):
+        self.center = center
+
+    def select(self, drain_connections, skip_connections):
+        for _ in range(len(drain_connections)):
+            connection = drain_connections.popleft()
+            if connection._closed:
+                continue
+            if connection in skip_connections:
+                drain_connections.append(connection)
+                continue
+            return connection
+        return None
+
+class MinRttScheduler(object):
+    UNKNOWN_SRTT = 60000
+
+    def __init__(self, center):
+        self.center = center
+
+    def get_delivery_time(self, connection, srtt, now):
+        delivery_time = srtt / 2000.0
+        if connection._wqueue_len:
+            queue_time = (connection._wqueue_len / connection._wrate) if connection._wrate else 0
+            queue_elapsed = now - connection._wqueue_time
+            delivery_time += max(queue_time - queue_elapsed, queue_elapsed)
+        if connection._congestion and connection._congestion.pacing_time > now:
+            delivery_time += connection._congestion.pacing_time - now
+        return delivery_time
+
+    def is_pacing(self, connection, now):
+        congestion = connection._congestion
+        return congestion is not None and congestion.inflight < congestion.cwnd and congestion.pacing_time > now
+
+    def select(self, drain_connections, skip_connections):
+        session = self.center.session
+        if not session:
+            return None
+
+        connections = session._connections
+        now = clock.time()
+
+        best_connection, best_time = None, None
+        for connection in list(drain_connections):
+            if connection._closed:
+                drain_connections.remove(connection)
+                continue
+            if connection in skip_connections:
+                continue
+            delivery_time = self.get_delivery_time(connection, connection._srtt or self.UNKNOWN_SRTT, now)
+            if best_connection is None or delivery_time < best_time:
+                best_connection, best_time = connection, delivery_time
+
+        if best_connection is None:
+            return None
+
+        for connection in connections:
+            if connection._closed:
+                continue
+            if connection in drain_connections:
+                if connection not in skip_connections or not self.is_pacing(connection, now):
+                    continue
+            elif not connection._wqueue_len:
+                continue
+            if self.get_delivery_time(connection, connection._srtt or self.UNKNOWN_SRTT, now) < best_time:
+                return None
+
+        drain_connections.remove(best_connection)
+        return best_connection
+
+SCHEDULERS = {
+    "roundrobin": RoundRobinScheduler,
+    "minrtt": MinRttScheduler,
+}
+
+def create_scheduler(center, name=None):
+    return SCHEDULERS.get(name or SCHEDULER, MinRttScheduler)(center)
+
+class StreamScheduler(object):
+    def __init__(self, quantum=STREAM_QUANTUM):
+        self.quantum = quantum
+        self.priority_streams = OrderedDict()
+        self.streams = OrderedDict()
+
+    def __len__(self):
+        return len(self.priority_streams) + len(self.streams)
+
+    def __contains__(self, stream):
+        return stream in self.streams or stream in self.priority_streams
+
+    def add(self, stream):
+        if stream._priority != 0:
+            self.priority_streams[stream] = 0
+        else:
+            self.streams[stream] = 0
+
+    def remove(self, stream):
+        if self.priority_streams.pop(stream, None) is None:
+            self.streams.pop(stream, None)
+
+    def first(self):
+        while self.priority_streams:
+            stream = next(iter(self.priority_streams))
+            if stream._priority != 0:
+                return stream
+            self.priority_streams.pop(stream)
+            self.streams[stream] = 0
+
+        streams = self.streams
+        while streams:
+            stream, deficit = next(iter(streams.items()))
+            if deficit > 0:
+                return stream
+            streams[stream] = deficit + self.quantum * stream._weight
+            streams.move_to_end(stream)
+        return None
+
+    def consume(self, stream, data_len):
+        if stream in self.streams:
+            self.streams[stream] -= data_len
@@ -12,8 +12,10 @@ import pickle
 import base64
 from sevent import EventEmitter, tcp, current
 from .session import Session
-from .crypto import Crypto, rand_string, xor_string, sign_string, CIPHER_SUITES
+from .crypto import Crypto, rand_string, xor_string, sign_string, get_backend_stats, load_crypto_backend, CIPHER_SUITES
 from .frame import StreamFrame
+from .timer import current_wheel
+from . import stats
 
 class Server(EventEmitter):
     def __init__(self, port, host='0.0.0.0', crypto_key='', crypto_alg=''):
@@ -40,7 +42,7 @@ class Server(EventEmitter):
         self._crypto_alg = crypto_alg
         self._fork_auth_fail_count = 0
 
-        current().add_timeout(120, self.on_check_session_timeout)
+        current_wheel().add_timeout(120, self.on_check_session_timeout)
 
     def get_session_key(self, session_id):
         return hashlib.md5("".join([str(self._host), str(self._port), self._crypto_key, self._crypto_alg, str(session_id)]).encode("utf-8")).hexdigest()
@@ -108,6 +110,7 @@ class Server(EventEmitter):
             fp.write(session)
 
     def start(self):
+        load_crypto_backend(self._crypto_alg, self.get_session_path())
         self.check_session()
         if isinstance(self._server, list):
             for i in range(len(self._server)):
@@ -117,6 +120,16 @@ class Server(EventEmitter):
             self._server.on("connection", self.on_connection)
             self._server.listen((self._host, self._port))
         current().add_timeout(6 * 60 * 60, self.check_session)
+        stats.register(self)
+
+    def stats(self):
+        return {
+            "host": self._host,
+            "port": self._port,
+            "session_count": len(self._sessions),
+            "crypto": get_backend_stats(),
+            "sessions": [session.stats() for session in self._sessions.values()],
+        }
 
     def on_connection(self, server, connection):
         connection.once("data", self.on_data)
@@ -260,11 +273,12 @@ class Server(EventEmitter):
                     self.emit_connection(self, connection, datas)
                     return
 
-                crypto = session.get_decrypt_crypto(crypto_time)
-                key = crypto.decrypt(key)
+                is_fresh = abs(crypto_time - time.time()) < 1800 and session.is_fresh_auth_time(crypto_time)
+                if is_fresh:
+                    crypto = session.get_decrypt_crypto(crypto_time)
+                    key = crypto.decrypt(key)
 
-                if abs(crypto_time - time.time()) < 1800 and session.get_last_auth_time() < crypto_time \
-                        and auth == sign_string(self._crypto_key.encode("utf-8") + key + session.auth_key + str(crypto_time).encode("utf-8")):
+                if is_fresh and auth == sign_string(self._crypto_key.encode("utf-8") + key + session.auth_key + str(crypto_time).encode("utf-8")):
                     if key in session._auth_cache:
                         logging.info("xstream connection auth reuse session closed %s %s %s", session_id, connection, time.time())
                         connection.close()
@@ -276,7 +290,7 @@ class Server(EventEmitter):
                     setattr(connection, "crypto_time", crypto_time)
                     connection.crypto.init_decrypt(crypto_time, key)
 
-                    crypto_time = int(time.time())
+                    crypto_time = session.get_fork_crypto_time()
                     key = connection.crypto.init_encrypt(crypto_time)
                     auth = sign_string(self._crypto_key.encode("utf-8") + key + session.auth_key + str(crypto_time).encode("utf-8"))
 
@@ -310,7 +324,7 @@ class Server(EventEmitter):
                                         session.start_key_exchange()
                                 current().add_timeout(random.randint(0, 3), on_timeout_start_key_exchange)
 
-                            connection._expried_seconds_timer = current().add_timeout(7200, connection.on_expried)
+                            connection._expried_seconds_timer = current_wheel().add_timeout(7200, connection.on_expried)
                         else:
                             conn.close()
                     current().add_async(add_connection, connection)
@@ -352,7 +366,7 @@ class Server(EventEmitter):
                     else:
                         logging.info("xstream session timeout close %s", session)
         finally:
-            current().add_timeout(120, self.on_check_session_timeout)
+            current_wheel().add_timeout(120, self.on_check_session_timeout)
 
     def on_session_close(self, session):
         if session.id in self._sessions and self._sessions[session.id] == session:
@@ -2,20 +2,21 @@
 #14-4-22
 # create by: snower
 
-import time
 import random
 import logging
 import base64
 import struct
 import pickle
 import socket
-from sevent import EventEmitter, current, tcp
+from sevent import EventEmitter, tcp
+from . import clock
 from .crypto import Crypto, rand_string
 from .connection import Connection
 from .center import Center
 from .stream import Stream
-from .frame import StreamFrame
+from .frame import StreamFrame, FramePool
 from .utils import format_data_len
+from .stats import Histogram
 
 STATUS_INITED = 0x01
 STATUS_OPENING = 0x02
@@ -25,6 +26,8 @@ ACTION_OPENING = 0x01
 ACTION_KEYEXCHANGE = 0x02
 
 class Session(EventEmitter):
+    AUTH_TIME_WINDOW = 120
+
     def __init__(self, session_id, auth_key, is_server=False, crypto=None, mss=None):
         super(Session, self).__init__()
 
@@ -37,6 +40,9 @@ class Session(EventEmitter):
         self._crypto = crypto
         self._current_crypto_key = b'0' * 64
         self._last_auth_time = 0
+        self._auth_times = set()
+        self._auth_time_floor = 0
+        self._fork_crypto_time = 0
         self._mss = mss
         self._key_exchanged = True
         self._key_exchanged_count = 1
@@ -44,9 +50,11 @@ class Session(EventEmitter):
         self._current_stream_id = 1 if is_server else 2
         self._connections = []
         self._streams = {}
+        self._frame_pool = FramePool()
         self._center = Center(self)
-        self._data_time = time.time()
+        self._data_time = clock.time()
         self._status = STATUS_INITED
+        self._ttfb_histogram = Histogram()
         self._controll_stream = self.create_stream(0, priority=1, capped=True, expried_time=0)
         self._controll_stream.on("data", self.on_controll_data)
         self._center.on("frame", self.on_frame)
@@ -89,10 +97,13 @@ class Session(EventEmitter):
             "crypto_desecret": list(self._crypto_desecret),
             "current_crypto_key": self._current_crypto_key,
             "last_auth_time": self._last_auth_time,
+            "auth_times": sorted(self._auth_times),
+            "auth_time_floor": self._auth_time_floor,
+            "fork_crypto_time": self._fork_crypto_time,
             "key_exchanged": self._key_exchanged,
             "key_exchanged_count": self._key_exchanged_count,
             "mss": self._mss,
-            "timestamp": time.time()
+            "timestamp": clock.time()
         })).decode("utf-8")
 
     @classmethod
@@ -105,6 +116,9 @@ class Session(EventEmitter):
             session = cls(s["session_id"], s["auth_key"], s["is_server"], crypto, s["mss"])
             session._current_crypto_key = s["current_crypto_key"]
             session._last_auth_time = int(s.get("last_auth_time", 0))
+            session._auth_times = set(s.get("auth_times", [session._last_auth_time]))
+            session._auth_time_floor = int(s.get("auth_time_floor", session._last_auth_time))
+            session._fork_crypto_time = int(s.get("fork_crypto_time", 0))
             session._key_exchanged = s.get("key_exchanged", True)
             session._key_exchanged_count = int(s.get("key_exchanged_count", 1))
             if not s["is_server"] and not session._key_exchanged:
@@ -117,10 +131,21 @@ class Session(EventEmitter):
         return self._last_auth_time
 
     def set_last_auth_time(self, last_auth_time):
-        if last_auth_time < self._last_auth_time:
+        self._auth_times.add(last_auth_time)
+        if last_auth_time <= self._last_auth_time:
             return
 
         self._last_auth_time = last_auth_time
+        if last_auth_time - self.AUTH_TIME_WINDOW > self._auth_time_floor:
+            self._auth_time_floor = last_auth_time - self.AUTH_TIME_WINDOW
+            self._auth_times = {auth_time for auth_time in self._auth_times if auth_time > self._auth_time_floor}
+
+    def is_fresh_auth_time(self, crypto_time):
+        return crypto_time > self._auth_time_floor and crypto_time not in self._auth_times
+
+    def get_fork_crypto_time(self):
+        self._fork_crypto_time = max(int(clock.time()), self._fork_crypto_time + 1)
+        return self._fork_crypto_time
 
     def get_encrypt_crypto(self, crypto_time):
         self._crypto.init_encrypt(crypto_time, self._crypto_ensecret, self._current_crypto_key)
@@ -188,9 +213,9 @@ class Session(EventEmitter):
                         self.do_close()
 
                 if self._status == STATUS_OPENING:
-                    current().add_timeout(15 * 60, on_exit)
+                    clock.current().add_timeout(15 * 60, on_exit)
                 else:
-                    current().add_async(on_exit)
+                    clock.current().add_async(on_exit)
 
         self.update_mss()
         return connection
@@ -218,8 +243,8 @@ class Session(EventEmitter):
                         self.create_stream(stream_frame.stream_id, priority=priority, capped=capped)
                 elif stream_frame.flag & 0x04 != 0:
                     data = rand_string(random.randint(1, 64))
-                    frame = StreamFrame(stream_frame.stream_id, 0x04, 0, data)
-                    frame.send_time = time.time()
+                    frame = self._frame_pool.stream_frame(stream_frame.stream_id, 0x04, 0, data)
+                    frame.send_time = clock.time()
                     self.write(frame)
             else:
                 if stream_frame.flag & 0x02 != 0:
@@ -263,7 +288,7 @@ class Session(EventEmitter):
         if callable(callback):
             callback(self, stream)
         if self._status == STATUS_CLOSED:
-            current().add_async(stream.do_close)
+            clock.current().add_async(stream.do_close)
         return stream
 
     def close_stream(self, stream):
@@ -276,14 +301,14 @@ class Session(EventEmitter):
     def ready_write(self, stream, is_ready=True):
         if self._status == STATUS_CLOSED:
             if stream.id in self._streams:
-                current().add_async(stream.do_close)
+                clock.current().add_async(stream.do_close)
             return False
         return self._center.ready_write(stream, is_ready)
 
     def write(self, frame):
         if self._status == STATUS_CLOSED:
             if frame.stream_id in self._streams:
-                current().add_async(self._streams[frame.stream_id].do_close)
+                clock.current().add_async(self._streams[frame.stream_id].do_close)
             return False
         
         self._data_time = frame.send_time
@@ -322,7 +347,7 @@ class Session(EventEmitter):
                 self.write_action(ACTION_KEYEXCHANGE, data, True)
                 self._key_exchanged = True
                 self._key_exchanged_count += 1
-                self._key_exchanged_time = time.time()
+                self._key_exchanged_time = clock.time()
                 self._auth_cache = {}
                 self.emit_keyexchange(self)
                 logging.info("xstream session %s finish %s key exchange", self, self._key_exchanged_count - 1)
@@ -331,7 +356,7 @@ class Session(EventEmitter):
             self._current_crypto_key = data[5:69]
             self._key_exchanged = True
             self._key_exchanged_count += 1
-            self._key_exchanged_time = time.time()
+            self._key_exchanged_time = clock.time()
             self._auth_cache = {}
             self.emit_keyexchange(self)
             logging.info("xstream session %s finish %s key exchange", self, self._key_exchanged_count - 1)
@@ -380,7 +405,7 @@ class Session(EventEmitter):
         if self._connections:
             for connection in self._connections:
                 if connection._connection and connection._connection._state == tcp.STATE_CLOSED:
-                    current().add_async(self.remove_connection, connection._connection)
+                    clock.current().add_async(self.remove_connection, connection._connection)
                 else:
                     connection.close()
         else:
@@ -399,6 +424,29 @@ class Session(EventEmitter):
             address.append((connection._connection.address, "%.2fms" % connection._ttl))
         return "%s %s %s" % (format_data_len(rdata_len), format_data_len(wdata_len), address)
 
+    def stats(self):
+        connections = [connection.stats() for connection in self._connections]
+        return {
+            "id": self._session_id,
+            "is_server": self._is_server,
+            "status": self._status,
+            "key_exchanged": self._key_exchanged,
+            "key_exchanged_count": self._key_exchanged_count,
+            "key_exchanged_time": self._key_exchanged_time,
+            "mss": self._mss,
+            "data_time": self._data_time,
+            "rdata_len": self._rdata_len + sum(connection["rdata_len"] for connection in connections),
+            "wdata_len": self._wdata_len + sum(connection["wdata_len"] for connection in connections),
+            "rpdata_count": self._rpdata_count + sum(connection["rpdata_count"] for connection in connections),
+            "wpdata_count": self._wpdata_count + sum(connection["wpdata_count"] for connection in connections),
+            "rfdata_count": self._rfdata_count + sum(connection["rfdata_count"] for connection in connections),
+            "wfdata_count": self._wfdata_count + sum(connection["wfdata_count"] for connection in connections),
+            "ttfb_histogram": self._ttfb_histogram.stats(),
+            "center": self._center.stats() if self._center else None,
+            "connections": connections,
+            "streams": [stream.stats() for stream in self._streams.values()],
+        }
+
     def __del__(self):
         self.close()
 
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import os
+import math
+import socket
+import logging
+from sevent import tcp, instance
+from sevent.loop import MODE_IN
+
+STATS_SOCKET = os.environ.get("XSTREAM_STATS_SOCKET", "")
+
+class Histogram(object):
+    SUB_BUCKETS = 8
+    MIN_EXPONENT = -6
+    MAX_EXPONENT = 24
+    BUCKET_COUNT = (MAX_EXPONENT - MIN_EXPONENT + 1) * SUB_BUCKETS + 2
+    PERCENTILES = (("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9))
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value):
+        if value <= 0:
+            index = 0
+        else:
+            mantissa, exponent = math.frexp(value)
+            if exponent < self.MIN_EXPONENT:
+                index = 0
+            elif exponent > self.MAX_EXPONENT:
+                index = self.BUCKET_COUNT - 1
+            else:
+                index = (exponent - self.MIN_EXPONENT) * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS) + 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def get_upper_bound(self, index):
+        if index == 0:
+            return math.ldexp(0.5, self.MIN_EXPONENT)
+        if index == self.BUCKET_COUNT - 1:
+            return float("inf")
+        exponent, sub_bucket = divmod(index - 1, self.SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub_bucket + 1) / (2.0 * self.SUB_BUCKETS), exponent + self.MIN_EXPONENT)
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        target, count = max(int(math.ceil(self.count * p / 100.0)), 1), 0
+        for index, bucket_count in enumerate(self.counts):
+            count += bucket_count
+            if count >= target:
+                return min(self.get_upper_bound(index), self.max)
+        return self.max
+
+    def clear(self):
+        self.counts = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def stats(self):
+        stats = {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "mean": self.sum / self.count if self.count else 0,
+        }
+        for key, p in self.PERCENTILES:
+            stats[key] = self.percentile(p)
+        return stats
+
+SESSION_METRICS = (
+    ("rdata_len", "xstream_session_read_bytes_total", "counter"),
+    ("wdata_len", "xstream_session_write_bytes_total", "counter"),
+    ("rfdata_count", "xstream_session_read_frames_total", "counter"),
+    ("wfdata_count", "xstream_session_write_frames_total", "counter"),
+)
+
+CENTER_METRICS = (
+    ("droped_count", "xstream_center_droped_frames_total", "counter"),
+    ("resended_count", "xstream_center_resended_frames_total", "counter"),
+    ("sframe_count", "xstream_center_send_frames_total", "counter"),
+    ("rframe_count", "xstream_center_recv_frames_total", "counter"),
+    ("ack_count", "xstream_center_ack_frames_total", "counter"),
+    ("ttl", "xstream_center_ttl_milliseconds", "gauge"),
+    ("frames", "xstream_center_queued_frames", "gauge"),
+    ("send_frames", "xstream_center_inflight_frames", "gauge"),
+    ("recv_frames", "xstream_center_reorder_frames", "gauge"),
+    ("ready_streams", "xstream_center_ready_streams", "gauge"),
+)
+
+CONNECTION_METRICS = (
+    ("ttl", "xstream_connection_ttl_milliseconds", "gauge"),
+    ("srtt", "xstream_connection_srtt_milliseconds", "gauge"),
+    ("wrate", "xstream_connection_write_rate_bytes", "gauge"),
+    ("rdata_len", "xstream_connection_read_bytes_total", "counter"),
+    ("wdata_len", "xstream_connection_write_bytes_total", "counter"),
+    ("cwnd", "xstream_connection_cwnd_frames", "gauge"),
+    ("lost_count", "xstream_connection_lost_frames_total", "counter"),
+)
+
+SESSION_HISTOGRAMS = (
+    ("ttfb_histogram", "xstream_session_stream_ttfb_milliseconds"),
+)
+
+CENTER_HISTOGRAMS = (
+    ("ack_histogram", "xstream_center_ack_milliseconds"),
+    ("reorder_histogram", "xstream_center_reorder_wait_milliseconds"),
+)
+
+CONNECTION_HISTOGRAMS = (
+    ("rtt_histogram", "xstream_connection_ping_rtt_milliseconds"),
+)
+
+def format_labels(labels):
+    return ",".join(['%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for key, value in labels])
+
+def format_prometheus(sessions):
+    metrics = {}
+
+    def add(name, metric_type, labels, value):
+        if name not in metrics:
+            metrics[name] = (metric_type, [])
+        metrics[name][1].append("%s{%s} %s" % (name, format_labels(labels), repr(float(value))))
+
+    def add_summary(name, labels, histogram):
+        for key, p in Histogram.PERCENTILES:
+            add(name, "summary", labels + [("quantile", "%g" % (p / 100.0))], histogram[key])
+        metrics[name][1].append("%s_sum{%s} %s" % (name, format_labels(labels), repr(float(histogram["sum"]))))
+        metrics[name][1].append("%s_count{%s} %s" % (name, format_labels(labels), repr(float(histogram["count"]))))
+
+    for role, session in sessions:
+        session_labels = [("role", role), ("session", session["id"])]
+        add("xstream_session_connections", "gauge", session_labels, len(session["connections"]))
+        add("xstream_session_streams", "gauge", session_labels, len(session["streams"]))
+        for key, name, metric_type in SESSION_METRICS:
+            add(name, metric_type, session_labels, session[key])
+        for key, name in SESSION_HISTOGRAMS:
+            add_summary(name, session_labels, session[key])
+        if session["center"]:
+            for key, name, metric_type in CENTER_METRICS:
+                add(name, metric_type, session_labels, session["center"][key])
+            for key, name in CENTER_HISTOGRAMS:
+                add_summary(name, session_labels, session["center"][key])
+        for connection in session["connections"]:
+            address = connection["address"]
+            connection_labels = session_labels + [("address", "%s:%s" % tuple(address[:2]) if address else "")]
+            for key, name, metric_type in CONNECTION_METRICS:
+                if key in connection:
+                    add(name, metric_type, connection_labels, connection[key])
+            for key, name in CONNECTION_HISTOGRAMS:
+                add_summary(name, connection_labels, connection[key])
+
+    lines = []
+    for name, (metric_type, values) in sorted(metrics.items()):
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        lines.extend(values)
+    return "\n".join(lines) + "\n"
+
+class PrometheusExporter(object):
+    def __init__(self, path):
+        self.path = path
+        self.targets = []
+        self.socket = None
+        self.loop = None
+
+    def register(self, target):
+        if target not in self.targets:
+            self.targets.append(target)
+
+    def unregister(self, target):
+        if target in self.targets:
+            self.targets.remove(target)
+
+    def get_sessions(self):
+        sessions = []
+        for target in self.targets:
+            stats = target.stats()
+            if "sessions" in stats:
+                sessions.extend([("server", session) for session in stats["sessions"]])
+            elif stats.get("session"):
+                sessions.append(("client", stats["session"]))
+        return sessions
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen(16)
+        self.socket.setblocking(False)
+        self.loop = instance()
+        self.loop.add_fd(self.socket.fileno(), MODE_IN, self.on_accept)
+        logging.info("xstream stats exporter listen %s", self.path)
+
+    def on_accept(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except Exception as e:
+                logging.info("xstream stats exporter accept error %s", e)
+                return
+
+            connection = tcp.Socket(self.loop, conn, (self.path, 0))
+            connection.once("data", self.on_data)
+            self.loop.add_timeout(5, connection.close)
+
+    def on_data(self, connection, buffer):
+        buffer.read()
+        try:
+            body = format_prometheus(self.get_sessions()).encode("utf-8")
+        except Exception as e:
+            logging.exception("xstream stats exporter error %s", e)
+            body = b""
+        connection.write(b"".join([b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n",
+                                   b"Content-Length: ", str(len(body)).encode("utf-8"), b"\r\n\r\n", body]))
+        connection.end()
+
+    def close(self):
+        if self.socket is None:
+            return
+        self.loop.remove_fd(self.socket.fileno(), self.on_accept)
+        self.socket.close()
+        self.socket = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+_exporter = None
+
+def register(target):
+    global _exporter
+    if not STATS_SOCKET:
+        return None
+    if _exporter is None:
+        _exporter = PrometheusExporter(STATS_SOCKET)
+        _exporter.start()
+    _exporter.register(target)
+    return _exporter
@@ -2,16 +2,15 @@
 #14-4-22
 # create by: snower
 
-import time
 import random
-import math
 import logging
 import bisect
 from collections import deque
-from sevent import EventEmitter, current, Buffer
-from .frame import StreamFrame
+from sevent import EventEmitter, Buffer
+from . import clock
 from .crypto import rand_string
 from .utils import format_data_len
+from .timer import current_wheel
 
 STATE_INITED = 0x01
 STATE_OPENED = 0x02
@@ -25,17 +24,18 @@ FLAG_CAPPED = 0x20
 FLAG_NONE_EXPRIED = 0x40
 
 class Stream(EventEmitter):
-    def __init__(self, stream_id, session, is_server=False, priority=0, capped=False, expried_time=900):
+    def __init__(self, stream_id, session, is_server=False, priority=0, capped=False, expried_time=900, weight=1):
         super(Stream, self).__init__()
 
-        now = time.time()
+        now = clock.time()
 
-        self.loop = current()
+        self.loop = clock.current()
         self._stream_id = stream_id
         self._session = session
         self._is_server = is_server
         self._priority = priority
         self._capped = capped
+        self._weight = max(int(weight), 1)
         self._state = STATE_INITED if not is_server else STATE_OPENED
         self._expried_time = expried_time
         self._start_time = now
@@ -57,7 +57,7 @@ class Stream(EventEmitter):
         self._recv_wait_emit = False
 
         if self._expried_time:
-            self._expried_timer = self.loop.add_timeout(self._expried_time / 5.0, self.on_time_out_loop)
+            self._expried_timer = current_wheel().add_timeout(self._expried_time / 5.0, self.on_time_out_loop)
         else:
             self._expried_timer = None
 
@@ -65,23 +65,15 @@ class Stream(EventEmitter):
     def id(self):
         return self._stream_id
 
-    @property
-    def priority(self):
-        if self._priority != 0:
-            return 0
-
-        t = time.time()
-        p = self._send_frame_count * 2.0 / (1 + math.sqrt(t - self._start_time))
-        if self._send_is_set_ready:
-            if t - self._send_time > 30:
-                return 0
-            return p / ((1 + t - self._send_time) ** 2)
-        return p
-
     @property
     def capped(self):
         return self._capped
 
+    @property
+    def weight(self):
+        # weight is not sent to the peer, it only shares this side's send direction
+        return self._weight
+
     @property
     def buffer(self):
         return (self._recv_buffer, self._send_buffer)
@@ -99,6 +91,7 @@ class Stream(EventEmitter):
             return
 
         if frame.index != self._recv_index:
+            frame.detach()
             if not self._recv_frames or frame.index >= self._recv_frames[-1].index:
                 self._recv_frames.append(frame)
             else:
@@ -127,10 +120,12 @@ class Stream(EventEmitter):
             self._recv_index += 1
 
     def on_read(self, frame):
+        if not self._recv_data_len and not self._is_server:
+            self._session._ttfb_histogram.record((frame.recv_time - self._start_time) * 1000)
         if not self._recv_wait_emit:
             self._recv_wait_emit = True
             self.loop.add_async(self.on_data)
-        self._recv_buffer.write(frame.data)
+        self._recv_buffer.write(bytes(frame.data))
         self._recv_frame_count += 1
         self._recv_data_len += len(frame.data)
         self._recv_time = frame.recv_time
@@ -153,7 +148,7 @@ class Stream(EventEmitter):
 
         if self._send_frames:
             frame = self._send_frames.popleft()
-            frame.send_time = time.time()
+            frame.send_time = clock.time()
             if self._state == STATE_INITED:
                 frame.flag |= FLAG_OPEN
                 if self._priority != 0:
@@ -175,23 +170,24 @@ class Stream(EventEmitter):
         return self._send_is_set_ready
         
     def flush(self, flush_all=False):
+        frame_pool = self._session._frame_pool
         if self._capped:
             for _ in range(64):
                 if not self._send_buffer:
                     break
-                frame = StreamFrame(self._stream_id, 0x01, self._send_index, self._send_buffer.next())
+                frame = frame_pool.stream_frame(self._stream_id, 0x01, self._send_index, self._send_buffer.next())
                 self._send_index += 1
                 self._send_frames.append(frame)
         else:
             for _ in range(64):
                 blen = len(self._send_buffer)
                 if blen >= self._session._mss:
-                    frame = StreamFrame(self._stream_id, 0x01, self._send_index, self._send_buffer.read(self._session._mss))
+                    frame = frame_pool.stream_frame(self._stream_id, 0x01, self._send_index, self._send_buffer.read(self._session._mss))
                     self._send_index += 1
                     self._send_frames.append(frame)
                     continue
                 elif blen > 0 and (not self._send_frames or flush_all):
-                    frame = StreamFrame(self._stream_id, 0x01, self._send_index, self._send_buffer.read(-1))
+                    frame = frame_pool.stream_frame(self._stream_id, 0x01, self._send_index, self._send_buffer.read(-1))
                     self._send_index += 1
                     self._send_frames.append(frame)
                 break
@@ -205,16 +201,16 @@ class Stream(EventEmitter):
         else:
             self._send_buffer.write(data)
         if not self._send_is_set_ready:
-            self._send_time = time.time()
+            self._send_time = clock.time()
             self._send_is_set_ready = True
             if not self._session.ready_write(self):
                 self.loop.add_async(self.do_close)
 
     def write_action(self, action, data=b''):
         data += rand_string(random.randint(1, 128))
-        frame = StreamFrame(self._stream_id, action, self._send_index, data)
+        frame = self._session._frame_pool.stream_frame(self._stream_id, action, self._send_index, data)
         self._send_index += 1
-        frame.send_time = time.time()
+        frame.send_time = clock.time()
         self.loop.add_async(self._session.write, frame)
 
     def on_action(self, frame):
@@ -252,7 +248,7 @@ class Stream(EventEmitter):
             frame.flag |= FLAG_CLOSE
 
             if not self._send_is_set_ready and self._send_frames:
-                self._send_time = time.time()
+                self._send_time = clock.time()
                 self._send_is_set_ready = True
                 if not self._session.ready_write(self):
                     return self.do_close()
@@ -281,22 +277,40 @@ class Stream(EventEmitter):
                 self.remove_all_listeners()
                 self._session = None
             if self._expried_timer:
-                self.loop.cancel_timeout(self._expried_timer)
+                current_wheel().cancel_timeout(self._expried_timer)
                 self._expried_timer = None
             logging.info("xstream session %s stream %s close %s(%s) %s(%s) %.2fms", session, self,
                          format_data_len(self._send_data_len), self._send_frame_count,
                          format_data_len(self._recv_data_len), self._recv_frame_count,
-                         (time.time() - self._start_time) * 1000)
+                         (clock.time() - self._start_time) * 1000)
         self.loop.add_async(do_close)
 
     def on_time_out_loop(self):
         if self._state == STATE_CLOSED or self._expried_time == 0:
             return
 
-        if time.time() - max(self._send_time, self._recv_time) > self._expried_time:
+        if clock.time() - max(self._send_time, self._recv_time) > self._expried_time:
             self.close()
         else:
-            self._expried_timer = self.loop.add_timeout(self._expried_time / 5.0, self.on_time_out_loop)
+            self._expried_timer = current_wheel().add_timeout(self._expried_time / 5.0, self.on_time_out_loop)
+
+    def stats(self):
+        return {
+            "id": self._stream_id,
+            "state": self._state,
+            "priority": self._priority,
+            "capped": self._capped,
+            "weight": self._weight,
+            "start_time": self._start_time,
+            "send_data_len": self._send_data_len,
+            "send_frame_count": self._send_frame_count,
+            "send_buffer_len": len(self._send_buffer),
+            "send_time": self._send_time,
+            "recv_data_len": self._recv_data_len,
+            "recv_frame_count": self._recv_frame_count,
+            "recv_buffer_len": len(self._recv_buffer),
+            "recv_time": self._recv_time,
+        }
 
     def __del__(self):
         self.close()
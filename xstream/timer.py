@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# 26/10/18
+# create by: snower
+
+import logging
+import weakref
+from . import clock
+
+class TimerHandler(object):
+    __slots__ = ("callback", "deadline", "expire_tick", "args", "kwargs")
+
+    def __init__(self, callback, deadline, args, kwargs):
+        self.callback = callback
+        self.deadline = deadline
+        self.expire_tick = 0
+        self.args = args
+        self.kwargs = kwargs
+
+    @property
+    def canceled(self):
+        return self.callback is None
+
+class TimerWheel(object):
+    def __init__(self, loop, tick=0.1, size=1024):
+        self.loop = weakref.proxy(loop)
+        self.tick = tick
+        self.size = size
+        self.mask = size - 1
+        self.slots = [set() for _ in range(size)]
+        self.current_tick = int(clock.time() / tick)
+        self.count = 0
+        self.timer = None
+        self.timer_tick = 0
+
+    def add_timeout(self, timeout, callback, *args, **kwargs):
+        now = clock.time()
+        if not self.count:
+            self.current_tick = int(now / self.tick)
+
+        handler = TimerHandler(callback, now + timeout, args, kwargs)
+        expire_tick = int(handler.deadline / self.tick) + 1
+        if expire_tick <= self.current_tick:
+            expire_tick = self.current_tick + 1
+        handler.expire_tick = expire_tick
+        self.slots[expire_tick & self.mask].add(handler)
+        self.count += 1
+
+        if self.timer is None or expire_tick < self.timer_tick:
+            self.arm_timer(expire_tick, now)
+        return handler
+
+    def cancel_timeout(self, handler):
+        if handler is None or handler.callback is None:
+            return
+
+        try:
+            self.slots[handler.expire_tick & self.mask].remove(handler)
+            self.count -= 1
+        except KeyError:
+            pass
+        handler.callback = None
+        handler.args = None
+        handler.kwargs = None
+
+    def arm_timer(self, expire_tick, now):
+        if self.timer is not None:
+            self.loop.cancel_timeout(self.timer)
+        self.timer_tick = expire_tick
+        self.timer = self.loop.add_timeout(max(expire_tick * self.tick - now, 0), self.on_tick)
+
+    def get_next_tick(self):
+        for tick in range(self.current_tick + 1, self.current_tick + 1 + self.size):
+            for handler in self.slots[tick & self.mask]:
+                if handler.expire_tick == tick:
+                    return tick
+        return min((handler.expire_tick for slot in self.slots for handler in slot), default=0)
+
+    def on_tick(self):
+        now_tick = max(int(clock.time() / self.tick), self.timer_tick)
+        if now_tick > self.current_tick:
+            expired_handlers = []
+            for tick in range(self.current_tick + 1, self.current_tick + 1 + min(now_tick - self.current_tick, self.size)):
+                slot = self.slots[tick & self.mask]
+                if not slot:
+                    continue
+
+                handlers = [handler for handler in slot if handler.expire_tick <= now_tick]
+                for handler in handlers:
+                    slot.remove(handler)
+                expired_handlers.extend(handlers)
+            self.current_tick = now_tick
+            self.count -= len(expired_handlers)
+
+            expired_handlers.sort(key=lambda h: h.deadline)
+            for handler in expired_handlers:
+                if handler.callback is None:
+                    continue
+                try:
+                    handler.callback(*handler.args, **handler.kwargs)
+                except Exception as e:
+                    logging.exception("timer wheel callback error: %s", e)
+
+        self.timer = None
+        if self.count:
+            next_tick = self.get_next_tick()
+            if next_tick:
+                self.arm_timer(next_tick, clock.time())
+
+_timer_wheels = weakref.WeakKeyDictionary()
+
+def current_wheel():
+    loop = clock.current()
+    try:
+        return _timer_wheels[loop]
+    except KeyError:
+        timer_wheel = _timer_wheels[loop] = TimerWheel(loop)
+        return timer_wheel
+
+def add_timeout(timeout, callback, *args, **kwargs):
+    timer_wheel = current_wheel()
+    if timeout < timer_wheel.tick * 10:
+        return timer_wheel.loop.add_timeout(timeout, callback, *args, **kwargs)
+    return timer_wheel.add_timeout(timeout, callback, *args, **kwargs)